@@ -0,0 +1,238 @@
+from airlift.envs.airlift_env import ObservationHelper
+from solution.common import PathCache, PlaneTypeMap
+from solution.evaluation import PlanEvaluator
+from solution.matrixcache import MatrixCache
+from solution.routing import NextHopTable
+from solution.strategic import Model
+from collections import namedtuple
+import contextlib
+import io
+import json
+import math
+import random
+import statistics
+import sys
+import tempfile
+import time
+import click
+import networkx as nx
+
+# only the fields the planner reads from the observation
+Cargo = namedtuple('Cargo', 'id location destination weight earliest_pickup_time is_available soft_deadline hard_deadline')
+ScenarioInfo = namedtuple('ScenarioInfo', 'processing_time')
+
+PROCESSING_TIME = 10
+
+
+def make_obs(airports, plane_types, planes, cargo, seed, new_cargo=0):
+    """Observation shaped input: a route map per plane type (each type flies to more neighbours than the previous one),
+    agents spread over the airports and cargo with random origin, destination and deadlines"""
+    rng = random.Random(seed)
+    positions = {airport: (rng.random(), rng.random()) for airport in range(1, airports + 1)}
+    route_map = {}
+    for plane_type in range(plane_types):
+        graph = nx.DiGraph()
+        graph.add_nodes_from(positions)
+        for airport, position in positions.items():
+            neighbours = sorted((math.dist(position, other_position), other)
+                                for other, other_position in positions.items() if other != airport)
+            for distance, other in neighbours[:3 + plane_type]:
+                travel_time = max(1, int(distance * 200))
+                for orig, dest in ((airport, other), (other, airport)):
+                    graph.add_edge(orig, dest, cost=travel_time * (1 + plane_type), time=travel_time,
+                                   route_available=True, mal=0)
+        route_map[plane_type] = graph
+
+    def create_cargo(cargo_id, start):
+        location, destination = rng.sample(list(positions), 2)
+        return Cargo(cargo_id, location, destination, rng.randint(1, 3), start, True, start + 1500, start + 3000)
+
+    global_state = {
+        'route_map': route_map,
+        'active_cargo': [create_cargo(cargo_id, 0) for cargo_id in range(cargo)],
+        'event_new_cargo': [create_cargo(cargo + i, 100) for i in range(new_cargo)],
+        'scenario_info': [ScenarioInfo(PROCESSING_TIME)],
+    }
+    obs = {}
+    for plane in range(planes):
+        airport = rng.choice(list(positions))
+        obs['a_{}'.format(plane)] = {
+            'globalstate': global_state,
+            'plane_type': plane % plane_types,
+            'current_airport': airport,
+            'cargo_at_current_airport': [c.id for c in global_state['active_cargo'] if c.location == airport],
+            'max_weight': 5,
+        }
+    return obs
+
+
+def without_new_cargo(obs):
+    global_state = dict(next(iter(obs.values()))['globalstate'], event_new_cargo=[])
+    return {a_id: dict(agent, globalstate=global_state) for a_id, agent in obs.items()}
+
+
+def bench_create_planning(obs, seed):
+    model = Model()
+    start = time.perf_counter()
+    model.create_planning(without_new_cargo(obs))
+    return time.perf_counter() - start
+
+
+def bench_update_planning(obs, seed):
+    model = Model()
+    model.create_planning(without_new_cargo(obs))
+    start = time.perf_counter()
+    model.update_planning(obs)
+    return time.perf_counter() - start
+
+
+def bench_path_cache_build(obs, seed):
+    graph = ObservationHelper.get_multidigraph(next(iter(obs.values()))['globalstate'])
+    start = time.perf_counter()
+    PathCache(graph)
+    return time.perf_counter() - start
+
+
+def bench_next_hop_build(obs, seed):
+    route_map = next(iter(obs.values()))['globalstate']['route_map']
+    start = time.perf_counter()
+    for graph in route_map.values():
+        NextHopTable(graph)
+    return time.perf_counter() - start
+
+
+def bench_matrix_cache_load(obs, seed):
+    # reset on route maps that were seen before: path matrices and reachability labels from the disk cache
+    global_state = next(iter(obs.values()))['globalstate']
+    graph = ObservationHelper.get_multidigraph(global_state)
+    with tempfile.TemporaryDirectory() as directory:
+        cache = MatrixCache(directory)
+        PathCache(graph, cache=cache)
+        PlaneTypeMap(global_state['route_map'], cache=cache)
+        start = time.perf_counter()
+        PathCache(graph, cache=cache)
+        PlaneTypeMap(global_state['route_map'], cache=cache)
+        return time.perf_counter() - start
+
+
+def bench_path_cache_queries(obs, seed, queries=1000):
+    graph = ObservationHelper.get_multidigraph(next(iter(obs.values()))['globalstate'])
+    paths = PathCache(graph)
+    rng = random.Random(seed)
+    nodes = list(graph.nodes)
+    pairs = [(rng.choice(nodes), rng.choice(nodes)) for _ in range(queries)]
+    start = time.perf_counter()
+    for orig, dest in pairs:
+        paths.get_travel_time(orig, dest)
+        paths.get_path(orig, dest)
+    return time.perf_counter() - start
+
+
+def bench_update_ep_lp(obs, seed):
+    model = Model()
+    planning = model.create_planning(without_new_cargo(obs))
+    planned = [ce for ce in planning.cargo_edges.cargo_edges if planning.is_assigned(ce.cargo_id, ce.sequence)]
+    start = time.perf_counter()
+    for ce in planned:
+        model.update_ep_lp(ce)
+    return time.perf_counter() - start
+
+
+def bench_evaluate_plan(obs, seed, evaluations=100):
+    model = Model()
+    planning = model.create_planning(without_new_cargo(obs))
+    evaluator = PlanEvaluator(model.paths, model.processing_time, model.plane_type_map)
+    start = time.perf_counter()
+    for _ in range(evaluations):
+        evaluator.evaluate(planning, 0)
+    return time.perf_counter() - start
+
+
+BENCHMARKS = {
+    'create_planning': bench_create_planning,
+    'update_planning': bench_update_planning,
+    'path_cache_build': bench_path_cache_build,
+    'next_hop_build': bench_next_hop_build,
+    'matrix_cache_load': bench_matrix_cache_load,
+    'path_cache_queries': bench_path_cache_queries,
+    'update_ep_lp': bench_update_ep_lp,
+    'evaluate_plan': bench_evaluate_plan,
+}
+
+
+def run_benchmarks(names, scales, airports, plane_types, planes, cargo, new_cargo, repeat, seed):
+    # median and min wall time in ms per (scale, benchmark)
+    results = {}
+    for scale in scales:
+        obs = make_obs(airports * scale, plane_types, planes * scale, cargo * scale, seed, new_cargo * scale)
+        for name in names:
+            # the planner prints what it could not plan, keep that out of the timings
+            with contextlib.redirect_stdout(io.StringIO()):
+                timings = [BENCHMARKS[name](obs, seed + i) * 1000 for i in range(repeat)]
+            results['{}/{}'.format(scale, name)] = {'median_ms': statistics.median(timings), 'min_ms': min(timings)}
+            print('scale {:>3}  {:<20} median {:10.3f} ms  min {:10.3f} ms'.format(
+                scale, name, statistics.median(timings), min(timings)))
+    return results
+
+
+def compare(results, baseline, tolerance):
+    # benchmarks whose median is more than tolerance (relative) slower than the baseline
+    regressions = []
+    for key, result in results.items():
+        if key not in baseline:
+            continue
+        ratio = result['median_ms'] / max(baseline[key]['median_ms'], 1e-9)
+        marker = 'REGRESSION' if ratio > 1 + tolerance else ''
+        print('{:<28} {:10.3f} ms -> {:10.3f} ms  x{:.2f} {}'.format(
+            key, baseline[key]['median_ms'], result['median_ms'], ratio, marker))
+        if marker:
+            regressions.append(key)
+    return regressions
+
+
+@click.command()
+@click.option('--benchmark',
+              'names',
+              multiple=True,
+              type=click.Choice(list(BENCHMARKS)),
+              help='Benchmark to run, can be repeated (default: all)')
+@click.option('--scales',
+              default="1,2,4",
+              help='Comma separated multipliers for the number of airports, planes and cargo')
+@click.option('--airports', type=int, default=20, help='Number of airports at scale 1')
+@click.option('--plane-types', type=int, default=2, help='Number of plane types')
+@click.option('--planes', type=int, default=6, help='Number of planes at scale 1')
+@click.option('--cargo', type=int, default=40, help='Number of cargo at scale 1')
+@click.option('--new-cargo', type=int, default=5, help='Number of new cargo for update_planning at scale 1')
+@click.option('--repeat', type=int, default=5, help='Number of timed runs per benchmark')
+@click.option('--seed', type=int, default=0, help='Seed for the synthetic instances')
+@click.option('--save-baseline',
+              type=click.Path(dir_okay=False),
+              help='Write the results to this json file')
+@click.option('--baseline',
+              type=click.Path(exists=True, dir_okay=False),
+              help='Compare the results with this json file, exits with 1 on a regression')
+@click.option('--tolerance',
+              type=float,
+              default=0.2,
+              help='Allowed relative slowdown of the median before it counts as a regression')
+def run_benchmark(names, scales, airports, plane_types, planes, cargo, new_cargo, repeat, seed, save_baseline, baseline,
+                  tolerance):
+    """Times the strategic planner on synthetic instances, without the simulator."""
+    config = dict(airports=airports, plane_types=plane_types, planes=planes, cargo=cargo, new_cargo=new_cargo,
+                  repeat=repeat, seed=seed)
+    results = run_benchmarks(names or list(BENCHMARKS), [int(scale) for scale in scales.split(',')], **config)
+    if save_baseline:
+        with open(save_baseline, 'w') as file:
+            json.dump({'config': config, 'results': results}, file, indent=2)
+    if baseline:
+        with open(baseline) as file:
+            stored = json.load(file)
+        if stored['config'] != config:
+            print("WARNING: baseline was made with {}".format(stored['config']))
+        if compare(results, stored['results'], tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    run_benchmark()
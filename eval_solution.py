@@ -1,12 +1,17 @@
 from airlift.evaluators.utils import doeval, doeval_single_episode
 from solution.mysolution import MySolution
+from solution.instrument import instrumentation, write_rows
+from solution.trace import LEVEL_NAMES, trace
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
 import os
+import re
 import time
 import click
 import csv
 
-def write_results(env_info, step_metrics):
-    timestr = time.strftime("%Y-%m-%d-%H%M%S")
+def write_results(env_info, step_metrics, timestr=None):
+    timestr = timestr or time.strftime("%Y-%m-%d-%H%M%S")
     with open("envinfo_{}.csv".format(timestr), 'w', newline='') as file:
         csvwriter = csv.writer(file)
         csvwriter.writerow(env_info._fields)
@@ -22,6 +27,89 @@ def write_results(env_info, step_metrics):
             csvwriter.writerow(step_metrics)
 
 
+def write_timings(timestr=None, rows=None, summary=None):
+    # per step planner timings and the step latency per episode, see solution/instrument.py
+    timestr = timestr or time.strftime("%Y-%m-%d-%H%M%S")
+    write_rows("timings_{}.csv".format(timestr), instrumentation.rows() if rows is None else rows)
+    write_rows("timings_summary_{}.csv".format(timestr), instrumentation.summary() if summary is None else summary)
+
+
+def _scenario_order(path):
+    # Test_2/Level_10.pkl sorts as (2, 10), not as text
+    return [int(part) if part.isdigit() else part for part in re.split(r'(\d+)', str(path))]
+
+
+def find_scenarios(folder):
+    return sorted(Path(folder).glob('**/*.pkl'), key=lambda path: _scenario_order(path.relative_to(folder)))
+
+
+def eval_episode(test_pkl_file, env_seed, solution_seed, instrument=False, background_replanning=False, cache_dir=None,
+                 event_driven=False, search_budget=0.0):
+    # runs in a worker process, every episode gets a fresh solution
+    instrumentation.enable(instrument)
+    instrumentation.episodes = []
+    returnval = doeval_single_episode(
+        test_pkl_file=str(test_pkl_file),
+        env_seed=env_seed,
+        solution=MySolution(background_replanning, cache_dir, event_driven, search_budget),
+        solution_seed=solution_seed)
+    row = episode_row(test_pkl_file, *returnval[:4])
+    return row, instrumentation.rows(), instrumentation.summary()
+
+
+def episode_row(test_pkl_file, env_info, metrics, time_taken, total_solution_time):
+    # a row of breakdown_results.csv as the serial evaluator writes it
+    row = {'test': test_pkl_file.parent.name, 'level': test_pkl_file.stem}
+    row.update(env_info._asdict())
+    row.update(metrics._asdict())
+    row['time_taken'] = time_taken
+    row['total_solution_time'] = total_solution_time
+    return row
+
+
+def doeval_parallel(folder, workers, start_solution_seed, env_seed, instrument=False, background_replanning=False,
+                    cache_dir=None, event_driven=False, search_budget=0.0):
+    # episode i uses solution seed start_solution_seed + i, whatever worker runs it
+    scenarios = find_scenarios(folder)
+    solution_seeds = [start_solution_seed + i for i in range(len(scenarios))]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(eval_episode, scenarios, [env_seed] * len(scenarios), solution_seeds,
+                                    [instrument] * len(scenarios), [background_replanning] * len(scenarios),
+                                    [cache_dir] * len(scenarios), [event_driven] * len(scenarios),
+                                    [search_budget] * len(scenarios)))
+    rows = [row for row, _, _ in results]
+    write_parallel_results(rows)
+    if instrument:
+        # renumber the episodes in scenario order
+        timings, summary = [], []
+        for episode, (_, episode_timings, episode_summary) in enumerate(results):
+            timings.extend(dict(timing, episode=episode) for timing in episode_timings)
+            summary.extend(dict(row, episode=episode) for row in episode_summary)
+        write_timings(rows=timings, summary=summary)
+    return rows
+
+
+def write_parallel_results(rows):
+    # the per episode rows, the aggregates go to a file of their own
+    if len(rows) == 0:
+        return
+    with open("breakdown_results.csv", 'w', newline='') as file:
+        csvwriter = csv.DictWriter(file, fieldnames=list(rows[0].keys()))
+        csvwriter.writeheader()
+        csvwriter.writerows(rows)
+    write_rows("parallel_summary.csv", summarize_results(rows))
+
+
+def summarize_results(rows):
+    # sum and mean of the numeric columns of the episode rows
+    numeric = [key for key, value in rows[0].items()
+               if isinstance(value, (int, float)) and not isinstance(value, bool)]
+    totals = {key: sum(row[key] for row in rows) for key in numeric}
+    means = {key: total / len(rows) for key, total in totals.items()}
+    return [dict({'statistic': 'sum', 'episodes': len(rows)}, **totals),
+            dict({'statistic': 'mean', 'episodes': len(rows)}, **means)]
+
+
 @click.command()
 @click.option('--scenarios',
               default="./scenarios",
@@ -47,16 +135,54 @@ def write_results(env_info, step_metrics):
 @click.option('--capture-step-metrics/--no-capture-step-metrics',
               default=False,
               help='Capture metrics for each step (only works wehn running a single pkl file)')
-def run_evaluation(scenarios, solution_seed, env_seed, render, render_sleep_time, render_mode, capture_step_metrics):
+@click.option('--workers',
+              type=int,
+              default=1,
+              help='Number of processes to evaluate a scenario folder with (1 runs the standard evaluator)')
+@click.option('--instrument/--no-instrument',
+              default=False,
+              help='Time the planner per step and write timings csv files')
+@click.option('--trace-level',
+              type=click.Choice([name.lower() for name in LEVEL_NAMES.values()]),
+              default="warning",
+              help='Print the decisions of the solution from this level on')
+@click.option('--trace-file',
+              type=click.Path(dir_okay=False),
+              help='Write all recorded decisions (info and up) to this file (not with --workers)')
+@click.option('--background-replanning/--no-background-replanning',
+              default=False,
+              help='Plan new cargo in a worker thread while the agents follow the current planning')
+@click.option('--cache-dir',
+              type=click.Path(file_okay=False),
+              help='Keep the shortest path matrices, next-hop tables and reachability labels in this folder for later runs')
+@click.option('--event-driven/--no-event-driven',
+              default=False,
+              help='Only decide again for agents whose observation or next leg changed since their last decision')
+@click.option('--search-budget',
+              type=float,
+              default=0.0,
+              help='Seconds per step to improve the planning with local search (0 disables it)')
+def run_evaluation(scenarios, solution_seed, env_seed, render, render_sleep_time, render_mode, capture_step_metrics, workers,
+                   instrument, trace_level, trace_file, background_replanning, cache_dir, event_driven, search_budget):
     """Evaluates solution against a set of scenario pkl files, or a single pkl file. csv files will be written with results."""
-    if os.path.isdir(scenarios):
-        doeval(scenarios, MySolution(), start_solution_seed=solution_seed)
+    instrumentation.enable(instrument)
+    level = {name.lower(): level for level, name in LEVEL_NAMES.items()}[trace_level]
+    trace.configure(level=min(level, trace.level), echo_level=level)
+    if trace_file:
+        trace.open(trace_file)
+    if os.path.isdir(scenarios) and workers > 1:
+        doeval_parallel(scenarios, workers, solution_seed, env_seed, instrument, background_replanning, cache_dir,
+                        event_driven, search_budget)
+    elif os.path.isdir(scenarios):
+        doeval(scenarios, MySolution(background_replanning, cache_dir, event_driven, search_budget), start_solution_seed=solution_seed)
+        if instrument:
+            write_timings()
     elif os.path.isfile(scenarios):
         returnval = \
             doeval_single_episode(
                 test_pkl_file=scenarios,
                 env_seed=env_seed,
-                solution=MySolution(),
+                solution=MySolution(background_replanning, cache_dir, event_driven, search_budget),
                 solution_seed=solution_seed,
                 render=render,
                 render_sleep_time=render_sleep_time,
@@ -67,7 +193,10 @@ def run_evaluation(scenarios, solution_seed, env_seed, render, render_sleep_time
             metrics = returnval[4]
         else:
             metrics = returnval[1]
-        write_results(env_info, metrics)
+        timestr = time.strftime("%Y-%m-%d-%H%M%S")
+        write_results(env_info, metrics, timestr)
+        if instrument:
+            write_timings(timestr)
     else:
         raise Exception("Scenarios not found")
 
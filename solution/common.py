@@ -1,8 +1,15 @@
 from __future__ import annotations
 
-from dataclasses import dataclass, field
-from typing import Dict, List, Optional, Set, Tuple
+import copy
+from collections import ChainMap
+from dataclasses import dataclass, field, replace
+from typing import Dict, Iterable, List, Optional, Set, Tuple
 import networkx as nx
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+
+from solution.matrixcache import MatrixCache, fingerprint
 
 BIG_TIME = 100_000
 
@@ -11,70 +18,570 @@ TW_OVERLAP_MARGIN = 15
 
 class PlaneTypeMap:
     # cache for travel time between 2 nodes
-    def __init__(self, route_map) -> None:
+    def __init__(self, route_map, cache: Optional[MatrixCache] = None) -> None:
         self.route_map = route_map
+        # per plane type: airport -> strongly connected component
+        self._components: Dict[int, Dict[int, int]] = {}
+        # per plane type: component -> bitset of the components it can reach
+        self._reachable_components: Dict[int, List[int]] = {}
+        # per plane type: the same as arrays, airport -> component (-1 if unknown) and
+        # a component x component reachability matrix
+        self._component_lookup: Dict[int, np.ndarray] = {}
+        self._reachability: Dict[int, np.ndarray] = {}
+        # (orig, dest) -> bit per plane type whose route map has the edge
+        self._edge_masks: Dict[Tuple[int, int], int] = {}
+        for plane_type in route_map:
+            self._index_edges(plane_type)
+        if cache is None:
+            for plane_type in route_map:
+                self.rebuild(plane_type)
+            return
+
+        key = fingerprint("reachability", route_map, attributes=())
+        arrays = cache.load(key)
+        if arrays is not None:
+            for plane_type in route_map:
+                self._restore(
+                    plane_type,
+                    arrays[f"lookup_{plane_type}"],
+                    arrays[f"reachability_{plane_type}"],
+                )
+            return
+        arrays = {}
+        for plane_type in route_map:
+            self.rebuild(plane_type)
+            arrays[f"lookup_{plane_type}"] = self._component_lookup[plane_type]
+            arrays[f"reachability_{plane_type}"] = self._reachability[plane_type]
+        cache.store(key, arrays)
+
+    def _restore(
+        self, plane_type: int, lookup: np.ndarray, reachability: np.ndarray
+    ) -> None:
+        # the labels of rebuild from its arrays
+        airports = np.flatnonzero(lookup >= 0)
+        self._components[plane_type] = dict(
+            zip(airports.tolist(), lookup[airports].tolist())
+        )
+        self._reachable_components[plane_type] = [
+            int.from_bytes(np.packbits(row, bitorder="little").tobytes(), "little")
+            for row in reachability
+        ]
+        self._component_lookup[plane_type] = lookup
+        self._reachability[plane_type] = reachability
+
+    def rebuild(self, plane_type: int, graph=None) -> None:
+        # recompute the reachability labels of one plane type after its route map changed
+        if graph is not None:
+            self.route_map[plane_type] = graph
+            self._index_edges(plane_type)
+        condensation = nx.condensation(self.route_map[plane_type])
+        reachable_components = [0] * condensation.number_of_nodes()
+        for component in reversed(list(nx.topological_sort(condensation))):
+            reachable = 1 << component
+            for successor in condensation.successors(component):
+                reachable |= reachable_components[successor]
+            reachable_components[component] = reachable
+        mapping = condensation.graph["mapping"]
+        self._components[plane_type] = mapping
+        self._reachable_components[plane_type] = reachable_components
+
+        lookup = np.full(max(mapping, default=0) + 1, -1, dtype=np.int64)
+        lookup[list(mapping.keys())] = list(mapping.values())
+        nr_components = len(reachable_components)
+        self._component_lookup[plane_type] = lookup
+        self._reachability[plane_type] = np.array(
+            [
+                [(reachable >> c) & 1 == 1 for c in range(nr_components)]
+                for reachable in reachable_components
+            ],
+            dtype=bool,
+        ).reshape(nr_components, nr_components)
+
+    def _index_edges(self, plane_type: int) -> None:
+        bit = 1 << plane_type
+        for edge in self._edge_masks:
+            self._edge_masks[edge] &= ~bit
+        for edge in self.route_map[plane_type].edges():
+            self._edge_masks[edge] = self._edge_masks.get(edge, 0) | bit
+
+    def plane_type_mask(self, orig: int, dest: int) -> int:
+        # bit per plane type that can fly the edge
+        return self._edge_masks.get((orig, dest), 0)
 
     def get_allowable_plane_types(self, orig: int, dest: int) -> Set[int]:
-        plane_types = set()
-        for pt, graph in self.route_map.items():
-            if graph.has_edge(orig, dest):
-                plane_types.add(pt)
-        return plane_types
+        return mask_plane_types(self.plane_type_mask(orig, dest))
 
     def reachable(self, plane_type: int, orig: int, dest: int) -> bool:
-        graph = self.route_map[plane_type]
-        return nx.has_path(graph, orig, dest)
+        components = self._components[plane_type]
+        if orig not in components or dest not in components:
+            return False
+        reachable = self._reachable_components[plane_type][components[orig]]
+        return (reachable >> components[dest]) & 1 == 1
+
+    def reachable_many(self, plane_type: int, origs, dests) -> np.ndarray:
+        # reachable for arrays of airports (broadcast against each other)
+        lookup = self._component_lookup[plane_type]
+        orig_components = _lookup(lookup, origs)
+        dest_components = _lookup(lookup, dests)
+        known = (orig_components >= 0) & (dest_components >= 0)
+        return (
+            known
+            & self._reachability[plane_type][
+                orig_components.clip(0), dest_components.clip(0)
+            ]
+        )
 
 
 class PathCache:
-    # shortest path cache
-    def __init__(self, graph) -> None:
+    # all-pairs shortest paths, routes that are unavailable (malfunctions) are avoided
+    # unless they cut the airports off from each other, then the path on the full route
+    # map is taken as the baseline did, the matrices are stored in and loaded from cache
+    # if there is one
+    def __init__(self, graph, cache: Optional[MatrixCache] = None) -> None:
         self.graph = graph
-        self._path_cache: Dict[Tuple[int, int], List[int]] = {}
-        self._time_cache: Dict[Tuple[int, int], int] = {}
+        self.cache = cache
+        self._unavailable: Set[Tuple[int, int]] = set()
+        # lookups that found a path around the unavailable routes, and the ones that
+        # did not
+        self.hits = 0
+        self.misses = 0
+        self._compute_matrices()
+
+    @property
+    def unavailable_routes(self) -> Set[Tuple[int, int]]:
+        return set(self._unavailable)
+
+    def copy(self) -> PathCache:
+        # a copy that set_unavailable_routes on this one does not change, for use in
+        # another thread
+        other = copy.copy(self)
+        other._unavailable = set(self._unavailable)
+        if self._cost is not self._base[0]:
+            other._cost, other._predecessors, other._time = (
+                matrix.copy() for matrix in (self._cost, self._predecessors, self._time)
+            )
+        return other
+
+    def set_unavailable_routes(
+        self, routes: Set[Tuple[int, int]]
+    ) -> Set[Tuple[int, int]]:
+        # recompute the paths that use a route which went down and restore the ones
+        # whose routes all recovered, returns the routes that went down
+        routes = set(routes)
+        went_down = routes - self._unavailable
+        if routes == self._unavailable:
+            return went_down
+        self._unavailable = routes
+        self._update_matrices()
+        return went_down
+
+    def _compute_matrices(self) -> None:
+        # all-pairs cost, time and predecessor matrices in one pass
+        arrays = None
+        if self.cache is not None:
+            key = fingerprint("paths", {0: self.graph})
+            arrays = self.cache.load(key)
+        if arrays is None:
+            arrays = self._full_graph_arrays()
+            if self.cache is not None:
+                self.cache.store(key, arrays)
+
+        self._nodes: List[int] = arrays["nodes"].tolist()
+        self._index: Dict[int, int] = {node: i for i, node in enumerate(self._nodes)}
+        self._index_lookup = np.full(max(self._nodes, default=0) + 1, -1, np.int64)
+        self._index_lookup[self._nodes] = np.arange(len(self._nodes))
+        self._hops = arrays["hops"]
+        self._hop_cost = arrays["hop_cost"]
+        self._hop_time = arrays["hop_time"]
+        # matrices of the full graph, used to restore rows when routes recover, read
+        # only (loaded ones are memory-mapped), the current matrices are these until a
+        # route goes down
+        self._base = (arrays["cost"], arrays["predecessors"], arrays["time"])
+        for matrix in self._base:
+            matrix.flags.writeable = False
+        self._cost, self._predecessors, self._time = self._base
+        self._degraded_rows = np.zeros(len(self._nodes), dtype=bool)
+
+    def _full_graph_arrays(self) -> Dict[str, np.ndarray]:
+        self._nodes = list(self.graph.nodes)
+        self._index = {node: i for i, node in enumerate(self._nodes)}
+        n = len(self._nodes)
+
+        # parallel edges (one per plane type) are reduced to the cheapest one, the hop
+        # time is the minimum time as in nx.path_weight
+        hop_cost: Dict[Tuple[int, int], float] = {}
+        self._hop_time = np.zeros((n, n), dtype=np.int64)
+        for orig, dest, data in self.graph.edges(data=True):
+            i, j = self._index[orig], self._index[dest]
+            if (i, j) in hop_cost:
+                hop_cost[i, j] = min(hop_cost[i, j], data["cost"])
+                self._hop_time[i, j] = min(self._hop_time[i, j], data["time"])
+            else:
+                hop_cost[i, j] = data["cost"]
+                self._hop_time[i, j] = data["time"]
+        self._hops = np.array(list(hop_cost.keys()), dtype=np.int64).reshape(-1, 2)
+        self._hop_cost = np.array(list(hop_cost.values()), dtype=np.float64)
+
+        cost, predecessors, time = self._shortest_path_trees(np.arange(n))
+        return {
+            "nodes": np.array(self._nodes, dtype=np.int64),
+            "hops": self._hops,
+            "hop_cost": self._hop_cost,
+            "hop_time": self._hop_time,
+            "cost": cost,
+            "predecessors": predecessors,
+            "time": time,
+        }
+
+    def _shortest_path_trees(
+        self, sources: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        n = len(self._nodes)
+        available = np.ones(len(self._hops), dtype=bool)
+        for orig, dest in self._unavailable:
+            if orig in self._index and dest in self._index:
+                available &= ~(
+                    (self._hops[:, 0] == self._index[orig])
+                    & (self._hops[:, 1] == self._index[dest])
+                )
+        hops = self._hops[available]
+        costs = csr_matrix(
+            (self._hop_cost[available], (hops[:, 0], hops[:, 1])), shape=(n, n)
+        )
+        cost, predecessors = dijkstra(
+            costs, directed=True, indices=sources, return_predecessors=True
+        )
+        predecessors = predecessors.astype(np.int32)
+
+        # accumulate hop times up the shortest path trees by pointer jumping
+        rows = np.arange(len(sources))[:, None]
+        ancestor = predecessors.astype(np.int64)
+        has_ancestor = ancestor >= 0
+        time = np.where(has_ancestor, self._hop_time[ancestor.clip(0), np.arange(n)], 0)
+        while has_ancestor.any():
+            jump = ancestor.clip(0)
+            time = np.where(has_ancestor, time + time[rows, jump], time)
+            ancestor = np.where(has_ancestor, ancestor[rows, jump], ancestor)
+            has_ancestor = ancestor >= 0
+        return cost, predecessors, time
+
+    def _update_matrices(self) -> None:
+        # only the rows whose shortest path tree on the full graph uses an
+        # unavailable route have to be recomputed
+        base_cost, base_predecessors, base_time = self._base
+        affected = np.zeros(len(self._nodes), dtype=bool)
+        for orig, dest in self._unavailable:
+            if orig in self._index and dest in self._index:
+                affected |= base_predecessors[:, self._index[dest]] == self._index[orig]
+
+        if not affected.any():
+            self._cost, self._predecessors, self._time = self._base
+            self._degraded_rows = affected
+            return
+        if self._cost is base_cost:
+            self._cost, self._predecessors, self._time = (
+                np.array(matrix) for matrix in self._base
+            )
+
+        restore = self._degraded_rows & ~affected
+        self._cost[restore] = base_cost[restore]
+        self._predecessors[restore] = base_predecessors[restore]
+        self._time[restore] = base_time[restore]
+
+        sources = np.flatnonzero(affected)
+        if len(sources) > 0:
+            (
+                self._cost[sources],
+                self._predecessors[sources],
+                self._time[sources],
+            ) = self._shortest_path_trees(sources)
+        self._degraded_rows = affected
+
+    def _matrices(self, orig, dest) -> Tuple[Tuple[np.ndarray, ...], int, int]:
+        # the current cost, predecessor and time matrices, or the ones of the full
+        # route map if the unavailable routes cut orig off from dest
+        i, j = self._index[orig], self._index[dest]
+        if not np.isinf(self._cost[i, j]):
+            self.hits += 1
+            return (self._cost, self._predecessors, self._time), i, j
+        self.misses += 1
+        if np.isinf(self._base[0][i, j]):
+            raise nx.NetworkXNoPath(f"No path between {orig} and {dest}.")
+        return self._base, i, j
 
     def get_path(self, orig, dest):
-        from_to = (orig, dest)
-        if from_to in self._path_cache:
-            return self._path_cache[from_to]
-        else:
-            path = nx.shortest_path(self.graph, orig, dest, weight="cost")
-            self._path_cache[from_to] = path
-            return path
+        (_, predecessors, _), i, j = self._matrices(orig, dest)
+        path = [self._nodes[j]]
+        while j != i:
+            j = predecessors[i, j]
+            path.append(self._nodes[j])
+        path.reverse()
+        return path
 
     def get_travel_time(self, orig, dest):
-        from_to = (orig, dest)
-        if from_to in self._time_cache:
-            return self._time_cache[from_to]
-        else:
-            path = self.get_path(orig, dest)
-            time = nx.path_weight(self.graph, path, "time")
-            self._time_cache[from_to] = time
-            return time
+        (_, _, time), i, j = self._matrices(orig, dest)
+        return int(time[i, j])
+
+    def get_cost(self, orig, dest):
+        (cost, _, _), i, j = self._matrices(orig, dest)
+        return float(cost[i, j])
+
+    def travel_times(self, origs, dests) -> np.ndarray:
+        # travel times for arrays of airports (broadcast against each other),
+        # BIG_TIME if there is no path
+        return self._pairwise(origs, dests, 2, BIG_TIME)
+
+    def travel_costs(self, origs, dests) -> np.ndarray:
+        # path costs as travel_times, inf if there is no path
+        return self._pairwise(origs, dests, 0, np.inf)
+
+    def _pairwise(self, origs, dests, matrix: int, missing) -> np.ndarray:
+        # matrix is the position in the cost, predecessor and time matrices
+        origs, dests = np.broadcast_arrays(np.asarray(origs), np.asarray(dests))
+        i = _lookup(self._index_lookup, origs)
+        j = _lookup(self._index_lookup, dests)
+        known = (i >= 0) & (j >= 0)
+        i, j = i.clip(0), j.clip(0)
+        cut_off = np.isinf(self._cost[i, j])
+        missed = int(np.count_nonzero(~known | cut_off))
+        self.hits += cut_off.size - missed
+        self.misses += missed
+        current = (self._cost, self._predecessors, self._time)[matrix][i, j]
+        values = np.where(cut_off, self._base[matrix][i, j], current)
+        no_path = ~known | np.isinf(self._base[0][i, j])
+        return np.where(no_path, missing, values)
+
+
+def _lookup(table: np.ndarray, keys) -> np.ndarray:
+    # table[keys] with -1 for keys outside of the table
+    keys = np.asarray(keys, dtype=np.int64)
+    inside = (keys >= 0) & (keys < len(table))
+    return np.where(inside, table[np.where(inside, keys, 0)], -1)
+
+
+def is_route_available(data) -> bool:
+    # edge attributes of the route map in the observation
+    return data.get("route_available", True) and data.get("mal", 0) == 0
+
+
+def get_unavailable_routes(*graphs) -> Set[Tuple[int, int]]:
+    # over several route maps a route is only unavailable if it is down in all of them
+    available = set()
+    unavailable = set()
+    for graph in graphs:
+        for orig, dest, data in graph.edges(data=True):
+            if is_route_available(data):
+                available.add((orig, dest))
+            else:
+                unavailable.add((orig, dest))
+    return unavailable - available
+
+
+class _Column:
+    # attribute of a CargoEdge that is stored in a column of its CargoEdges
+    def __set_name__(self, owner, name) -> None:
+        self.name = name
+
+    def __get__(self, ce, owner=None):
+        if ce is None:
+            return self
+        return int(ce._store._columns[self.name][ce._row])
+
+    def __set__(self, ce, value) -> None:
+        ce._store._columns[self.name][ce._row] = value
 
 
-@dataclass
 class CargoEdge:
-    cargo_id: int
-    origin: int
-    destination: int
-    duration: int
-    sequence: int
-    ep: int  # earliest pickup
-    lp: int  # latest pickup
-    weight: int
-    allowed_plane_types: Set[int]
+    # view on a row of the CargoEdges it was created in
+    __slots__ = ("_store", "_row")
+
+    cargo_id = _Column()
+    origin = _Column()
+    destination = _Column()
+    duration = _Column()
+    sequence = _Column()
+    ep = _Column()  # earliest pickup
+    lp = _Column()  # latest pickup
+    weight = _Column()
+    plane_type_mask = _Column()  # bit per plane type that can fly the edge
+
+    def __init__(self, store: CargoEdges, row: int) -> None:
+        self._store = store
+        self._row = row
+
+    @property
+    def row(self) -> int:
+        # row in its CargoEdges, to index CargoEdges.column() with
+        return self._row
+
+    @property
+    def allowed_plane_types(self) -> Set[int]:
+        return mask_plane_types(self.plane_type_mask)
 
     def corresponds(self, ce_seq) -> bool:
         return self.cargo_id == ce_seq[0] and self.sequence == ce_seq[1]
 
+    def __repr__(self) -> str:
+        return (
+            f"CargoEdge(cargo_id={self.cargo_id}, origin={self.origin}, "
+            f"destination={self.destination}, duration={self.duration}, "
+            f"sequence={self.sequence}, ep={self.ep}, lp={self.lp}, "
+            f"weight={self.weight}, allowed_plane_types={self.allowed_plane_types})"
+        )
+
 
 class CargoEdges:
-    def __init__(self) -> None:
-        self.cargo_edges: List[List[CargoEdge]] = []
+    # cargo edges stored column-wise, rows of removed cargo stay allocated
+    COLUMNS = (
+        "cargo_id",
+        "origin",
+        "destination",
+        "duration",
+        "sequence",
+        "ep",
+        "lp",
+        "weight",
+        "plane_type_mask",
+    )
+
+    def __init__(self, capacity: int = 256) -> None:
+        self._columns: Dict[str, np.ndarray] = {
+            name: np.zeros(capacity, dtype=np.int64) for name in self.COLUMNS
+        }
+        self._alive = np.zeros(capacity, dtype=bool)
+        self._size = 0
+        self._views: List[CargoEdge] = []
+        self._by_key: Dict[Tuple[int, int], CargoEdge] = {}
+        # per cargo, the rows of its cargo edges ordered by sequence
+        self._chains: Dict[int, List[int]] = {}
+        # views of the active cargo edges, until cargo is added or removed
+        self._active: Optional[List[CargoEdge]] = None
 
-    def add(self, cargo_edges: List[CargoEdge]):
-        self.cargo_edges.append(cargo_edges)
+    def create(
+        self,
+        cargo_id: int,
+        origin: int,
+        destination: int,
+        duration: int,
+        sequence: int,
+        ep: int,
+        lp: int,
+        weight: int,
+        plane_type_mask: int,
+    ) -> CargoEdge:
+        if self._size == len(self._alive):
+            for name, column in self._columns.items():
+                self._columns[name] = np.concatenate([column, np.zeros_like(column)])
+            self._alive = np.concatenate([self._alive, np.zeros_like(self._alive)])
+        row = self._size
+        self._size += 1
+        values = (
+            cargo_id,
+            origin,
+            destination,
+            duration,
+            sequence,
+            ep,
+            lp,
+            weight,
+            plane_type_mask,
+        )
+        for name, value in zip(self.COLUMNS, values):
+            self._columns[name][row] = value
+        self._alive[row] = True
+
+        ce = CargoEdge(self, row)
+        self._views.append(ce)
+        self._active = None
+        self._by_key[cargo_id, sequence] = ce
+        chain = self._chains.setdefault(cargo_id, [])
+        pos = len(chain)
+        sequences = self._columns["sequence"]
+        while pos > 0 and sequences[chain[pos - 1]] > sequence:
+            pos -= 1
+        chain.insert(pos, row)
+        return ce
+
+    @property
+    def cargo_edges(self) -> List[CargoEdge]:
+        # shared between calls, not to be changed
+        if self._active is None:
+            self._active = self._rows_to_edges(self.rows())
+        return self._active
+
+    def rows(self) -> np.ndarray:
+        # rows of the cargo edges of the active cargo, to index column() with
+        return np.flatnonzero(self._alive[: self._size])
+
+    def __len__(self) -> int:
+        return len(self._by_key)
+
+    def column(self, name: str) -> np.ndarray:
+        # all rows, including the ones of removed cargo
+        return self._columns[name][: self._size]
+
+    def get(self, cargo_id: int, sequence: int) -> Optional[CargoEdge]:
+        return self._by_key.get((cargo_id, sequence))
+
+    def at(self, row: int) -> CargoEdge:
+        # the cargo edge of a row, also of removed cargo
+        return self._views[row]
+
+    def copy(self) -> CargoEdges:
+        # the same cargo edges in the same rows, with views of their own
+        other = CargoEdges(capacity=0)
+        other._columns = {name: column.copy() for name, column in self._columns.items()}
+        other._alive = self._alive.copy()
+        other._size = self._size
+        other._views = [CargoEdge(other, row) for row in range(self._size)]
+        other._by_key = {key: other._views[ce.row] for key, ce in self._by_key.items()}
+        other._chains = {
+            cargo_id: list(rows) for cargo_id, rows in self._chains.items()
+        }
+        return other
+
+    def cargo_ids(self) -> Set[int]:
+        return set(self._chains)
+
+    def chain(self, cargo_id: int) -> List[CargoEdge]:
+        return self._rows_to_edges(self._chains.get(cargo_id, []))
+
+    def following(self, cargo_id: int, sequence: int) -> List[CargoEdge]:
+        # cargo edges of the cargo with a higher sequence
+        return self._rows_to_edges(self._following_rows(cargo_id, sequence))
+
+    def originating_at(
+        self, airport: int, cargo_ids: Optional[Iterable[int]] = None
+    ) -> List[CargoEdge]:
+        selected = self._alive[: self._size] & (self.column("origin") == airport)
+        if cargo_ids is not None:
+            selected &= np.isin(self.column("cargo_id"), list(cargo_ids))
+        return self._rows_to_edges(np.flatnonzero(selected))
+
+    def shift_sequence(self, cargo_id: int, sequence: int, delta: int) -> None:
+        # renumber the cargo edges of the cargo after sequence
+        rows = self._following_rows(cargo_id, sequence)
+        edges = self._rows_to_edges(rows)
+        for ce in edges:
+            del self._by_key[ce.cargo_id, ce.sequence]
+        self._columns["sequence"][rows] += delta
+        for ce in edges:
+            self._by_key[ce.cargo_id, ce.sequence] = ce
+
+    def remove_cargo(self, cargo_ids: Set[int]) -> None:
+        for cargo_id in cargo_ids:
+            rows = self._chains.pop(cargo_id, [])
+            for ce in self._rows_to_edges(rows):
+                del self._by_key[ce.cargo_id, ce.sequence]
+            self._alive[rows] = False
+        self._active = None
+
+    def _following_rows(self, cargo_id: int, sequence: int) -> np.ndarray:
+        rows = np.array(self._chains.get(cargo_id, []), dtype=np.int64)
+        return rows[self._columns["sequence"][rows] > sequence]
+
+    def _rows_to_edges(self, rows) -> List[CargoEdge]:
+        return [self._views[row] for row in rows]
 
 
 @dataclass
@@ -95,6 +602,11 @@ class Leg:
     def get_duration(self) -> int:
         return self.cargo_edges[-1].duration
 
+    def update_window(self) -> None:
+        # window of the remaining cargo edges, as if constructed from them
+        self.ep = max(ce.ep for ce in self.cargo_edges)
+        self.lp = min(ce.lp for ce in self.cargo_edges)
+
     @staticmethod
     def construct(ces: List[CargoEdge]) -> Leg:
         first_ce = ces[0]
@@ -118,6 +630,23 @@ class Plane:
     def has_legs(self) -> bool:
         return len(self.legs) > 0
 
+    def flies(self, ce: CargoEdge) -> bool:
+        # the plane type may fly the edge of the cargo edge
+        return ce.plane_type_mask & (1 << self.type) != 0
+
+    def sync_last_leg(self) -> None:
+        # where new cargo edges are planned from, after the legs were changed, a plane
+        # without legs keeps its location and carries no planned cargo
+        if not self.has_legs():
+            self.cur_weight = 0
+            self.cargo_ids = set()
+            return
+        last = self.legs[-1]
+        self.location = last.cargo_edges[0].origin
+        self.next_destination = last.cargo_edges[-1].destination
+        self.cur_weight = sum(ce.weight for ce in last.cargo_edges)
+        self.cargo_ids = {ce.cargo_id for ce in last.cargo_edges}
+
     def get_next_deadline(self) -> Optional[int]:
         if self.has_legs():
             return self.legs[0].lp
@@ -157,7 +686,7 @@ class Plane:
         self, ce: CargoEdge, path_cache: PathCache, plane_type_map: PlaneTypeMap
     ) -> bool:
         # can plane fly the edge
-        if self.type not in ce.allowed_plane_types:
+        if not self.flies(ce):
             return False
 
         # plane can not reach origin
@@ -240,18 +769,302 @@ class Plane:
 
         return (ep_diff_ce, lp_diff_ce, ep_diff_leg, lp_diff_leg)
 
-    def find_leg(self, ce_seq: Tuple[int, int]) -> List[CargoEdge]:
-        for legs in self.legs:
-            for ce in legs.cargo_edges:
-                if ce.cargo_id == ce_seq[0] and ce.sequence == ce_seq[1]:
-                    return legs
-        return []
-
 
 class Planning:
     def __init__(self, cargo_edges: CargoEdges, planes: Dict[str, Plane]) -> None:
         self.cargo_edges = cargo_edges
         self.planes = planes
+        # (cargo_id, sequence) -> plane and leg the cargo edge is planned on
+        self._legs: Dict[Tuple[int, int], Tuple[Plane, Leg]] = {}
+        # incremented on every change of the legs
+        self.version = 0
+        # for a fork: id of a plane or leg of the parent -> (it, its copy in the fork),
+        # None for a planning that owns all its planes
+        self._copies: Optional[Dict[int, Tuple[object, object]]] = None
+        # ids of the planes a fork copied
+        self._owned: Set[int] = set()
+        # for a fork: the changes to the index of the parent, None where a cargo edge
+        # is no longer planned
+        self._changes: Dict[Tuple[int, int], Optional[Tuple[Plane, Leg]]] = {}
+        # a fork that was committed must not be used any more
+        self._committed = False
+        for plane in planes.values():
+            self._index_legs(plane)
+
+    def fork(self) -> Planning:
+        # snapshot to try changes on, shares the planes, legs and index with this
+        # planning, copies only the planes it changes and keeps its changes to the index
+        # apart, the cargo edges themselves are always shared, so this planning must
+        # not change while the fork is in use
+        if self._copies is not None:
+            raise ValueError("Can not fork a fork of a planning")
+        fork = copy.copy(self)
+        fork.planes = ChainMap({}, self.planes)
+        fork._copies = {}
+        fork._owned = set()
+        fork._changes = {}
+        return fork
+
+    def copy(self, cargo_edges: CargoEdges) -> Planning:
+        # the same legs on planes of their own, on a copy of the cargo edges
+        planes = {
+            plane_id: replace(
+                plane,
+                legs=[
+                    Leg(
+                        [cargo_edges.at(ce.row) for ce in leg.cargo_edges],
+                        leg.ep,
+                        leg.lp,
+                    )
+                    for leg in plane.legs
+                ],
+                cargo_ids=set(plane.cargo_ids),
+            )
+            for plane_id, plane in self.planes.items()
+        }
+        planning = Planning(cargo_edges, planes)
+        planning.version = self.version
+        return planning
+
+    def commit(self, fork: Planning) -> None:
+        # take over the legs of a fork of this planning, the planes and legs of this
+        # planning that the fork copied keep their identity, the fork can not be used
+        # afterwards
+        fork._check_usable()
+        originals = {id(copied): original for original, copied in fork._copies.values()}
+        copied_planes = fork.planes.maps[0]
+        for plane_id, copied in copied_planes.items():
+            plane = self.planes[plane_id]
+            legs = []
+            for leg in copied.legs:
+                original = originals.get(id(leg))
+                if original is not None:
+                    original.cargo_edges = leg.cargo_edges
+                    original.ep, original.lp = leg.ep, leg.lp
+                    leg = original
+                legs.append(leg)
+            plane.legs = legs
+            plane.location = copied.location
+            plane.next_destination = copied.next_destination
+            plane.cur_weight = copied.cur_weight
+            plane.cargo_ids = copied.cargo_ids
+        for key, found in fork._changes.items():
+            if found is None:
+                self._legs.pop(key, None)
+        for plane_id in copied_planes:
+            self._index_legs(self.planes[plane_id])
+        if len(copied_planes) > 0:
+            self.version += 1
+        # the fork shares the planes and legs with this planning from now on
+        fork._committed = True
+
+    def diff(self, other: Planning) -> Set[str]:
+        # ids of the planes whose legs differ between the two plannings
+        return {
+            plane_id
+            for plane_id, plane in self.planes.items()
+            if plane is not other.planes[plane_id]
+            and _leg_keys(plane) != _leg_keys(other.planes[plane_id])
+        }
+
+    def _writable(self, plane: Plane) -> Plane:
+        # the plane itself, or in a fork its own copy of it
+        if self._copies is None:
+            return plane
+        self._check_usable()
+        if id(plane) in self._copies:
+            return self._copies[id(plane)][1]
+        if id(plane) in self._owned:
+            return plane
+        copied = copy.copy(plane)
+        copied.legs = []
+        for leg in plane.legs:
+            copied_leg = Leg(list(leg.cargo_edges), leg.ep, leg.lp)
+            self._copies[id(leg)] = (leg, copied_leg)
+            copied.legs.append(copied_leg)
+        copied.cargo_ids = set(plane.cargo_ids)
+        self._copies[id(plane)] = (plane, copied)
+        self._owned.add(id(copied))
+        self.planes[plane.id] = copied
+        self._index_legs(copied)
+        return copied
+
+    def _current(self, item):
+        # the copy in this fork of a plane or leg of the parent, if there is one
+        if self._copies is None:
+            return item
+        return self._copies.get(id(item), (item, item))[1]
+
+    def find(self, cargo_id: int, sequence: int) -> Optional[Tuple[Plane, Leg]]:
+        return self._get((cargo_id, sequence))
+
+    def is_assigned(self, cargo_id: int, sequence: int) -> bool:
+        return self._get((cargo_id, sequence)) is not None
+
+    def assigned(self) -> Set[Tuple[int, int]]:
+        # (cargo_id, sequence) of all planned cargo edges
+        if self._copies is None:
+            return set(self._legs)
+        self._check_usable()
+        assigned = set(self._legs)
+        for key, found in self._changes.items():
+            if found is None:
+                assigned.discard(key)
+            else:
+                assigned.add(key)
+        return assigned
+
+    def assigned_rows(self) -> Set[int]:
+        # rows of all planned cargo edges, unlike the sequence they never change
+        return {self.cargo_edges.get(*key).row for key in self.assigned()}
+
+    def add_cargo_edge(
+        self, plane: Plane, ce: CargoEdge, path_cache: PathCache
+    ) -> Tuple[int, int, int, int]:
+        plane = self._writable(plane)
+        changes = plane.add_cargo_edge(ce, path_cache)
+        self._set((ce.cargo_id, ce.sequence), (plane, plane.legs[-1]))
+        self.version += 1
+        return changes
+
+    def remove_cargo_edge(self, ce: CargoEdge) -> Optional[Plane]:
+        # legs that become empty are dropped from the plane, which then plans from
+        # its last leg
+        key = (ce.cargo_id, ce.sequence)
+        found = self._get(key)
+        if found is None:
+            return None
+        self._writable(found[0])
+        plane, leg = self._get(key)
+        self._set(key, None)
+        leg.remove(ce)
+        if len(leg.cargo_edges) == 0:
+            plane.legs = [other for other in plane.legs if other is not leg]
+        plane.sync_last_leg()
+        self.version += 1
+        return plane
+
+    def join_leg(self, plane: Plane, leg: Leg, ce: CargoEdge) -> None:
+        # plan a cargo edge on a leg that is already planned
+        plane = self._writable(plane)
+        leg = self._current(leg)
+        leg.add(ce)
+        self._set((ce.cargo_id, ce.sequence), (plane, leg))
+        plane.sync_last_leg()
+        self.version += 1
+
+    def move_cargo_edge(self, ce: CargoEdge, plane: Plane, leg: Leg) -> Plane:
+        # move a planned cargo edge into an existing leg, returns the plane it was on
+        source = self.remove_cargo_edge(ce)
+        plane = self._writable(plane)
+        leg = self._current(leg)
+        leg.add(ce)
+        self._set((ce.cargo_id, ce.sequence), (plane, leg))
+        plane.sync_last_leg()
+        return source
+
+    def swap_legs(self, plane_a: Plane, leg_a: Leg, plane_b: Plane, leg_b: Leg) -> None:
+        plane_a, plane_b = self._writable(plane_a), self._writable(plane_b)
+        leg_a, leg_b = self._current(leg_a), self._current(leg_b)
+        i = next(i for i, leg in enumerate(plane_a.legs) if leg is leg_a)
+        j = next(j for j, leg in enumerate(plane_b.legs) if leg is leg_b)
+        plane_a.legs[i], plane_b.legs[j] = leg_b, leg_a
+        self.set_legs(plane_a, plane_a.legs)
+        self.set_legs(plane_b, plane_b.legs)
+
+    def set_legs(self, plane: Plane, legs: List[Leg]) -> None:
+        # replace the legs of a plane, e.g. to undo a change
+        plane = self._writable(plane)
+        plane.legs = [self._current(leg) for leg in legs]
+        self._index_legs(plane)
+        plane.sync_last_leg()
+        self.version += 1
+
+    def insert_legs(self, plane: Plane, leg: Leg, legs: List[Leg]) -> None:
+        # plan legs on the plane right after leg
+        plane = self._writable(plane)
+        leg = self._current(leg)
+        i = next(i for i, other in enumerate(plane.legs) if other is leg)
+        self.set_legs(plane, plane.legs[: i + 1] + legs + plane.legs[i + 1 :])
+
+    def shift_sequence(self, cargo_id: int, sequence: int, delta: int) -> None:
+        # renumber the cargo edges of the cargo after sequence, planned or not
+        self._check_owned("shift the sequence of cargo")
+        found = [
+            self._legs.pop((ce.cargo_id, ce.sequence), None)
+            for ce in self.cargo_edges.following(cargo_id, sequence)
+        ]
+        self.cargo_edges.shift_sequence(cargo_id, sequence, delta)
+        for ce, planned in zip(self.cargo_edges.following(cargo_id, sequence), found):
+            if planned is not None:
+                self._legs[ce.cargo_id, ce.sequence] = planned
+        self.version += 1
+
+    def cancel_cargo(self, cargo_ids: Iterable[int]) -> Set[str]:
+        # drop all cargo edges of the cargo from the planning in one go, returns the ids
+        # of the planes whose legs changed
+        self._check_owned("cancel cargo")
+        cargo_ids = set(cargo_ids)
+        changed_legs: Dict[int, Tuple[Plane, Leg]] = {}
+        for cargo_id in cargo_ids:
+            for ce in self.cargo_edges.chain(cargo_id):
+                found = self._legs.pop((ce.cargo_id, ce.sequence), None)
+                if found is not None:
+                    plane, leg = found
+                    leg.remove(ce)
+                    changed_legs[id(leg)] = (plane, leg)
+        self.cargo_edges.remove_cargo(cargo_ids)
+
+        changed_planes: Dict[str, Plane] = {}
+        for plane, leg in changed_legs.values():
+            changed_planes[plane.id] = plane
+            if len(leg.cargo_edges) > 0:
+                leg.update_window()
+        for plane in changed_planes.values():
+            plane.legs = [leg for leg in plane.legs if len(leg.cargo_edges) > 0]
+            plane.sync_last_leg()
+        self.version += 1
+        return set(changed_planes)
+
+    def _index_legs(self, plane: Plane) -> None:
+        for leg in plane.legs:
+            for ce in leg.cargo_edges:
+                self._set((ce.cargo_id, ce.sequence), (plane, leg))
+
+    def _get(self, key: Tuple[int, int]) -> Optional[Tuple[Plane, Leg]]:
+        if self._copies is not None:
+            self._check_usable()
+            if key in self._changes:
+                return self._changes[key]
+        return self._legs.get(key)
+
+    def _set(self, key: Tuple[int, int], found: Optional[Tuple[Plane, Leg]]) -> None:
+        # the index of a fork is the one of its parent, its changes are kept apart
+        if self._copies is not None:
+            self._changes[key] = found
+        elif found is None:
+            del self._legs[key]
+        else:
+            self._legs[key] = found
+
+    def _check_usable(self) -> None:
+        if self._committed:
+            raise ValueError("Can not use a fork of a planning after it was committed")
+
+    def _check_owned(self, change: str) -> None:
+        # changes of the cargo edges would show in the planning the fork was made from
+        if self._copies is not None:
+            raise ValueError(f"Can not {change} in a fork of a planning")
+
+
+def _leg_keys(plane: Plane) -> List[List[Tuple[int, int]]]:
+    return [
+        [(ce.cargo_id, ce.sequence) for ce in leg.cargo_edges] for leg in plane.legs
+    ]
+
+
+def mask_plane_types(mask: int) -> Set[int]:
+    return {pt for pt in range(mask.bit_length()) if (mask >> pt) & 1}
 
 
 def tw_overlap(ep_1: int, lp_1: int, ep_2: int, lp_2: int) -> bool:
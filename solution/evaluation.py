@@ -0,0 +1,257 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import connected_components
+
+from solution.common import BIG_TIME, PathCache, PlaneTypeMap, Planning
+
+# rounds of the running maximum before the departures are taken in topological order
+ROUNDS = 8
+
+
+@dataclass
+class PlanEstimate:
+    # cargo whose remaining cargo edges are all planned on legs within capacity
+    delivered: int
+    # delivered cargo that leaves on its last cargo edge after the latest pickup
+    missed: int
+    # cargo that is not delivered
+    undelivered: int
+    # how long the planned cargo edges leave after their latest pickup, summed
+    lateness: int
+    # flying time of the legs, including flying empty to the next leg (and to the
+    # first one from where the plane is)
+    flying_time: int
+    # cost of the same flights, inf if a plane can not get to its next leg
+    flight_cost: float
+    # legs heavier than their plane can carry
+    overloaded: int
+    # minus the sum of squared leg sizes, lower favours fuller legs
+    fullness: int
+
+
+class PlanEvaluator:
+    # flies a planning without the environment: a leg leaves when its plane got there
+    # from its previous leg, the cargo arrived with its previous cargo edge and the
+    # windows of its cargo edges opened, all legs that are ready are flown at once
+    def __init__(
+        self,
+        path_cache: PathCache,
+        processing_time: int,
+        plane_type_map: Optional[PlaneTypeMap] = None,
+    ) -> None:
+        self.path_cache = path_cache
+        self.processing_time = processing_time
+        # to check that a plane type can fly empty to its next leg
+        self.plane_type_map = plane_type_map
+
+    def evaluate(
+        self,
+        planning: Planning,
+        now: int,
+        cargo_ids: Optional[Iterable[int]] = None,
+        positions: Optional[Dict[str, Tuple[int, int]]] = None,
+    ) -> Optional[PlanEstimate]:
+        # the cargo to count defaults to all cargo of the cargo edges, which includes
+        # the delivered cargo, positions are plane id -> airport the plane is at or
+        # flies to and when it is there, without one a plane starts its first leg now,
+        # None if legs wait on each other in a circle
+        planes = list(planning.planes.values())
+        rows, sizes, plane_of, first = [], [], [], []
+        for p, plane in enumerate(planes):
+            for i, leg in enumerate(plane.legs):
+                rows.extend(ce.row for ce in leg.cargo_edges)
+                sizes.append(len(leg.cargo_edges))
+                plane_of.append(p)
+                first.append(i == 0)
+        store = planning.cargo_edges
+        rows = np.array(rows, dtype=np.int64)
+        sizes = np.array(sizes, dtype=np.int64)
+        first = np.array(first, dtype=bool)
+        n = len(sizes)
+        starts = np.cumsum(sizes) - sizes
+        ends = starts + sizes - 1
+        # leg of each planned cargo edge
+        leg_of = np.repeat(np.arange(n), sizes)
+        ep, lp, ce_cargo, sequences = (
+            store.column(name)[rows] for name in ("ep", "lp", "cargo_id", "sequence")
+        )
+
+        if n > 0:
+            leg_ep = np.maximum.reduceat(ep, starts)
+            weight = np.add.reduceat(store.column("weight")[rows], starts)
+        else:
+            leg_ep = weight = np.zeros(0, dtype=np.int64)
+        duration = store.column("duration")[rows][ends]
+        origin = store.column("origin")[rows][starts]
+        destination = store.column("destination")[rows][ends]
+        max_weight = np.array([plane.max_weight for plane in planes])[plane_of]
+        overloaded = weight > max_weight
+
+        # flying empty from the previous leg of the plane, or to the first leg from
+        # where the plane is
+        following = np.flatnonzero(~first)
+        start = np.full(n, now, dtype=np.int64)
+        empty = following
+        empty_from = destination[following - 1]
+        if positions is not None:
+            positioned, airports, available = [], [], []
+            for leg in np.flatnonzero(first).tolist():
+                position = positions.get(planes[plane_of[leg]].id)
+                if position is not None:
+                    positioned.append(leg)
+                    airports.append(position[0])
+                    available.append(position[1])
+            start[positioned] = np.maximum(available, now)
+            empty = np.concatenate([following, positioned]).astype(np.int64)
+            empty_from = np.concatenate(
+                [empty_from, np.array(airports, dtype=np.int64)]
+            )
+        empty_time = np.zeros(n, dtype=np.int64)
+        empty_cost = np.zeros(n)
+        empty_time[empty] = self.path_cache.travel_times(empty_from, origin[empty])
+        empty_cost[empty] = self.path_cache.travel_costs(empty_from, origin[empty])
+        if self.plane_type_map is not None:
+            for leg, orig, dest in zip(
+                empty.tolist(), empty_from.tolist(), origin[empty].tolist()
+            ):
+                plane_type = planes[plane_of[leg]].type
+                if orig != dest and not self.plane_type_map.reachable(
+                    plane_type, orig, dest
+                ):
+                    empty_time[leg], empty_cost[leg] = BIG_TIME, np.inf
+
+        # a leg waits for the previous leg of its plane and for the legs with the
+        # previous cargo edges of its cargo (plus the processing time)
+        order = np.lexsort((sequences, ce_cargo))
+        before, after = order[:-1], order[1:]
+        chained = (ce_cargo[before] == ce_cargo[after]) & (
+            sequences[before] + 1 == sequences[after]
+        )
+        chained &= leg_of[before] != leg_of[after]
+        src, dst = leg_of[before[chained]], leg_of[after[chained]]
+        # legs that wait on each other in a circle share a strong component
+        waiting = np.concatenate([src, following - 1])
+        by_leg = np.argsort(waiting, kind="stable")
+        waits = csr_matrix(
+            (
+                np.ones(len(waiting)),
+                np.concatenate([dst, following])[by_leg],
+                np.searchsorted(waiting[by_leg], np.arange(n + 1)),
+            ),
+            shape=(n, n),
+        )
+        # connected_components does not handle repeated entries in a row
+        waits.sum_duplicates()
+        if n > 0 and connected_components(waits, connection="strong")[0] < n:
+            return None
+
+        # the departures along the legs of a plane are a running maximum of when each
+        # leg could leave relative to the time the plane needs from its first leg,
+        # repeated with the arrivals of the cargo until nothing changes, which takes
+        # one round per hand-over of cargo between planes, after ROUNDS rounds the
+        # legs are taken one by one in topological order instead
+        step = np.zeros(n, dtype=np.int64)
+        step[following] = duration[following - 1]
+        step += empty_time
+        earliest = np.maximum(leg_ep, start + np.where(first, empty_time, 0))
+        offset = np.cumsum(step)
+        offset -= offset[np.maximum.accumulate(np.where(first, np.arange(n), 0))]
+        departure = earliest.copy()
+        for _ in range(ROUNDS):
+            ready = earliest.copy()
+            np.maximum.at(
+                ready, dst, departure[src] + duration[src] + self.processing_time
+            )
+            relative = ready - offset
+            # lifts each plane above the previous one, to scan all planes at once
+            plane_start = np.cumsum(first) * (np.ptp(relative) + 1 if n > 0 else 0)
+            latest = np.maximum.accumulate(relative + plane_start)
+            updated = latest - plane_start + offset
+            if np.array_equal(updated, departure):
+                break
+            departure = updated
+        else:
+            departure = _departures_in_order(
+                earliest, step, first, src, dst, duration, self.processing_time
+            )
+
+        # the cargo edges before the first planned one of a cargo are taken to be
+        # flown already
+        active = store.rows()
+        cargos, cargo_of = np.unique(
+            store.column("cargo_id")[active], return_inverse=True
+        )
+        last = np.full(len(cargos), -1, dtype=np.int64)
+        np.maximum.at(last, cargo_of, store.column("sequence")[active])
+        flown = ~overloaded[leg_of]
+        cargo = np.searchsorted(cargos, ce_cargo[flown])
+        lowest = np.full(len(cargos), np.iinfo(np.int64).max)
+        highest = np.full(len(cargos), -1, dtype=np.int64)
+        np.minimum.at(lowest, cargo, sequences[flown])
+        np.maximum.at(highest, cargo, sequences[flown])
+        delivered = (highest == last) & (
+            highest - lowest + 1 == np.bincount(cargo, minlength=len(cargos))
+        )
+        ce_departure = departure[leg_of]
+        late = np.zeros(len(cargos), dtype=bool)
+        final = sequences[flown] == last[cargo]
+        late[cargo[final]] = (ce_departure[flown] > lp[flown])[final]
+        counted = np.ones(len(cargos), dtype=bool)
+        if cargo_ids is not None:
+            counted = np.isin(cargos, list(cargo_ids))
+        delivered &= counted
+
+        return PlanEstimate(
+            delivered=int(np.count_nonzero(delivered)),
+            missed=int(np.count_nonzero(delivered & late)),
+            undelivered=int(np.count_nonzero(counted & ~delivered)),
+            lateness=int(np.maximum(0, ce_departure - lp).sum()),
+            flying_time=int(duration.sum() + empty_time.sum()),
+            flight_cost=float(
+                self.path_cache.travel_costs(origin, destination).sum()
+                + empty_cost.sum()
+            ),
+            overloaded=int(np.count_nonzero(overloaded)),
+            fullness=-int((sizes**2).sum()),
+        )
+
+
+def _departures_in_order(
+    earliest: np.ndarray,
+    step: np.ndarray,
+    first: np.ndarray,
+    src: np.ndarray,
+    dst: np.ndarray,
+    duration: np.ndarray,
+    processing_time: int,
+) -> np.ndarray:
+    # the departures of the legs in one pass in topological order (Kahn), a leg
+    # leaves after the previous leg of its plane and the legs that hand cargo over to
+    # it, the legs must not wait on each other in a circle
+    n = len(earliest)
+    departure = earliest.tolist()
+    step, first, duration = step.tolist(), first.tolist(), duration.tolist()
+    handed_to: List[List[int]] = [[] for _ in range(n)]
+    waiting = [0 if first[leg] else 1 for leg in range(n)]
+    for leg, other in zip(src.tolist(), dst.tolist()):
+        handed_to[leg].append(other)
+        waiting[other] += 1
+    queue = [leg for leg in range(n) if waiting[leg] == 0]
+    while len(queue) > 0:
+        leg = queue.pop()
+        successors = [
+            (other, duration[leg] + processing_time) for other in handed_to[leg]
+        ]
+        if leg + 1 < n and not first[leg + 1]:
+            successors.append((leg + 1, step[leg + 1]))
+        for other, after in successors:
+            departure[other] = max(departure[other], departure[leg] + after)
+            waiting[other] -= 1
+            if waiting[other] == 0:
+                queue.append(other)
+    return np.array(departure, dtype=np.int64)
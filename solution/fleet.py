@@ -0,0 +1,324 @@
+from __future__ import annotations
+
+import heapq
+from bisect import bisect_left, insort
+from collections import defaultdict
+from typing import Dict, Iterator, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+from solution.common import (
+    TW_OVERLAP_MARGIN,
+    CargoEdge,
+    Leg,
+    PathCache,
+    Plane,
+    PlaneTypeMap,
+    tw_overlap,
+)
+
+
+class CandidateIndex:
+    # yields the planes for a cargo edge in the same order as sorting on Plane.matches
+    def __init__(self, planes: Dict[str, Plane], path_cache: PathCache) -> None:
+        self.planes = planes
+        self.path_cache = path_cache
+        # position in the planes dict, the last tie-breaker of the stable sort
+        self._ordinal = {plane_id: i for i, plane_id in enumerate(planes)}
+        self._by_cargo: Dict[int, Set[str]] = defaultdict(set)
+        self._by_edge: Dict[Tuple[int, int], Set[str]] = defaultdict(set)
+        self._by_next_destination: Dict[int, Set[str]] = defaultdict(set)
+        # (type, location) -> planes sorted by (ep, nr_legs, ordinal)
+        self._by_location: Dict[Tuple[int, int], List[Tuple[int, int, int, str]]] = (
+            defaultdict(list)
+        )
+        self._keys: Dict[str, Tuple] = {}
+        for plane in planes.values():
+            self._insert(plane)
+
+    def update(self, plane: Plane) -> None:
+        # call after the location, legs or cargo of the plane changed
+        self._remove(plane.id)
+        self._insert(plane)
+
+    def candidates(self, ce: CargoEdge) -> Iterator[Plane]:
+        seen: Set[str] = set()
+
+        # carries the cargo already
+        yield from self._sorted_group(ce, self._by_cargo.get(ce.cargo_id, ()), seen)
+        # flies the edge with an overlapping time window
+        same_edge = [
+            plane_id
+            for plane_id in self._by_edge.get((ce.origin, ce.destination), ())
+            if tw_overlap(
+                self.planes[plane_id].ep, self.planes[plane_id].lp, ce.ep, ce.lp
+            )
+        ]
+        yield from self._sorted_group(ce, same_edge, seen)
+        # ends up at the origin of the edge
+        yield from self._sorted_group(
+            ce, self._by_next_destination.get(ce.origin, ()), seen
+        )
+
+        # all other planes ordered by time difference, merged over their locations
+        heap = []
+        mask = ce.plane_type_mask
+        for (plane_type, location), bucket in self._by_location.items():
+            if mask & (1 << plane_type) and len(bucket) > 0:
+                tt = self.path_cache.get_travel_time(location, ce.origin)
+                ep, nr_legs, ordinal, plane_id = bucket[0]
+                heap.append((ep + tt - ce.ep, nr_legs, ordinal, tt, bucket, 0))
+        heapq.heapify(heap)
+        while len(heap) > 0:
+            _, _, _, tt, bucket, pos = heapq.heappop(heap)
+            plane_id = bucket[pos][3]
+            if pos + 1 < len(bucket):
+                ep, nr_legs, ordinal, _ = bucket[pos + 1]
+                heapq.heappush(
+                    heap, (ep + tt - ce.ep, nr_legs, ordinal, tt, bucket, pos + 1)
+                )
+            if plane_id not in seen:
+                seen.add(plane_id)
+                yield self.planes[plane_id]
+
+    def servicing(
+        self, ce: CargoEdge, plane_type_map: PlaneTypeMap, n: int = 1
+    ) -> List[Plane]:
+        # best n planes that can service the cargo edge
+        found = []
+        for plane in self.candidates(ce):
+            if plane.can_service(ce, self.path_cache, plane_type_map):
+                found.append(plane)
+                if len(found) == n:
+                    break
+        return found
+
+    def _sorted_group(
+        self, ce: CargoEdge, plane_ids: Iterator[str], seen: Set[str]
+    ) -> Iterator[Plane]:
+        group = [
+            self.planes[plane_id]
+            for plane_id in plane_ids
+            if plane_id not in seen and self.planes[plane_id].flies(ce)
+        ]
+        group.sort(key=lambda p: (p.matches(ce, self.path_cache), self._ordinal[p.id]))
+        for plane in group:
+            seen.add(plane.id)
+            yield plane
+
+    def _insert(self, plane: Plane) -> None:
+        cargo_ids = frozenset(plane.cargo_ids)
+        edge = (plane.location, plane.next_destination)
+        location = (plane.type, plane.location)
+        entry = (plane.ep, len(plane.legs), self._ordinal[plane.id], plane.id)
+        for cargo_id in cargo_ids:
+            self._by_cargo[cargo_id].add(plane.id)
+        self._by_edge[edge].add(plane.id)
+        self._by_next_destination[plane.next_destination].add(plane.id)
+        insort(self._by_location[location], entry)
+        self._keys[plane.id] = (cargo_ids, edge, location, entry)
+
+    def _remove(self, plane_id: str) -> None:
+        cargo_ids, edge, location, entry = self._keys.pop(plane_id)
+        for cargo_id in cargo_ids:
+            self._by_cargo[cargo_id].discard(plane_id)
+        self._by_edge[edge].discard(plane_id)
+        self._by_next_destination[edge[1]].discard(plane_id)
+        bucket = self._by_location[location]
+        del bucket[bisect_left(bucket, entry)]
+
+
+class LegIndex:
+    # the planned legs that a cargo edge could join: all legs but the first one of a
+    # plane (it is being executed) that fly a single edge, per edge sorted on the start
+    # of their window
+    def __init__(self, planes: Dict[str, Plane]) -> None:
+        self.planes = planes
+        self._ids = list(planes)
+        self._ordinal = {plane_id: i for i, plane_id in enumerate(planes)}
+        # edge -> (ep, lp, ordinal, position of the leg on its plane) sorted
+        self._by_edge: Dict[Tuple[int, int], List[Tuple[int, int, int, int]]] = (
+            defaultdict(list)
+        )
+        # edge -> longest window in the bucket, bounds how far back a query looks
+        self._longest: Dict[Tuple[int, int], int] = defaultdict(int)
+        # per plane, for each leg but the first: the leg, its number of cargo edges
+        # and its edge and entry if it is indexed
+        self._keys: Dict[str, List[Tuple[Leg, int, Optional[Tuple]]]] = {}
+        for plane in planes.values():
+            self._insert(plane)
+
+    def update(self, plane: Plane) -> None:
+        # call after the legs of the plane changed, only the legs that are not the
+        # ones indexed at the same position with as many cargo edges are indexed again
+        keys = self._keys[plane.id]
+        for position, leg in enumerate(plane.legs[1:], 1):
+            if position <= len(keys):
+                indexed, size, key = keys[position - 1]
+                if indexed is leg and size == len(leg.cargo_edges):
+                    continue
+                self._remove_leg(key)
+            key = (leg, len(leg.cargo_edges), self._insert_leg(plane, leg, position))
+            if position <= len(keys):
+                keys[position - 1] = key
+            else:
+                keys.append(key)
+        for _, _, key in keys[max(0, len(plane.legs) - 1) :]:
+            self._remove_leg(key)
+        del keys[max(0, len(plane.legs) - 1) :]
+
+    def joinable(self, ce: CargoEdge) -> List[Tuple[Plane, Leg]]:
+        # (plane, leg) on the edge of the cargo edge with an overlapping window, by the
+        # start of the window, the windows only narrow once indexed so the stored ones
+        # are checked first and the current ones after
+        edge = (ce.origin, ce.destination)
+        bucket = self._by_edge.get(edge, [])
+        last = bisect_left(bucket, (ce.lp - TW_OVERLAP_MARGIN + 1,))
+        first = bisect_left(
+            bucket, (ce.ep + TW_OVERLAP_MARGIN - self._longest[edge],), 0, last
+        )
+        found = []
+        for _, lp, ordinal, position in bucket[first:last]:
+            if lp < ce.ep + TW_OVERLAP_MARGIN:
+                continue
+            plane = self.planes[self._ids[ordinal]]
+            leg = plane.legs[position]
+            if tw_overlap(leg.ep, leg.lp, ce.ep, ce.lp):
+                found.append((plane, leg))
+        return found
+
+    def _insert(self, plane: Plane) -> None:
+        keys = []
+        for position, leg in enumerate(plane.legs[1:], 1):
+            keys.append(
+                (leg, len(leg.cargo_edges), self._insert_leg(plane, leg, position))
+            )
+        self._keys[plane.id] = keys
+
+    def _insert_leg(
+        self, plane: Plane, leg: Leg, position: int
+    ) -> Optional[Tuple[Tuple[int, int], Tuple]]:
+        edges = {(ce.origin, ce.destination) for ce in leg.cargo_edges}
+        if len(edges) != 1:
+            return None
+        edge = edges.pop()
+        entry = (leg.ep, leg.lp, self._ordinal[plane.id], position)
+        insort(self._by_edge[edge], entry)
+        self._longest[edge] = max(self._longest[edge], leg.lp - leg.ep)
+        return edge, entry
+
+    def _remove_leg(self, key: Optional[Tuple[Tuple[int, int], Tuple]]) -> None:
+        if key is not None:
+            edge, entry = key
+            bucket = self._by_edge[edge]
+            del bucket[bisect_left(bucket, entry)]
+
+
+class FleetScorer:
+    # Plane.matches and Plane.can_service for the whole fleet at once, from plane
+    # state kept in arrays
+    def __init__(self, planes: Dict[str, Plane], path_cache: PathCache) -> None:
+        self.planes = planes
+        self.path_cache = path_cache
+        self._ids = list(planes)
+        self._ordinal = {plane_id: i for i, plane_id in enumerate(self._ids)}
+        n = len(self._ids)
+        self._location = np.zeros(n, dtype=np.int64)
+        self._next_destination = np.zeros(n, dtype=np.int64)
+        self._type = np.zeros(n, dtype=np.int64)
+        self._ep = np.zeros(n, dtype=np.int64)
+        self._lp = np.zeros(n, dtype=np.int64)
+        # duration of the last leg, 0 without legs
+        self._duration = np.zeros(n, dtype=np.int64)
+        self._nr_legs = np.zeros(n, dtype=np.int64)
+        self._cur_weight = np.zeros(n, dtype=np.int64)
+        self._max_weight = np.zeros(n, dtype=np.int64)
+        self._by_cargo: Dict[int, Set[int]] = defaultdict(set)
+        self._cargo_ids: List[Set[int]] = [set() for _ in range(n)]
+        for plane in planes.values():
+            self.update(plane)
+
+    def update(self, plane: Plane) -> None:
+        # call after the location, legs or cargo of the plane or the window of its last
+        # leg changed, the scores are only as fresh as the last update
+        i = self._ordinal[plane.id]
+        self._location[i] = plane.location
+        self._next_destination[i] = plane.next_destination
+        self._type[i] = plane.type
+        self._ep[i] = plane.ep
+        self._lp[i] = plane.lp
+        self._duration[i] = plane.legs[-1].get_duration() if plane.has_legs() else 0
+        self._nr_legs[i] = len(plane.legs)
+        self._cur_weight[i] = plane.cur_weight
+        self._max_weight[i] = plane.max_weight
+        for cargo_id in self._cargo_ids[i]:
+            self._by_cargo[cargo_id].discard(i)
+        self._cargo_ids[i] = set(plane.cargo_ids)
+        for cargo_id in self._cargo_ids[i]:
+            self._by_cargo[cargo_id].add(i)
+
+    def score(
+        self, cargo_edges: Sequence[CargoEdge], plane_type_map: PlaneTypeMap
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        # match keys as in Plane.matches (cargo edges x planes x 5, lower is better)
+        # and whether the plane can service the cargo edge (cargo edges x planes)
+        def column(attribute: str) -> np.ndarray:
+            return np.array(
+                [getattr(ce, attribute) for ce in cargo_edges], dtype=np.int64
+            )[:, None]
+
+        origin, destination = column("origin"), column("destination")
+        ce_ep, ce_lp = column("ep"), column("lp")
+
+        carrying = np.zeros((len(cargo_edges), len(self._ids)), dtype=bool)
+        for row, ce in enumerate(cargo_edges):
+            carrying[row, list(self._by_cargo.get(ce.cargo_id, ()))] = True
+        overlap = (self._ep <= ce_lp - TW_OVERLAP_MARGIN) & (
+            ce_ep <= self._lp - TW_OVERLAP_MARGIN
+        )
+        same_edge = (
+            (self._location == origin) & (self._next_destination == destination)
+        ) & overlap
+        at_origin = self._next_destination == origin
+        timediff = (
+            self._ep + self.path_cache.travel_times(self._location, origin) - ce_ep
+        )
+        keys = np.stack(
+            np.broadcast_arrays(
+                ~carrying, ~same_edge, ~at_origin, timediff, self._nr_legs
+            ),
+            axis=-1,
+        ).astype(np.int64)
+
+        allowed = (column("plane_type_mask") >> self._type) & 1 == 1
+        reachable = np.zeros_like(allowed)
+        for plane_type in np.unique(self._type):
+            of_type = self._type == plane_type
+            reachable[:, of_type] = plane_type_map.reachable_many(
+                int(plane_type), self._location[of_type], origin
+            )
+        fits = self._cur_weight + column("weight") <= self._max_weight
+        arrival = (
+            self._ep
+            + self._duration
+            + self.path_cache.travel_times(self._next_destination, origin)
+        )
+        feasible = (
+            allowed
+            & reachable
+            & ((self._nr_legs == 0) | (same_edge & fits) | (arrival < ce_lp))
+        )
+        return keys, feasible
+
+    def servicing(
+        self, ce: CargoEdge, plane_type_map: PlaneTypeMap, n: int = 1
+    ) -> List[Plane]:
+        # best n planes that can service the cargo edge
+        keys, feasible = self.score([ce], plane_type_map)
+        keys, feasible = keys[0], feasible[0]
+        # lexsort takes the primary key last, ties keep the order of the planes dict
+        order = np.lexsort(
+            (np.arange(len(self._ids)),) + tuple(keys[:, k] for k in range(4, -1, -1))
+        )
+        ranked = order[feasible[order]][:n]
+        return [self.planes[self._ids[i]] for i in ranked]
@@ -0,0 +1,131 @@
+from __future__ import annotations
+
+import csv
+from time import perf_counter
+from typing import Dict, List
+
+import numpy as np
+
+
+class _Span:
+    def __init__(self, instrumentation: Instrumentation, name: str) -> None:
+        self.instrumentation = instrumentation
+        self.name = name
+
+    def __enter__(self) -> None:
+        self.start = perf_counter()
+
+    def __exit__(self, *exc) -> None:
+        self.instrumentation.record(self.name, self.start)
+
+
+class _NoSpan:
+    def __enter__(self) -> None:
+        pass
+
+    def __exit__(self, *exc) -> None:
+        pass
+
+
+_NO_SPAN = _NoSpan()
+
+
+class Instrumentation:
+    # per step timings (ms) and counters, does nothing unless enabled
+    def __init__(self) -> None:
+        self.enabled = False
+        # per episode, a row per step
+        self.episodes: List[List[Dict[str, float]]] = []
+        self._step: Dict[str, float] = {}
+        self._step_start = 0.0
+        # caches with hits and misses attributes, their counts at the start of the step
+        self._watched: Dict[str, object] = {}
+        self._counts: Dict[str, tuple] = {}
+
+    def enable(self, enabled: bool = True) -> None:
+        self.enabled = enabled
+
+    def start_episode(self) -> None:
+        self._watched = {}
+        if self.enabled:
+            self.episodes.append([])
+
+    def watch(self, name: str, cache) -> None:
+        self._watched[name] = cache
+
+    def start_step(self) -> None:
+        if not self.enabled:
+            return
+        self._step = {}
+        self._counts = {
+            name: (cache.hits, cache.misses) for name, cache in self._watched.items()
+        }
+        self._step_start = perf_counter()
+
+    def end_step(self) -> None:
+        if not self.enabled:
+            return
+        step = {"step_ms": (perf_counter() - self._step_start) * 1000}
+        step.update(self._step)
+        for name, cache in self._watched.items():
+            hits, misses = self._counts[name]
+            step[f"{name}_hits"] = cache.hits - hits
+            step[f"{name}_misses"] = cache.misses - misses
+        self.episodes[-1].append(step)
+
+    def span(self, name: str):
+        # with instrumentation.span("update_planning"): ...
+        if not self.enabled:
+            return _NO_SPAN
+        return _Span(self, name)
+
+    def clock(self) -> float:
+        # start of a timed block that is too long for a with statement, see record
+        return perf_counter() if self.enabled else 0.0
+
+    def record(self, name: str, start: float) -> None:
+        if self.enabled:
+            elapsed = (perf_counter() - start) * 1000
+            self._step[name] = self._step.get(name, 0.0) + elapsed
+
+    def count(self, name: str, n: int = 1) -> None:
+        if self.enabled:
+            self._step[name] = self._step.get(name, 0) + n
+
+    def rows(self) -> List[Dict[str, float]]:
+        return [
+            {"episode": episode, "step": step, **values}
+            for episode, steps in enumerate(self.episodes)
+            for step, values in enumerate(steps)
+        ]
+
+    def summary(self) -> List[Dict[str, float]]:
+        # step latency per episode
+        rows = []
+        for episode, steps in enumerate(self.episodes):
+            latency = np.array([step["step_ms"] for step in steps] or [0.0])
+            rows.append(
+                {
+                    "episode": episode,
+                    "steps": len(steps),
+                    "total_ms": float(latency.sum()),
+                    "p50_ms": float(np.percentile(latency, 50)),
+                    "p95_ms": float(np.percentile(latency, 95)),
+                    "max_ms": float(latency.max()),
+                }
+            )
+        return rows
+
+
+def write_rows(filename: str, rows: List[Dict[str, float]]) -> None:
+    # columns in order of first appearance, missing values are 0
+    fieldnames: Dict[str, None] = {}
+    for row in rows:
+        fieldnames.update(dict.fromkeys(row))
+    with open(filename, "w", newline="") as file:
+        csvwriter = csv.DictWriter(file, fieldnames=list(fieldnames), restval=0)
+        csvwriter.writeheader()
+        csvwriter.writerows(rows)
+
+
+instrumentation = Instrumentation()
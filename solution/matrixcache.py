@@ -0,0 +1,111 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from typing import Dict, Optional
+
+import numpy as np
+
+# part of every fingerprint, bump it when the stored arrays change meaning
+FORMAT_VERSION = 2
+
+MAX_BYTES = 1 << 30
+
+
+def fingerprint(kind: str, graphs: Dict, attributes=("cost", "time")) -> str:
+    # kind and a hash of the nodes, edges and edge weights of the graphs (key -> graph)
+    # in their insertion order, which decides how ties between shortest paths are broken
+    digest = hashlib.sha1(repr((FORMAT_VERSION, kind)).encode())
+    for key, graph in graphs.items():
+        digest.update(repr((key, list(graph.nodes))).encode())
+        edges = [
+            (orig, dest, tuple(data.get(attribute) for attribute in attributes))
+            for orig, dest, data in graph.edges(data=True)
+        ]
+        digest.update(repr(edges).encode())
+    return f"{kind}-{digest.hexdigest()}"
+
+
+class MatrixCache:
+    # precomputed arrays on local disk, a directory per fingerprint of the graphs they
+    # were computed from, loaded memory-mapped, the least recently used entries are
+    # evicted once all entries take more than max_bytes
+    def __init__(self, directory: str, max_bytes: int = MAX_BYTES) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def load(self, key: str) -> Optional[Dict[str, np.ndarray]]:
+        # the stored arrays (read only), None if there is no valid entry for key
+        path = os.path.join(self.directory, key)
+        try:
+            with open(os.path.join(path, "meta.json")) as file:
+                meta = json.load(file)
+            if meta["key"] != key:
+                raise ValueError(f"{path} holds {meta['key']}")
+            arrays = {}
+            for name, (shape, dtype) in meta["arrays"].items():
+                array = np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+                if list(array.shape) != shape or array.dtype.str != dtype:
+                    raise ValueError(f"{path}/{name}.npy does not match {meta}")
+                arrays[name] = array
+            # the modification time orders the entries for eviction
+            os.utime(os.path.join(path, "meta.json"))
+        except (OSError, ValueError, KeyError):
+            # missing, or partly evicted or written by another version, an invalid
+            # entry is removed so it can be stored again
+            shutil.rmtree(path, ignore_errors=True)
+            self.misses += 1
+            return None
+        self.hits += 1
+        return arrays
+
+    def store(self, key: str, arrays: Dict[str, np.ndarray]) -> None:
+        size = sum(array.nbytes for array in arrays.values())
+        if size > self.max_bytes:
+            return
+        # written next to the entries and renamed, so other processes never see a
+        # partial entry
+        staging = tempfile.mkdtemp(prefix=".staging-", dir=self.directory)
+        try:
+            for name, array in arrays.items():
+                np.save(os.path.join(staging, f"{name}.npy"), array)
+            meta = {
+                "key": key,
+                "arrays": {
+                    name: [list(array.shape), array.dtype.str]
+                    for name, array in arrays.items()
+                },
+            }
+            with open(os.path.join(staging, "meta.json"), "w") as file:
+                json.dump(meta, file)
+            os.rename(staging, os.path.join(self.directory, key))
+        except OSError:
+            # stored by another process in the meantime
+            shutil.rmtree(staging, ignore_errors=True)
+            return
+        self._evict(keep=key)
+
+    def _evict(self, keep: str) -> None:
+        entries = []
+        for entry in os.scandir(self.directory):
+            if not entry.is_dir() or entry.name.startswith("."):
+                continue
+            try:
+                used = os.stat(os.path.join(entry.path, "meta.json")).st_mtime
+                size = sum(file.stat().st_size for file in os.scandir(entry.path))
+            except OSError:
+                continue
+            entries.append((used, size, entry))
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in sorted(entries, key=lambda entry: entry[0]):
+            if total <= self.max_bytes:
+                break
+            if entry.name != keep:
+                shutil.rmtree(entry.path, ignore_errors=True)
+                total -= size
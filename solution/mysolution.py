@@ -3,12 +3,15 @@ from airlift.solutions import Solution
 from airlift.envs import ActionHelper
 from airlift.envs.airport import NOAIRPORT_ID
 from airlift.envs.agents import PlaneState
-from airlift.envs.airlift_env import ObservationHelper
 
 from typing import Optional, Tuple, Dict, List
 
-import networkx as nx
-from solution.common import Leg
+from solution.common import BIG_TIME
+from solution.instrument import instrumentation
+from solution.matrixcache import MatrixCache
+from solution.replan import BackgroundReplanner
+from solution.routing import NextHopTable
+from solution.trace import trace
 
 from solution.strategic import Model
 
@@ -19,17 +22,47 @@ class MySolution(Solution):
     policy function.
     """
 
-    def __init__(self):
+    def __init__(
+        self,
+        background_replanning: bool = False,
+        cache_dir: Optional[str] = None,
+        event_driven: bool = False,
+        search_budget: float = 0.0,
+    ):
         super().__init__()
+        # plan new cargo in a worker thread, the agents keep following the current
+        # planning until the new one is ready
+        self.background_replanning = background_replanning
+        self.replanner: Optional[BackgroundReplanner] = None
+        # keep the path matrices and reachability labels on disk, most scenarios share
+        # their route maps with another level or run
+        self.matrix_cache = MatrixCache(cache_dir) if cache_dir is not None else None
+        # only decide again for agents whose observation or first leg changed, the
+        # others repeat their last action with an updated priority
+        self.event_driven = event_driven
+        # seconds per step to improve the planning with local search, 0 to disable
+        self.search_budget = search_budget
 
     def reset(self, obs, observation_spaces=None, action_spaces=None, seed=None):
         # Currently, the evaluator will NOT pass in an observation space or action space (they will be set to None)
         super().reset(obs, observation_spaces, action_spaces, seed)
 
         self.current_time = 0
+        # agent -> (key, time until which the decision holds, action, deadlines its
+        # priority is computed from)
+        self._decisions: Dict[str, Tuple[tuple, int, dict, List[Optional[int]]]] = {}
 
-        self.model = Model()
+        instrumentation.start_episode()
+        self.model = Model(
+            search_budget=self.search_budget, matrix_cache=self.matrix_cache
+        )
         self.planning = self.model.create_planning(obs)
+        instrumentation.watch("paths", self.model.paths)
+        if self.replanner is not None:
+            self.replanner.close()
+        self.replanner = (
+            BackgroundReplanner(self.model) if self.background_replanning else None
+        )
 
         global_state = next(iter(obs.values()))["globalstate"]
 
@@ -38,9 +71,14 @@ class MySolution(Solution):
             c.hard_deadline for c in global_state["active_cargo"]
         )
 
-        self.path_matrices = dict()
+        # the route maps as they are at the start, a plane takes the best first hop
+        # that is available when it departs
+        self.next_hops = dict()
         for plane_type, route_map in global_state["route_map"].items():
-            self.path_matrices[plane_type] = PathMatrix(route_map)
+            self.next_hops[plane_type] = NextHopTable(
+                route_map, cache=self.matrix_cache
+            )
+            instrumentation.watch(f"next_hops_{plane_type}", self.next_hops[plane_type])
 
     def calculate_priority(self, next_deadline: Optional[int]) -> int:
         if next_deadline is None:
@@ -52,54 +90,110 @@ class MySolution(Solution):
         priority = max(min(priority, self.nr_agents), 1)
         return priority
 
+    def positions(self, obs) -> Dict[str, Tuple[int, int]]:
+        # where each plane is, or the airport it flies to, and when it is there, the
+        # observation has no arrival times so planes in the air are taken to be there now
+        positions = {}
+        for a, agent in obs.items():
+            airport = agent["current_airport"]
+            if (
+                agent["state"] == PlaneState.MOVING
+                and agent["destination"] != NOAIRPORT_ID
+            ):
+                airport = agent["destination"]
+            positions[a] = (airport, self.current_time)
+        return positions
+
     def policies(self, obs, dones, infos):
+        try:
+            return self._policies(obs)
+        except Exception:
+            # show the decisions that led up to the error
+            trace.dump()
+            raise
+
+    def _policies(self, obs):
         # Use the action helper to generate an action
         actions = {}
-
-        global_state = next(iter(obs.values()))["globalstate"]
-        new_planning = self.model.update_planning(obs)
-        if new_planning is not None:
-            self.planning = new_planning
+        trace.time = self.current_time
+        instrumentation.start_step()
+
+        with instrumentation.span("observation_ms"):
+            view = self.model.views.get(obs, refresh=True)
+        with instrumentation.span("update_planning_ms"):
+            if self.replanner is None:
+                new_planning = self.model.update_planning(obs, now=self.current_time)
+                if new_planning is not None:
+                    self.planning = new_planning
+            else:
+                self.model.repair(obs, self.model.update_routes(obs), self.current_time)
+                model = self.replanner.poll(obs, self.current_time)
+                if model is not None:
+                    self.model = model
+                    self.planning = model.planning
+                self.replanner.submit(obs)
+        if self.search_budget > 0:
+            with instrumentation.span("improve_ms"):
+                self.model.improve(self.current_time, self.positions(obs))
+
+        # drop missed cargo that is still on board from the planning in one batch
+        with instrumentation.span("missed_cargo_ms"):
+            missed_cargo_ids = {
+                cargo_id
+                for agent in obs.values()
+                for cargo_id in agent["cargo_onboard"]
+                if cargo_id not in view.active_cargo
+            }
+            if len(missed_cargo_ids) > 0:
+                self.planning.cancel_cargo(missed_cargo_ids)
+                instrumentation.count("cargo_missed", len(missed_cargo_ids))
 
         for a, agent in obs.items():
             plane = self.planning.planes[a]
+            next_deadline = plane.get_next_deadline()
+            if self.event_driven:
+                key = _decision_key(agent, plane, view)
+                decision = self._decisions.get(a)
+                if (
+                    decision is not None
+                    and decision[0] == key
+                    and self.current_time < decision[1]
+                ):
+                    _, _, action, deadlines = decision
+                    actions[a] = dict(
+                        action,
+                        priority=min(self.calculate_priority(d) for d in deadlines),
+                    )
+                    instrumentation.count("agents_skipped")
+                    continue
+                version = self.planning.version
+            deadlines = [next_deadline]
             plane_state = agent["state"]
             plane_type = agent["plane_type"]
             current_airport = agent["current_airport"]
             max_weight = agent["max_weight"]
             cur_weight = agent["current_weight"]
             available_destinations = agent["available_routes"]
-            cargo_at_current_airport = agent["cargo_at_current_airport"]
             cargo_onboard = agent["cargo_onboard"]
             destination = agent["destination"]
 
             if plane_state in (PlaneState.WAITING, PlaneState.READY_FOR_TAKEOFF):
+                load_unload_start = instrumentation.clock()
                 cargo_to_unload = []
                 cargo_to_load = []
                 # unload
                 for cargo_id in cargo_onboard:
                     # Dump missed
-                    cargo = ObservationHelper.get_active_cargo_info(
-                        global_state, cargo_id
-                    )
+                    cargo = view.active_cargo.get(cargo_id)
                     if cargo is None:
-                        # Missed cargo
-                        # print(
-                        #     f"Dumping missed cargo {cargo_id} from {a} at {current_airport}"
-                        # )
+                        # Missed cargo, already dropped from the planning
+                        trace.debug(
+                            "Dumping missed cargo %s from %s at %s",
+                            cargo_id,
+                            a,
+                            current_airport,
+                        )
                         cargo_to_unload.append(cargo_id)
-                        for plane in self.planning.planes.values():
-                            # TODO This is slow
-                            new_legs = []
-                            for legs in plane.legs:
-                                filtered_ce = [
-                                    ce
-                                    for ce in legs.cargo_edges
-                                    if ce.cargo_id != cargo_id
-                                ]
-                                if len(filtered_ce) > 0:
-                                    new_legs.append(Leg.construct(filtered_ce))
-                            plane.legs = new_legs
                         continue
 
                     # Unload cargo where the next CargoEdge is not an available destination
@@ -116,12 +210,7 @@ class MySolution(Solution):
                         cur_weight -= cargo.weight
 
                 # load
-                for cargo in (
-                    ObservationHelper.get_active_cargo_info(
-                        global_state, cargo_at_current_airport
-                    )
-                    or []
-                ):
+                for cargo in view.cargo_by_airport[current_airport]:
                     if plane.has_legs():
                         for ce in plane.legs[0].cargo_edges:
                             if (
@@ -144,19 +233,20 @@ class MySolution(Solution):
                     if cargo_missing and can_wait:
                         cargo_to_load = []
 
-                priority = self.calculate_priority(plane.get_next_deadline())
+                priority = self.calculate_priority(next_deadline)
                 if len(cargo_to_load) > 0:
-                    print(
-                        f"[{self.current_time}] Loading {cargo_to_load} on {a} at {current_airport} lp {plane.legs[0].lp}"
+                    trace.info(
+                        "Loading %s on %s at %s lp %s",
+                        tuple(cargo_to_load),
+                        a,
+                        current_airport,
+                        plane.legs[0].lp,
                     )
 
                 if len(cargo_to_unload) > 0:
-                    ce_to_unload = [
-                        ce
-                        for ce in self.planning.cargo_edges.cargo_edges
-                        if ce.cargo_id in cargo_to_unload
-                        and ce.origin == current_airport
-                    ]
+                    ce_to_unload = self.planning.cargo_edges.originating_at(
+                        current_airport, cargo_to_unload
+                    )
                     next_cargo_deadline = min(
                         (ce.lp for ce in ce_to_unload), default=None
                     )
@@ -164,8 +254,13 @@ class MySolution(Solution):
                     priority = min(
                         priority, self.calculate_priority(next_cargo_deadline)
                     )
-                    print(
-                        f"[{self.current_time}] Unloading {cargo_to_unload} from {a} at {current_airport} lp {next_cargo_deadline}"
+                    deadlines.append(next_cargo_deadline)
+                    trace.info(
+                        "Unloading %s from %s at %s lp %s",
+                        tuple(cargo_to_unload),
+                        a,
+                        current_airport,
+                        next_cargo_deadline,
                     )
 
                 actions[a] = {
@@ -174,12 +269,13 @@ class MySolution(Solution):
                     "cargo_to_unload": cargo_to_unload,
                     "destination": NOAIRPORT_ID,
                 }
+                instrumentation.record("load_unload_ms", load_unload_start)
 
             if (
                 plane_state == PlaneState.READY_FOR_TAKEOFF
                 and len(cargo_to_load) + len(cargo_to_unload) == 0
             ):
-
+                dispatch_start = instrumentation.clock()
                 ce_onboard = []
                 should_depart = False
                 if plane.has_legs():
@@ -199,24 +295,29 @@ class MySolution(Solution):
                     ce = plane.legs[0].cargo_edges[0]
                     destination = ce.destination
                     actions[a] = {
-                        "priority": self.calculate_priority(plane.get_next_deadline()),
+                        "priority": self.calculate_priority(next_deadline),
                         "cargo_to_load": [],
                         "cargo_to_unload": [],
                         "destination": ce.destination,
                     }
-                    print(
-                        f"[{self.current_time}] Sending {a} to {destination} for {ce}"
+                    trace.info(
+                        "Sending %s to %s for cargo %s hop %s",
+                        a,
+                        destination,
+                        ce.cargo_id,
+                        ce.sequence,
                     )
                     for ce in ce_onboard:
                         if ce.destination == destination:
-                            # Remove them from legs as they are being executed
-                            plane.legs[0].remove(ce)
+                            # Remove them from legs as they are being executed, empty
+                            # legs are dropped
+                            self.planning.remove_cargo_edge(ce)
                         else:
-                            print(
-                                f"WARNING: plane being dispatched to {destination} with {ce} onboard"
+                            trace.warning(
+                                "plane being dispatched to %s with %s onboard",
+                                destination,
+                                ce,
                             )
-                    if len(plane.legs[0].cargo_edges) == 0:
-                        plane.legs.pop(0)
 
                 # destination to first CargoEdge origin assigned
                 if len(ce_onboard) == 0 and plane.has_legs():
@@ -226,60 +327,101 @@ class MySolution(Solution):
                             # Stay here until the cargo is loaded
                             destination = NOAIRPORT_ID
                             actions[a] = {
-                                "priority": self.calculate_priority(
-                                    plane.get_next_deadline()
-                                ),
+                                "priority": self.calculate_priority(next_deadline),
                                 "cargo_to_load": [],
                                 "cargo_to_unload": [],
                                 "destination": NOAIRPORT_ID,
                             }
-                            # print(f"{a} waiting at {current_airport} for {ce}")
+                            trace.debug(
+                                "%s waiting at %s for cargo %s hop %s",
+                                a,
+                                current_airport,
+                                ce.cargo_id,
+                                ce.sequence,
+                            )
                             break
 
-                        path = self.path_matrices[plane_type].get_path(
-                            current_airport, ce.origin
-                        )
-                        if path[1] in available_destinations:
-                            # Head to it
-                            destination = path[1]
+                        with instrumentation.span("next_hop_ms"):
+                            hop = self.next_hops[plane_type].next_hop(
+                                current_airport, ce.origin, available_destinations
+                            )
+                        if hop is not None:
+                            # Head to it, around the routes that are down
+                            destination = hop
                             actions[a] = {
-                                "priority": self.calculate_priority(
-                                    plane.get_next_deadline()
-                                ),
+                                "priority": self.calculate_priority(next_deadline),
                                 "cargo_to_load": [],
                                 "cargo_to_unload": [],
                                 "destination": destination,
                             }
-                            print(
-                                f"[{self.current_time}] Sending {a} on {path} to pickup {ce}"
+                            trace.info(
+                                "Sending %s to %s to pickup cargo %s hop %s at %s",
+                                a,
+                                destination,
+                                ce.cargo_id,
+                                ce.sequence,
+                                ce.origin,
                             )
                             break
                         else:
-                            print(f"WARNING: {a} cannot go on {path} to pickup {ce}")
+                            # the routes there are down, wait for one to recover
+                            trace.warning(
+                                "%s has no available route to pickup %s", a, ce
+                            )
+                instrumentation.record("dispatch_ms", dispatch_start)
             if a not in actions:
                 noop_action = ActionHelper.noop_action()
-                noop_action["priority"] = self.calculate_priority(
-                    plane.get_next_deadline()
-                )
+                noop_action["priority"] = self.calculate_priority(next_deadline)
                 actions[a] = noop_action
+            if self.event_driven and self.planning.version == version:
+                # not kept if the agent was dispatched, its first leg changed
+                self._decisions[a] = (
+                    key,
+                    _wake_time(plane, self.current_time),
+                    actions[a],
+                    deadlines,
+                )
         self.current_time += 1
+        instrumentation.end_step()
         return actions
 
 
-class PathMatrix:
-    def __init__(self, graph: nx.graph) -> None:
-        self.graph: nx.graph = graph
-        self._matrix: Dict[Tuple[int, int], List[int]] = {}
-
-    def _compute_shortest_path(self, orig: int, dest: int, from_to: Tuple[int, int]):
-        path = nx.shortest_path(self.graph, orig, dest, weight="cost")
-        self._matrix[from_to] = path
-        for sub_ind in range(1, len(path) - 1):
-            sub_from_to = (path[sub_ind], dest)
-            self._matrix[sub_from_to] = path[sub_ind : len(path)]
-
-    def get_path(self, orig: int, dest: int):
-        from_to = (orig, dest)
-        if from_to not in self._matrix:
-            self._compute_shortest_path(orig, dest, from_to)
-        return self._matrix[from_to]
+def _decision_key(agent, plane, view) -> tuple:
+    # what the decision for an agent depends on, besides the time
+    leg = plane.legs[0] if plane.has_legs() else None
+    return (
+        agent["state"],
+        agent["current_airport"],
+        agent["current_weight"],
+        tuple(agent["cargo_onboard"]),
+        tuple(cargo_id in view.active_cargo for cargo_id in agent["cargo_onboard"]),
+        tuple(cargo.id for cargo in view.cargo_by_airport[agent["current_airport"]]),
+        tuple(agent["available_routes"]),
+        (
+            None
+            if leg is None
+            else (
+                id(leg),
+                leg.lp,
+                tuple(
+                    (ce.cargo_id, ce.sequence, ce.origin, ce.destination, ce.lp)
+                    for ce in leg.cargo_edges
+                ),
+            )
+        ),
+    )
+
+
+def _wake_time(plane, now: int) -> int:
+    # the first time the cargo of the first leg can no longer wait or has to depart
+    if not plane.has_legs():
+        return BIG_TIME
+    return min(
+        (
+            time
+            for ce in plane.legs[0].cargo_edges
+            for time in (ce.lp, ce.lp + 20)
+            if time > now
+        ),
+        default=BIG_TIME,
+    )
@@ -0,0 +1,72 @@
+from __future__ import annotations
+
+from typing import Dict, List, Optional, Set, Tuple
+
+from solution.common import is_route_available
+
+
+class StepView:
+    # the global state of one step indexed once, for the lookups the policies and the
+    # model make per agent and per cargo
+    def __init__(self, obs) -> None:
+        self.global_state = next(iter(obs.values()))["globalstate"]
+        self.route_map = self.global_state["route_map"]
+        self.new_cargo = self.global_state["event_new_cargo"]
+        # in the order of the observation
+        self.active_cargo: Dict[int, object] = {
+            cargo.id: cargo for cargo in self.global_state["active_cargo"]
+        }
+        self._position = {cargo_id: i for i, cargo_id in enumerate(self.active_cargo)}
+        # active cargo at the airports that have a plane, as get_active_cargo_info
+        # returns it for cargo_at_current_airport (planes in the air see none)
+        cargo_ids_by_airport: Dict[int, Set[int]] = {}
+        for agent in obs.values():
+            cargo_ids_by_airport.setdefault(agent["current_airport"], set()).update(
+                agent["cargo_at_current_airport"]
+            )
+        self.cargo_by_airport: Dict[int, List] = {
+            airport: self.cargo_info(cargo_ids)
+            for airport, cargo_ids in cargo_ids_by_airport.items()
+        }
+
+        # routes that are down per plane type, and the ones that are down in all route
+        # maps, see get_unavailable_routes
+        self.unavailable_routes_by_type: Dict[int, Set[Tuple[int, int]]] = {}
+        available = set()
+        for plane_type, graph in self.route_map.items():
+            unavailable = set()
+            for orig, dest, data in graph.edges(data=True):
+                if is_route_available(data):
+                    available.add((orig, dest))
+                else:
+                    unavailable.add((orig, dest))
+            self.unavailable_routes_by_type[plane_type] = unavailable
+        self.unavailable_routes: Set[Tuple[int, int]] = (
+            set().union(*self.unavailable_routes_by_type.values()) - available
+        )
+
+    def cargo_info(self, cargo_ids) -> List:
+        # the active cargo among cargo_ids, in the order of the observation
+        return sorted(
+            (
+                self.active_cargo[cargo_id]
+                for cargo_id in cargo_ids
+                if cargo_id in self.active_cargo
+            ),
+            key=lambda cargo: self._position[cargo.id],
+        )
+
+
+class ViewCache:
+    # the view of the last global state a model was given, every model has its own so
+    # episodes evaluated side by side never see each other's state
+    def __init__(self) -> None:
+        self._last: Optional[Tuple[dict, StepView]] = None
+
+    def get(self, obs, refresh: bool = False) -> StepView:
+        # the view of the global state of obs, built on its first use, the solution
+        # refreshes it at the start of every step in case the state is updated in place
+        global_state = next(iter(obs.values()))["globalstate"]
+        if refresh or self._last is None or self._last[0] is not global_state:
+            self._last = (global_state, StepView(obs))
+        return self._last[1]
@@ -0,0 +1,79 @@
+from __future__ import annotations
+
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List, Optional, Set
+
+from solution.search import LocalSearch
+from solution.strategic import Model
+
+
+class BackgroundReplanner:
+    # plans new cargo on a copy of the model in a worker thread while the solution keeps
+    # executing the current planning, the copy is handed out once it is done and has
+    # caught up with what was executed or dropped in the meantime, the worker runs
+    # under the GIL so it still takes time from the steps it overlaps
+    def __init__(self, model: Model) -> None:
+        self.model = model
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="replan")
+        self._future: Optional[Future] = None
+        # new cargo that arrived while the worker was busy
+        self._pending: List = []
+        # the rows of the planned cargo edges and the cargo of the planning the running
+        # replan started from, the copy has the same rows
+        self._assigned: Set[int] = set()
+        self._cargo_ids: Set[int] = set()
+
+    def submit(self, obs) -> None:
+        # queue the new cargo of the observation, starts a replan if none is running
+        self._pending.extend(self.model.views.get(obs).new_cargo)
+        if self._future is None and len(self._pending) > 0:
+            planning = self.model.planning
+            self._assigned = planning.assigned_rows()
+            self._cargo_ids = planning.cargo_edges.cargo_ids()
+            cargos, self._pending = self._pending, []
+            self._future = self._executor.submit(
+                _replan, self.model.fork(), obs, cargos
+            )
+
+    def poll(self, obs, now: int) -> Optional[Model]:
+        # the replanned model once it is ready, to be used from now on, None while the
+        # worker is busy or idle
+        if self._future is None or not self._future.done():
+            return None
+        model = self._future.result()
+        self._future = None
+        model.views = self.model.views
+        # the worker planned on a snapshot of the paths, the live ones know the routes
+        # that went down since
+        model.paths = self.model.paths
+        model.search = LocalSearch(model.paths, model.plane_type_map)
+        self._reconcile(model)
+        # the copy still flies the routes that went down while the worker was busy
+        model.repair(obs, model.paths.unavailable_routes, now)
+        self.model = model
+        return model
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _reconcile(self, model: Model) -> None:
+        # drop what the current planning lost while the worker was busy: the cargo that
+        # was missed and the cargo edges that were executed
+        current = self.model.planning
+        planning = model.planning
+        cancelled = self._cargo_ids - current.cargo_edges.cargo_ids()
+        if len(cancelled) > 0:
+            planning.cancel_cargo(cancelled)
+        # by row, a detour renumbers the later cargo edges of its cargo in either of the
+        # plannings
+        for row in self._assigned - current.assigned_rows():
+            ce = planning.cargo_edges.at(row)
+            if ce.cargo_id not in cancelled and planning.is_assigned(
+                ce.cargo_id, ce.sequence
+            ):
+                planning.remove_cargo_edge(ce)
+
+
+def _replan(model: Model, obs, cargos) -> Model:
+    model.plan_new_cargo(obs, cargos)
+    return model
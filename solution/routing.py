@@ -0,0 +1,96 @@
+from __future__ import annotations
+
+from typing import Iterable, List, Optional
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+
+from solution.matrixcache import MatrixCache, fingerprint
+
+# first hops kept per pair of airports
+ALTERNATIVES = 3
+
+
+class NextHopTable:
+    # per pair of airports the first hops of a plane type ranked by the cost of the
+    # cheapest path through them that does not come back, so a plane can take the next
+    # one when the route of the best one is down, computed on the full route map
+    def __init__(
+        self,
+        graph,
+        alternatives: int = ALTERNATIVES,
+        cache: Optional[MatrixCache] = None,
+    ) -> None:
+        self.graph = graph
+        # lookups that found an available first hop, and the ones that did not
+        self.hits = 0
+        self.misses = 0
+        arrays = None
+        if cache is not None:
+            key = fingerprint(f"next_hops_{alternatives}", {0: graph}, ("cost",))
+            arrays = cache.load(key)
+        if arrays is None:
+            arrays = self._compute(alternatives)
+            if cache is not None:
+                cache.store(key, arrays)
+        self._nodes: List[int] = arrays["nodes"].tolist()
+        self._index = {node: i for i, node in enumerate(self._nodes)}
+        # orig x dest x rank -> index of the first hop, -1 if there are no more
+        self._hops = arrays["hops"]
+
+    def next_hops(self, orig: int, dest: int) -> List[int]:
+        # first hops from orig towards dest, best first
+        i, j = self._index.get(orig), self._index.get(dest)
+        if i is None or j is None:
+            return []
+        return [self._nodes[k] for k in self._hops[i, j] if k >= 0]
+
+    def next_hop(self, orig: int, dest: int, available: Iterable[int]) -> Optional[int]:
+        # the best first hop that is one of the available destinations
+        available = set(available)
+        for hop in self.next_hops(orig, dest):
+            if hop in available:
+                self.hits += 1
+                return hop
+        self.misses += 1
+        return None
+
+    def _compute(self, alternatives: int) -> dict:
+        nodes = list(self.graph.nodes)
+        index = {node: i for i, node in enumerate(nodes)}
+        n = len(nodes)
+        hop_cost = np.full((n, n), np.inf)
+        for orig, dest, data in self.graph.edges(data=True):
+            i, j = index[orig], index[dest]
+            hop_cost[i, j] = min(hop_cost[i, j], data["cost"])
+        rows, cols = np.nonzero(np.isfinite(hop_cost))
+
+        hops = np.full((n, n, alternatives), -1, dtype=np.int32)
+        for i in range(n):
+            successors = np.flatnonzero(np.isfinite(hop_cost[i]))
+            if len(successors) == 0:
+                continue
+            # paths on from a first hop must not come back through i, the plane takes
+            # another first hop because the route to the best one is down and a path
+            # through i would take it again
+            keep = (rows != i) & (cols != i)
+            cost = dijkstra(
+                csr_matrix(
+                    (hop_cost[rows[keep], cols[keep]], (rows[keep], cols[keep])),
+                    shape=(n, n),
+                ),
+                directed=True,
+                indices=successors,
+            )
+            # successor x dest: cost of the cheapest path through that first hop
+            through = hop_cost[i, successors][:, None] + cost
+            order = np.argsort(through, axis=0, kind="stable")[:alternatives]
+            ranked = np.where(
+                np.isfinite(np.take_along_axis(through, order, axis=0)),
+                successors[order],
+                -1,
+            )
+            hops[i, :, : len(ranked)] = ranked.T
+            hops[i, i] = -1
+        return {"nodes": np.array(nodes, dtype=np.int64), "hops": hops}
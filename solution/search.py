@@ -0,0 +1,244 @@
+from __future__ import annotations
+
+from collections import defaultdict
+from itertools import combinations, permutations
+from time import perf_counter
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from solution.common import (
+    CargoEdge,
+    Leg,
+    PathCache,
+    Plane,
+    PlaneTypeMap,
+    Planning,
+    tw_overlap,
+)
+from solution.evaluation import PlanEvaluator
+from solution.windows import Change, TimeWindows
+
+# undelivered cargo, delivered cargo that misses its deadline, lateness of the cargo
+# edges, flying time (including flying empty to the next leg) and minus the sum of
+# squared leg sizes, lower is better, the last one favours fuller legs
+Cost = Tuple[int, int, int, int, int]
+
+
+class LocalSearch:
+    # anytime improvement of a planning: relocate cargo edges to a leg on the same
+    # edge, merge such legs and swap legs between planes, the first leg of a plane
+    # (the one being executed) is never changed
+    def __init__(self, path_cache: PathCache, plane_type_map: PlaneTypeMap) -> None:
+        self.path_cache = path_cache
+        self.plane_type_map = plane_type_map
+        self._planning: Optional[Planning] = None
+        self._moves: Optional[Iterator[Tuple]] = None
+        self._improved = False
+        # version of the planning after a pass without improvements
+        self._idle_version: Optional[int] = None
+        # cost of the planning at a version
+        self._cost: Optional[Cost] = None
+        self._cost_version: Optional[int] = None
+        # plane id -> airport the plane is at or flies to and when it is there
+        self._positions: Optional[Dict[str, Tuple[int, int]]] = None
+
+    def run(
+        self,
+        planning: Planning,
+        windows: TimeWindows,
+        budget: float,
+        now: int,
+        positions: Optional[Dict[str, Tuple[int, int]]] = None,
+    ) -> int:
+        # try moves for budget seconds, continues with the same pass on the next
+        # call, returns the number of moves applied
+        deadline = perf_counter() + budget
+        if planning is not self._planning:
+            self._planning = planning
+            self._moves = None
+            self._idle_version = None
+        # the planes moved since the last call
+        self._positions = positions
+        self._cost_version = None
+        applied = 0
+        while perf_counter() < deadline:
+            if self._moves is None:
+                if planning.version == self._idle_version:
+                    break
+                self._moves = self._neighbourhood(planning)
+                self._improved = False
+            move = next(self._moves, None)
+            if move is None:
+                self._moves = None
+                if not self._improved:
+                    self._idle_version = planning.version
+                continue
+            if self._try(planning, windows, move, now):
+                applied += 1
+                self._improved = True
+        return applied
+
+    def _neighbourhood(self, planning: Planning) -> Iterator[Tuple]:
+        planes = list(planning.planes.values())
+        by_edge: Dict[Tuple[int, int], List[Tuple[Plane, Leg]]] = defaultdict(list)
+        for plane in planes:
+            for leg in plane.legs[1:]:
+                edge = _edge(leg)
+                if edge is not None:
+                    by_edge[edge].append((plane, leg))
+
+        for legs in by_edge.values():
+            for (plane, leg), (other_plane, other_leg) in permutations(legs, 2):
+                # the whole leg first, then its cargo edges one by one
+                yield (other_plane, other_leg, plane, leg, list(other_leg.cargo_edges))
+                for ce in list(other_leg.cargo_edges):
+                    yield (other_plane, other_leg, plane, leg, [ce])
+
+        for plane, other_plane in combinations(planes, 2):
+            for leg in plane.legs[1:]:
+                for other_leg in other_plane.legs[1:]:
+                    yield (plane, leg, other_plane, other_leg)
+
+    def _try(
+        self, planning: Planning, windows: TimeWindows, move: Tuple, now: int
+    ) -> bool:
+        if len(move) == 5:
+            source, source_leg, target, target_leg, ces = move
+            if not self._is_relocatable(source, source_leg, target, target_leg, ces):
+                return False
+            planes = (source, target)
+        else:
+            plane, leg, other_plane, other_leg = move
+            if not self._is_swappable(plane, leg, other_plane, other_leg):
+                return False
+            planes = (plane, other_plane)
+        if self._cost_version != planning.version:
+            self._cost = self._evaluate(planning, windows, now)
+            self._cost_version = planning.version
+
+        # the move is tried on a fork, which only copies the planes it changes
+        candidate = planning.fork()
+        if len(move) == 5:
+            for ce in ces:
+                candidate.move_cargo_edge(ce, target, target_leg)
+        else:
+            candidate.swap_legs(plane, leg, other_plane, other_leg)
+        cost = self._evaluate(candidate, windows, now)
+        if cost is None or self._cost is None or not cost < self._cost:
+            return False
+
+        # the windows of the cargo edges are only narrowed once the move is taken,
+        # which can make it late after all
+        snapshot = _Snapshot(planes)
+        planning.commit(candidate)
+        changes: List[Change] = []
+        if len(move) == 5 and len(windows.propagate(target_leg, changes)) > 0:
+            cost = None
+        elif len(changes) > 0:
+            cost = self._evaluate(planning, windows, now)
+        if cost is None or not cost < self._cost:
+            windows.undo(changes)
+            snapshot.restore(planning)
+            self._cost_version = planning.version
+            return False
+        self._cost = cost
+        self._cost_version = planning.version
+        return True
+
+    def _is_relocatable(
+        self,
+        source: Plane,
+        source_leg: Leg,
+        target: Plane,
+        target_leg: Leg,
+        ces: List[CargoEdge],
+    ) -> bool:
+        if source_leg is target_leg or not _is_open(source, source_leg):
+            return False
+        if not _is_open(target, target_leg):
+            return False
+        if any(ce not in source_leg.cargo_edges for ce in ces):
+            return False
+        weight = sum(ce.weight for ce in target_leg.cargo_edges + ces)
+        return weight <= target.max_weight and all(
+            tw_overlap(target_leg.ep, target_leg.lp, ce.ep, ce.lp) for ce in ces
+        )
+
+    def _is_swappable(
+        self, plane: Plane, leg: Leg, other_plane: Plane, other_leg: Leg
+    ) -> bool:
+        if not _is_open(plane, leg) or not _is_open(other_plane, other_leg):
+            return False
+        for flying, carried in ((plane, other_leg), (other_plane, leg)):
+            if not all(flying.flies(ce) for ce in carried.cargo_edges):
+                return False
+            if sum(ce.weight for ce in carried.cargo_edges) > flying.max_weight:
+                return False
+        return True
+
+    def _evaluate(
+        self, planning: Planning, windows: TimeWindows, now: int
+    ) -> Optional[Cost]:
+        # None if legs wait on each other in a circle
+        estimate = PlanEvaluator(
+            self.path_cache, windows.processing_time, self.plane_type_map
+        ).evaluate(planning, now, positions=self._positions)
+        if estimate is None:
+            return None
+        return (
+            estimate.undelivered,
+            estimate.missed,
+            estimate.lateness,
+            estimate.flying_time,
+            estimate.fullness,
+        )
+
+
+class _Snapshot:
+    # what a move can change besides the windows propagate logs: the legs of its
+    # planes, their cargo edges and windows, and where the planes plan from
+    def __init__(self, planes: Tuple[Plane, ...]) -> None:
+        self.planes = [
+            (
+                plane,
+                [(leg, list(leg.cargo_edges), leg.ep, leg.lp) for leg in plane.legs],
+                plane.location,
+                plane.next_destination,
+                plane.cur_weight,
+                set(plane.cargo_ids),
+            )
+            for plane in _distinct(planes)
+        ]
+
+    def restore(self, planning: Planning) -> None:
+        for _, legs, *_ in self.planes:
+            for leg, cargo_edges, ep, lp in legs:
+                leg.cargo_edges = cargo_edges
+                leg.ep, leg.lp = ep, lp
+        for (
+            plane,
+            legs,
+            location,
+            next_destination,
+            cur_weight,
+            cargo_ids,
+        ) in self.planes:
+            planning.set_legs(plane, [leg for leg, *_ in legs])
+            plane.location = location
+            plane.next_destination = next_destination
+            plane.cur_weight = cur_weight
+            plane.cargo_ids = cargo_ids
+
+
+def _edge(leg: Leg) -> Optional[Tuple[int, int]]:
+    # origin and destination if all cargo edges of the leg fly the same edge
+    edges = {(ce.origin, ce.destination) for ce in leg.cargo_edges}
+    return next(iter(edges)) if len(edges) == 1 else None
+
+
+def _distinct(planes: Tuple[Plane, ...]) -> List[Plane]:
+    return list({plane.id: plane for plane in planes}.values())
+
+
+def _is_open(plane: Plane, leg: Leg) -> bool:
+    # planned on the plane, but not its first leg
+    return any(other is leg for other in plane.legs[1:])
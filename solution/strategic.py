@@ -1,8 +1,12 @@
-from collections import OrderedDict
-import math
-from typing import Dict, Iterable, List, Optional, Tuple
+import copy
+from itertools import accumulate
+from typing import Dict, Iterable, List, Optional, Set, Tuple, Union
+
+import networkx as nx
+import numpy as np
 from airlift.envs.airlift_env import ObservationHelper
 from solution.common import (
+    BIG_TIME,
     CargoEdge,
     CargoEdges,
     Leg,
@@ -11,47 +15,206 @@ from solution.common import (
     PlaneTypeMap,
     Planning,
 )
+from solution.fleet import CandidateIndex, FleetScorer, LegIndex
+from solution.instrument import instrumentation
+from solution.matrixcache import MatrixCache
+from solution.observation import ViewCache
+from solution.search import LocalSearch
+from solution.trace import trace
+from solution.windows import Change, TimeWindows
 
 
 class Model:
-    def __init__(self) -> None:
-        pass
+    def __init__(
+        self,
+        incremental: bool = True,
+        vectorized: bool = False,
+        search_budget: float = 0.0,
+        matrix_cache: Optional[MatrixCache] = None,
+        consolidate: bool = True,
+    ) -> None:
+        # insert new cargo into the existing planning instead of re-assigning everything
+        self.incremental = incremental
+        # score the whole fleet with arrays instead of walking the candidate index
+        self.vectorized = vectorized
+        # seconds per step to improve the planning with local search, 0 to disable
+        self.search_budget = search_budget
+        # on-disk cache of the path matrices and reachability labels, shared by the
+        # episodes on the same route maps
+        self.matrix_cache = matrix_cache
+        # let a cargo edge join any planned leg on its edge, not only the last leg of
+        # a plane
+        self.consolidate = consolidate
+        # the indexed global state of the current step
+        self.views = ViewCache()
 
     def create_planning(self, obs) -> Planning:
         global_state = next(iter(obs.values()))["globalstate"]
         self.processing_time = global_state["scenario_info"][0].processing_time
         graph = ObservationHelper.get_multidigraph(global_state)
-        self.paths = PathCache(graph)
-        self.plane_type_map = PlaneTypeMap(global_state["route_map"])
+        self.paths = PathCache(graph, cache=self.matrix_cache)
+        self.plane_type_map = PlaneTypeMap(
+            global_state["route_map"], cache=self.matrix_cache
+        )
+        self.search = LocalSearch(self.paths, self.plane_type_map)
         self.cargo_edges = self._create_cargo_edges(obs)
-        self.planes = self._create_assignments(obs)
+        self._create_assignments(obs)
         # print_cargo_edges(self.cargo_edges)
-        # print_planes(self.planes.values())
-        return Planning(self.cargo_edges, self.planes)
+        # print_planes(self.planning.planes.values())
+        return self.planning
 
-    def update_planning(self, obs) -> Optional[Planning]:
-        # TODO: we should probably put the planning in the model so it's more straightforward
-        # Update the palnning for new cargo
-        global_state = next(iter(obs.values()))["globalstate"]
-        new_cargos = global_state["event_new_cargo"]
+    def update_planning(
+        self, obs, full_rebuild: bool = False, now: int = 0
+    ) -> Optional[Planning]:
+        # Update the planning for new cargo, None if there was none, legs on routes
+        # that went down are repaired in place in the current planning either way
+        self.repair(obs, self.update_routes(obs), now)
+        return self.plan_new_cargo(obs, self.views.get(obs).new_cargo, full_rebuild)
+
+    def update_routes(self, obs) -> Set[Tuple[int, int]]:
+        # returns the routes that went down since the last update
+        return self.paths.set_unavailable_routes(self.views.get(obs).unavailable_routes)
+
+    def repair(self, obs, routes: Set[Tuple[int, int]], now: int) -> int:
+        # planned legs on a route that is down fly around it if that is faster than
+        # waiting for the route, the rest of the planning stays as it is, returns the
+        # number of legs that got a detour
+        if len(routes) == 0:
+            return 0
+        route_map = self.views.get(obs).route_map
+        repaired = 0
+        for plane in self.planning.planes.values():
+            for leg in list(plane.legs):
+                edges = {(ce.origin, ce.destination) for ce in leg.cargo_edges}
+                if len(edges) == 1 and edges <= routes:
+                    route = next(iter(edges))
+                    graph = route_map[plane.type]
+                    recovery = graph.get_edge_data(*route, {})
+                    repaired += self._detour(
+                        plane, leg, graph, recovery.get("mal", 0), now
+                    )
+        instrumentation.count("legs_repaired", repaired)
+        return repaired
+
+    def _detour(
+        self, plane: Plane, leg: Leg, graph: nx.DiGraph, downtime: int, now: int
+    ) -> bool:
+        # split the leg into a leg per hop of the path around its route on the routes
+        # of the plane type, the later cargo edges of its cargo are renumbered
+        first = leg.cargo_edges[0]
+        down = self.paths.unavailable_routes | {(first.origin, first.destination)}
+        available = nx.subgraph_view(
+            graph, filter_edge=lambda orig, dest: (orig, dest) not in down
+        )
+        try:
+            path = nx.shortest_path(
+                available, first.origin, first.destination, weight="cost"
+            )
+        except (nx.NetworkXNoPath, nx.NodeNotFound):
+            return False
+        hops = list(zip(path, path[1:]))
+        allowed = [self.plane_type_map.plane_type_mask(*hop) for hop in hops]
+        durations = [graph.edges[hop]["time"] + self.processing_time for hop in hops]
+        # without a known downtime the route is assumed to stay down
+        recovery = now + downtime if downtime > 0 else BIG_TIME
+        direct = max(leg.ep, recovery) + first.duration
+        detour = leg.ep + sum(durations) + (len(hops) - 1) * self.processing_time
+        if detour >= direct:
+            return False
+        # the last hop has to leave in time for the next cargo edge of the cargo, as
+        # the leg had, the hops before it in time for the next hop
+        latest = {}
+        for ce in leg.cargo_edges:
+            latest[ce.row] = list(
+                accumulate(
+                    reversed(durations),
+                    lambda lp, duration: lp - duration - self.processing_time,
+                    initial=ce.lp + ce.duration + self.processing_time,
+                )
+            )[:0:-1]
+            if ce.ep > latest[ce.row][0]:
+                return False
+
+        legs: List[List[CargoEdge]] = [[] for _ in hops[1:]]
+        for ce in list(leg.cargo_edges):
+            self.planning.shift_sequence(ce.cargo_id, ce.sequence, len(hops) - 1)
+            offset = 0
+            for i, (orig, dest) in enumerate(hops[1:]):
+                offset += durations[i] + self.processing_time
+                legs[i].append(
+                    self.cargo_edges.create(
+                        ce.cargo_id,
+                        orig,
+                        dest,
+                        durations[i + 1],
+                        ce.sequence + i + 1,
+                        ce.ep + offset,
+                        latest[ce.row][i + 1],
+                        ce.weight,
+                        allowed[i + 1],
+                    )
+                )
+            # the cargo edge itself becomes the first hop
+            ce.destination = hops[0][1]
+            ce.duration = durations[0]
+            ce.lp = latest[ce.row][0]
+            ce.plane_type_mask = allowed[0]
+        leg.update_window()
+        new_legs = [Leg.construct(ces) for ces in legs]
+        self.planning.insert_legs(plane, leg, new_legs)
+        for each in [leg] + new_legs:
+            if len(self.windows.propagate(each)) > 0:
+                instrumentation.count("detours_late")
+        trace.info(
+            "Detour %s for %s with cargo %s",
+            tuple(path),
+            plane.id,
+            tuple(ce.cargo_id for ce in leg.cargo_edges),
+        )
+        return True
+
+    def plan_new_cargo(
+        self, obs, new_cargos, full_rebuild: bool = False
+    ) -> Optional[Planning]:
+        # the planning with the new cargo, None if there is none and no rebuild was
+        # asked for
         if len(new_cargos) > 0:
-            self.cargo_edges = self._add_cargo_edges_from_cargos(
+            new_cargo_edges = self._add_cargo_edges_from_cargos(
                 self.cargo_edges, new_cargos
             )
-            self.planes = self._create_assignments(obs)
-            return Planning(self.cargo_edges, self.planes)
-        # TODO: Do something to return a modified planning if malfunctions happen...
+            if self.incremental and not full_rebuild:
+                # the edges that can not be placed stay unplanned as in a rebuild,
+                # which tends to leave more of them unplanned
+                for ce in self._insert_cargo_edges(obs, new_cargo_edges):
+                    trace.warning("No plane found for ce %s", ce)
+                return self.planning
+            full_rebuild = True
+        if full_rebuild:
+            return self._create_assignments(obs)
+
+    def fork(self) -> "Model":
+        # copy with its own cargo edges, planning, windows and path cache to plan in
+        # another thread, the plane type map is not changed after it is built and is
+        # shared
+        model = copy.copy(self)
+        model.cargo_edges = self.cargo_edges.copy()
+        model.planning = self.planning.copy(model.cargo_edges)
+        model.paths = self.paths.copy()
+        model.windows = TimeWindows(model.planning, self.processing_time)
+        model.search = LocalSearch(model.paths, self.plane_type_map)
+        model.views = ViewCache()
+        return model
 
     def _create_cargo_edges(self, obs) -> CargoEdges:
         global_state = next(iter(obs.values()))["globalstate"]
-        cargo_edges = self._add_cargo_edges_from_cargos(
-            CargoEdges(), global_state["active_cargo"]
-        )
+        cargo_edges = CargoEdges()
+        self._add_cargo_edges_from_cargos(cargo_edges, global_state["active_cargo"])
         return cargo_edges
 
     def _add_cargo_edges_from_cargos(
         self, cargo_edges: CargoEdges, cargos
-    ) -> CargoEdges:
+    ) -> List[CargoEdge]:
+        added = []
         for cargo in cargos:
             shortest_path = self.paths.get_path(cargo.location, cargo.destination)
 
@@ -75,8 +238,8 @@ class Model:
                 latest_pickup -= (
                     self.processing_time + travel_time + self.processing_time
                 )
-                cargo_edges.add(
-                    CargoEdge(
+                added.append(
+                    cargo_edges.create(
                         cargo.id,
                         orig,
                         dest,
@@ -85,15 +248,14 @@ class Model:
                         earliest_pickup,
                         latest_pickup,
                         cargo.weight,
-                        self.plane_type_map.get_allowable_plane_types(orig, dest),
+                        self.plane_type_map.plane_type_mask(orig, dest),
                     )
                 )
                 sequence -= 1
-        return cargo_edges
+        return added
 
-    def _create_assignments(self, obs) -> Dict[str, Plane]:
-        ce_plane_map: Dict[Tuple[int, int], str] = dict()
-        planes: Dict[int, Plane] = dict()
+    def _create_assignments(self, obs) -> Planning:
+        planes: Dict[str, Plane] = dict()
         for a_id, agent in obs.items():
             planes[a_id] = Plane(
                 a_id,
@@ -103,130 +265,188 @@ class Model:
                 agent["max_weight"],
             )
 
-        for ce in sorted(
-            self.cargo_edges.cargo_edges,
-            key=lambda ce: (math.floor(ce.ep / 30), ce.sequence),
-        ):
-            sorted_planes = sorted(
-                [p for p in planes.values() if p.type in ce.allowed_plane_types],
-                key=lambda p: p.matches(ce, self.paths),
-            )
-            found = False
-            for plane in sorted_planes:
-                if plane.can_service(ce, self.paths, self.plane_type_map):
-                    (ep_diff_ce, lp_diff_ce, ep_diff_leg, lp_diff_leg) = (
-                        plane.add_cargo_edge(ce, self.paths)
-                    )
-                    ce_plane_map[(ce.cargo_id, ce.sequence)] = plane.id
-                    leg = plane.legs[-1]
-                    self.update_ep_lp(
-                        (ep_diff_ce, lp_diff_ce, ep_diff_leg, lp_diff_leg),
-                        ce,
-                        leg,
-                        planes,
-                        ce_plane_map,
-                    )
-                    found = True
-                    break
-            if not found:
-                print(f"No plane found for ce {ce}")
+        self.planning = Planning(self.cargo_edges, planes)
+        self.windows = TimeWindows(self.planning, self.processing_time)
+        for ce in self._assign_cargo_edges(self.cargo_edges.cargo_edges):
+            trace.warning("No plane found for ce %s", ce)
 
-        return planes
+        return self.planning
 
-    def update_ep_lp(
-        self,
-        changes: Tuple[int, int, int, int],
-        cur_ce: CargoEdge,
-        cur_leg: Leg,
-        planes: List[Plane],
-        ce_plane_map: Dict[Tuple[int, int], str],
+    def _insert_cargo_edges(self, obs, cargo_edges: List[CargoEdge]) -> List[CargoEdge]:
+        # only place the new cargo edges, planned legs (including the ones in progress)
+        # are kept, returns the ones that could not be placed
+        for a_id, agent in obs.items():
+            plane = self.planning.planes[a_id]
+            if not plane.has_legs():
+                # the plane finished its plan, start planning from where it is now
+                plane.location = agent["current_airport"]
+                plane.next_destination = agent["current_airport"]
+                plane.cur_weight = 0
+                plane.cargo_ids = set()
+
+        return self._assign_cargo_edges(cargo_edges)
+
+    def _assign_cargo_edges(self, cargo_edges: List[CargoEdge]) -> List[CargoEdge]:
+        unassigned = []
+        candidates = (FleetScorer if self.vectorized else CandidateIndex)(
+            self.planning.planes, self.paths
+        )
+        legs = LegIndex(self.planning.planes) if self.consolidate else None
+        # windows changed by planning a cargo edge, planes whose last leg moved are
+        # indexed by a stale window
+        changes: List[Change] = []
+        # by the half hour of the earliest pickup and then the sequence, read from the
+        # columns
+        store = self.planning.cargo_edges
+        rows = np.array([ce.row for ce in cargo_edges], dtype=np.int64)
+        order = np.lexsort(
+            (store.column("sequence")[rows], store.column("ep")[rows] // 30)
+        )
+        for ce in (cargo_edges[i] for i in order.tolist()):
+            if legs is not None:
+                joined = self._join_leg(ce, legs, changes)
+                if joined is not None:
+                    candidates.update(joined)
+                    legs.update(joined)
+                    self._update_moved(changes, candidates)
+                    instrumentation.count("cargo_edges_joined")
+                    continue
+
+            plane = None
+            servicing = candidates.servicing(ce, self.plane_type_map)
+            if len(servicing) > 0 and self._add_cargo_edge(servicing[0], ce, changes):
+                plane = servicing[0]
+            elif len(servicing) > 0:
+                # the best plane would delay planned cargo, try the others in order
+                others = candidates.servicing(
+                    ce, self.plane_type_map, len(self.planning.planes)
+                )[1:]
+                plane = next(
+                    (
+                        other
+                        for other in others
+                        if self._add_cargo_edge(other, ce, changes)
+                    ),
+                    None,
+                )
+            if plane is None:
+                unassigned.append(ce)
+                continue
+
+            candidates.update(plane)
+            if legs is not None:
+                legs.update(plane)
+            self._update_moved(changes, candidates)
+
+        instrumentation.count(
+            "cargo_edges_assigned", len(cargo_edges) - len(unassigned)
+        )
+        return unassigned
+
+    def _join_leg(
+        self, ce: CargoEdge, legs: LegIndex, changes: List[Change]
+    ) -> Optional[Plane]:
+        # plan the cargo edge on the first planned leg it fits in, returns its plane
+        for plane, leg in legs.joinable(ce):
+            if not plane.flies(ce):
+                continue
+            if sum(other.weight for other in leg.cargo_edges) + ce.weight > (
+                plane.max_weight
+            ):
+                continue
+            # only legs within the window of the cargo edge, narrowing a leg that is
+            # planned further ahead delays the cargo already on it
+            if ce.ep > leg.ep or leg.lp > ce.lp:
+                continue
+            if not self._in_cargo_order(plane, leg, ce):
+                continue
+            window = (leg.ep, leg.lp)
+            self.planning.join_leg(plane, leg, ce)
+            first = len(changes)
+            if len(self.update_ep_lp(ce, changes)) == 0:
+                return plane
+            # it delays cargo edges of its cargo past their window
+            self.windows.undo(changes[first:])
+            del changes[first:]
+            self.planning.remove_cargo_edge(ce)
+            leg.ep, leg.lp = window
+            instrumentation.count("cargo_edges_rejected")
+        return None
+
+    def _add_cargo_edge(
+        self, plane: Plane, ce: CargoEdge, changes: List[Change]
+    ) -> bool:
+        # plan the cargo edge after the legs of the plane, undone when that delays a
+        # planned cargo edge past its window
+        state = (
+            plane.location,
+            plane.next_destination,
+            plane.cur_weight,
+            set(plane.cargo_ids),
+        )
+        last = plane.legs[-1] if plane.has_legs() else None
+        window = (last.ep, last.lp) if last is not None else None
+        self.planning.add_cargo_edge(plane, ce, self.paths)
+        first = len(changes)
+        if len(self.update_ep_lp(ce, changes)) == 0:
+            return True
+        self.windows.undo(changes[first:])
+        del changes[first:]
+        self.planning.remove_cargo_edge(ce)
+        plane.location, plane.next_destination, plane.cur_weight, plane.cargo_ids = (
+            state
+        )
+        if last is not None:
+            last.ep, last.lp = window
+        instrumentation.count("cargo_edges_rejected")
+        return False
+
+    def _update_moved(
+        self, changes: List[Change], candidates: Union[CandidateIndex, FleetScorer]
     ) -> None:
-        (ep_diff_ce, lp_diff_ce, ep_diff_leg, lp_diff_leg) = changes
-
-        orig_leg_ep = cur_leg.ep - ep_diff_leg
-        orig_leg_lp = cur_leg.lp + lp_diff_leg
-
-        if ep_diff_ce > 0:
-            for ce in self.cargo_edges.cargo_edges:
-                if ce.cargo_id == cur_ce.cargo_id and ce.sequence > cur_ce.sequence:
-                    ce.ep += ep_diff_ce
-
-        if ep_diff_leg > 0:
-            ce_seq_to_propagate: OrderedDict[Tuple[int, int], int] = OrderedDict()
-            for ce in cur_leg.cargo_edges:
-                if ce.cargo_id != cur_ce.cargo_id:
-                    already_added = max(0, orig_leg_ep - ce.ep)
-                    to_add = max(0, ep_diff_leg - already_added)
-                    if to_add > 0:
-                        ce_seq_to_propagate[ce.cargo_id, ce.sequence + 1] = to_add
-            for ce_seq, to_add in ce_seq_to_propagate.items():
-                if ce_seq not in ce_plane_map:
-                    for ce in self.cargo_edges.cargo_edges:
-                        if ce.cargo_id == ce_seq[0] and ce.sequence >= ce_seq[1]:
-                            ce.ep += to_add
-
-            while len(ce_seq_to_propagate) > 0:
-                ce_seq, to_add = ce_seq_to_propagate.popitem(last=False)
-                if ce_seq in ce_plane_map:
-                    plane = planes[ce_plane_map[ce_seq]]
-                    leg = plane.find_leg(ce_seq)
-                    leg.ep += ep_diff_leg
-                    for ce in leg.cargo_edges:
-                        cur_ce_seq = (ce.cargo_id, ce.sequence)
-                        if cur_ce_seq in ce_seq_to_propagate:
-                            del ce_seq_to_propagate[cur_ce_seq]
-                        ce_seq_to_propagate[ce.cargo_id, ce.sequence + 1] = ep_diff_leg
-
-        if lp_diff_ce > 0:
-            ce_seq_to_propagate: List[Tuple[int, int, int]] = [
-                (cur_ce.cargo_id, cur_ce.sequence - 1, lp_diff_ce)
-            ]
-            while len(ce_seq_to_propagate) > 0:
-                ce_seq = ce_seq_to_propagate.pop()
-                if (ce_seq[0], ce_seq[1]) in ce_plane_map:
-                    plane = planes[ce_plane_map[ce_seq[0], ce_seq[1]]]
-                    leg = plane.find_leg(ce_seq)
-
-                    for ce in leg.cargo_edges:
-                        if ce.corresponds(ce_seq):
-                            already_subtracted = max(0, ce.lp - leg.lp)
-                            to_subtract = max(0, ce_seq[2] - already_subtracted)
-                            leg.lp -= to_subtract
-                            break
-                    if to_subtract > 0:
-                        for ce in leg.cargo_edges:
-                            ce_seq_to_propagate.append(
-                                (ce.cargo_id, ce.sequence - 1, to_subtract)
-                            )
-
-        if lp_diff_leg > 0:
-            ce_seq_to_propagate: OrderedDict[Tuple[int, int], int] = OrderedDict()
-            for ce in cur_leg.cargo_edges:
-                if ce.cargo_id != cur_ce.cargo_id:
-                    already_subtracted = max(0, ce.lp - orig_leg_lp)
-                    to_subtract = max(0, lp_diff_leg - already_subtracted)
-                    if to_subtract > 0:
-                        ce_seq_to_propagate[ce.cargo_id, ce.sequence - 1] = to_subtract
-
-            while len(ce_seq_to_propagate) > 0:
-                ce_seq, to_subtract = ce_seq_to_propagate.popitem(last=False)
-                if ce_seq in ce_plane_map:
-                    plane = planes[ce_plane_map[ce_seq]]
-                    leg = plane.find_leg(ce_seq)
-                    for ce in leg.cargo_edges:
-                        if ce.corresponds(ce_seq):
-                            already_subtracted = max(0, ce.lp - leg.lp)
-                            to_subtract_cur = max(0, lp_diff_leg - already_subtracted)
-                            leg.lp -= to_subtract
-                            break
-                    if to_subtract_cur > 0:
-                        for ce in leg.cargo_edges:
-                            ce_seq_to_propagate[ce.cargo_id, ce.sequence - 1] = (
-                                to_subtract_cur
-                            )
-                            cur_ce_seq = (ce.cargo_id, ce.sequence)
-                            if cur_ce_seq in ce_seq_to_propagate:
-                                del ce_seq_to_propagate[cur_ce_seq]
+        # reindex the planes whose last leg got another window, the leg index only
+        # relies on windows narrowing
+        moved = {}
+        for unit, _, _ in changes:
+            if isinstance(unit, Leg):
+                first = unit.cargo_edges[0]
+                found = self.planning.find(first.cargo_id, first.sequence)
+                if found is not None and found[0].legs[-1] is unit:
+                    moved[found[0].id] = found[0]
+        for plane in moved.values():
+            candidates.update(plane)
+        changes.clear()
+
+    def _in_cargo_order(self, plane: Plane, leg: Leg, ce: CargoEdge) -> bool:
+        # the planned cargo edges before and after it on the same plane fly before and
+        # after the leg
+        position = next(i for i, other in enumerate(plane.legs) if other is leg)
+        for sequence, before in ((ce.sequence - 1, True), (ce.sequence + 1, False)):
+            found = self.planning.find(ce.cargo_id, sequence)
+            if found is None or found[0] is not plane:
+                continue
+            other = next(i for i, other in enumerate(plane.legs) if other is found[1])
+            if (other < position) != before:
+                return False
+        return True
+
+    def improve(
+        self, now: int, positions: Optional[Dict[str, Tuple[int, int]]] = None
+    ) -> None:
+        # spend the search budget on the current planning, the next call continues,
+        # positions as PlanEvaluator.evaluate takes them
+        if self.search_budget > 0:
+            moves = self.search.run(
+                self.planning, self.windows, self.search_budget, now, positions
+            )
+            instrumentation.count("search_moves", moves)
+
+    def update_ep_lp(
+        self, cur_ce: CargoEdge, changes: Optional[List[Change]] = None
+    ) -> List[CargoEdge]:
+        # propagate the window of the leg the cargo edge was just planned on, returns
+        # the cargo edges whose windows became infeasible
+        return self.windows.propagate(cur_ce, changes)
 
 
 def print_cargo_edges(cargo_edges: CargoEdges) -> None:
@@ -0,0 +1,173 @@
+import networkx as nx
+import pytest
+
+from solution.common import BIG_TIME, CargoEdges, Leg, PathCache, Plane, Planning
+
+
+def _create(cargo_edges, cargo_id, sequence, ep=0):
+    return cargo_edges.create(cargo_id, 0, 1, 10, sequence, ep, ep + 100, 1, 1)
+
+
+def test_cargo_edges_are_views_on_the_columns():
+    cargo_edges = CargoEdges(capacity=1)
+    first = _create(cargo_edges, 0, 0)
+    second = _create(cargo_edges, 0, 1, ep=30)
+
+    second.ep = 40
+    assert cargo_edges.column("ep").tolist() == [0, 40]
+    assert cargo_edges.get(0, 1) is second
+    assert cargo_edges.chain(0) == [first, second]
+
+
+def test_active_cargo_edges_follow_added_and_removed_cargo():
+    cargo_edges = CargoEdges()
+    first = _create(cargo_edges, 0, 0)
+    assert cargo_edges.cargo_edges == [first]
+
+    second = _create(cargo_edges, 1, 0)
+    assert cargo_edges.cargo_edges == [first, second]
+
+    cargo_edges.remove_cargo({0})
+    assert cargo_edges.cargo_edges == [second]
+    assert cargo_edges.get(0, 0) is None
+    assert len(cargo_edges) == 1
+
+
+def test_shift_sequence_renumbers_the_later_cargo_edges():
+    cargo_edges = CargoEdges()
+    chain = [_create(cargo_edges, 0, sequence) for sequence in range(3)]
+
+    cargo_edges.shift_sequence(0, 0, 2)
+    assert [ce.sequence for ce in chain] == [0, 3, 4]
+    assert cargo_edges.get(0, 3) is chain[1]
+    assert cargo_edges.get(0, 1) is None
+    assert cargo_edges.following(0, 0) == chain[1:]
+
+
+def test_copies_do_not_share_cargo_edges_or_planes():
+    cargo_edges = CargoEdges()
+    first, second = _create(cargo_edges, 0, 0), _create(cargo_edges, 0, 1)
+    plane = Plane("a_0", 0, 1, 0, 10, legs=[Leg.construct([first, second])])
+    planning = Planning(cargo_edges, {plane.id: plane})
+
+    copied = planning.copy(cargo_edges.copy())
+    copied_first = copied.cargo_edges.at(first.row)
+    copied_first.ep = 50
+    copied.remove_cargo_edge(copied.cargo_edges.at(second.row))
+    assert first.ep == 0
+    assert planning.is_assigned(0, 1)
+    assert copied.find(0, 0)[1].cargo_edges == [copied_first]
+    assert plane.legs[0].cargo_edges == [first, second]
+
+
+def test_path_cache_copy_keeps_its_routes():
+    graph = nx.MultiDiGraph()
+    for orig, dest, time in [(0, 1, 10), (0, 2, 10), (2, 1, 10)]:
+        graph.add_edge(orig, dest, time=time, cost=time)
+    paths = PathCache(graph)
+    copied = paths.copy()
+
+    paths.set_unavailable_routes({(0, 1)})
+    assert paths.get_path(0, 1) == [0, 2, 1]
+    assert copied.get_path(0, 1) == [0, 1]
+    assert copied.unavailable_routes == set()
+
+
+def _planning():
+    cargo_edges = CargoEdges()
+    chain = [_create(cargo_edges, 0, sequence) for sequence in range(2)]
+    other = _create(cargo_edges, 1, 0)
+    planes = {
+        "a_0": Plane("a_0", 0, 1, 0, 10, legs=[Leg.construct(chain[:1])]),
+        "a_1": Plane("a_1", 0, 1, 0, 10, legs=[Leg.construct([chain[1], other])]),
+    }
+    return Planning(cargo_edges, planes), chain, other
+
+
+def test_fork_changes_do_not_show_in_the_planning():
+    planning, chain, other = _planning()
+    a_0, a_1 = planning.planes["a_0"], planning.planes["a_1"]
+    fork = planning.fork()
+    fork.move_cargo_edge(other, a_0, a_0.legs[0])
+
+    assert fork.find(1, 0)[0] is fork.planes["a_0"]
+    assert fork.planes["a_1"] is not a_1
+    assert fork.assigned() == planning.assigned() == {(0, 0), (0, 1), (1, 0)}
+    assert planning.find(1, 0) == (a_1, a_1.legs[0])
+    assert a_0.legs[0].cargo_edges == chain[:1]
+    assert fork.diff(planning) == {"a_0", "a_1"}
+
+    fork.remove_cargo_edge(chain[0])
+    assert not fork.is_assigned(0, 0)
+    assert fork.assigned() == {(0, 1), (1, 0)}
+    assert fork.assigned_rows() == {chain[1].row, other.row}
+    assert planning.is_assigned(0, 0)
+
+
+def test_commit_takes_over_the_legs_of_the_fork():
+    planning, chain, other = _planning()
+    a_0, a_1 = planning.planes["a_0"], planning.planes["a_1"]
+    leg = a_0.legs[0]
+    version = planning.version
+    fork = planning.fork()
+    fork.move_cargo_edge(other, a_0, leg)
+    fork.remove_cargo_edge(chain[1])
+
+    planning.commit(fork)
+    assert planning.planes == {"a_0": a_0, "a_1": a_1}
+    assert a_0.legs == [leg]
+    assert leg.cargo_edges == [chain[0], other]
+    assert a_1.legs == []
+    assert planning.find(1, 0) == (a_0, leg)
+    assert planning.assigned() == {(0, 0), (1, 0)}
+    assert planning.version > version
+    with pytest.raises(ValueError):
+        fork.find(0, 0)
+    with pytest.raises(ValueError):
+        fork.remove_cargo_edge(chain[0])
+
+
+def test_unchanged_fork_leaves_the_planning_as_it_was():
+    planning, chain, other = _planning()
+    version = planning.version
+    fork = planning.fork()
+    assert fork.diff(planning) == set()
+    planning.commit(fork)
+    assert planning.version == version
+    assert planning.find(0, 1)[0] is planning.planes["a_1"]
+    with pytest.raises(ValueError):
+        planning.fork().fork()
+
+
+def test_path_cache_falls_back_to_the_full_map_when_cut_off():
+    graph = nx.MultiDiGraph()
+    for orig, dest in [(0, 1), (1, 2), (2, 1)]:
+        graph.add_edge(orig, dest, time=10, cost=10)
+    paths = PathCache(graph)
+    paths.set_unavailable_routes({(0, 1), (1, 2)})
+
+    assert paths.get_path(0, 2) == [0, 1, 2]
+    assert paths.get_travel_time(0, 2) == 20
+    assert paths.travel_times([0, 2, 1], [2, 1, 0]).tolist() == [20, 10, BIG_TIME]
+    assert (paths.hits, paths.misses) == (1, 4)
+    with pytest.raises(nx.NetworkXNoPath):
+        paths.get_path(1, 0)
+
+
+def test_planes_plan_from_their_last_leg_after_cargo_is_dropped():
+    cargo_edges = CargoEdges()
+    first = cargo_edges.create(0, 0, 1, 10, 0, 0, 100, 2, 1)
+    second = cargo_edges.create(1, 1, 2, 10, 0, 0, 100, 4, 1)
+    plane = Plane("a_0", 0, 1, 0, 10, legs=[Leg.construct([first])])
+    plane.legs.append(Leg.construct([second]))
+    plane.sync_last_leg()
+    planning = Planning(cargo_edges, {plane.id: plane})
+    assert (plane.location, plane.next_destination, plane.cur_weight) == (1, 2, 4)
+
+    assert planning.cancel_cargo({1}) == {"a_0"}
+    assert (plane.location, plane.next_destination) == (0, 1)
+    assert (plane.cur_weight, plane.cargo_ids) == (2, {0})
+
+    planning.remove_cargo_edge(first)
+    assert plane.legs == []
+    assert (plane.cur_weight, plane.cargo_ids) == (0, set())
@@ -0,0 +1,210 @@
+import random
+from collections import defaultdict
+
+import networkx as nx
+import pytest
+
+import solution.evaluation as evaluation
+from solution.common import CargoEdges, Leg, PathCache, Plane, Planning
+from solution.evaluation import PlanEvaluator
+
+N_AIRPORTS = 5
+PROCESSING_TIME = 5
+
+
+def _paths():
+    graph = nx.MultiDiGraph()
+    for orig in range(N_AIRPORTS):
+        for dest in range(N_AIRPORTS):
+            if orig != dest:
+                time = 10 + 7 * abs(orig - dest)
+                graph.add_edge(orig, dest, time=time, cost=time)
+    return PathCache(graph)
+
+
+def _leg_order(planning):
+    # the walk local search used before the evaluator: (plane, index of the leg) with
+    # a leg after the previous leg of its plane and after the legs with the previous
+    # cargo edges of its cargo, None if there is no such order
+    legs = {}
+    successors = defaultdict(list)
+    indegree = {}
+    for plane in planning.planes.values():
+        for i, leg in enumerate(plane.legs):
+            legs[id(leg)] = (plane, i)
+            indegree.setdefault(id(leg), 0)
+            if i + 1 < len(plane.legs):
+                successors[id(leg)].append(id(plane.legs[i + 1]))
+            for ce in leg.cargo_edges:
+                found = planning.find(ce.cargo_id, ce.sequence + 1)
+                if found is not None and found[1] is not leg:
+                    successors[id(leg)].append(id(found[1]))
+    for targets in successors.values():
+        for target in targets:
+            indegree[target] += 1
+    queue = [key for key, count in indegree.items() if count == 0]
+    order = []
+    while len(queue) > 0:
+        key = queue.pop()
+        order.append(legs[key])
+        for target in successors[key]:
+            indegree[target] -= 1
+            if indegree[target] == 0:
+                queue.append(target)
+    return order if len(order) == len(legs) else None
+
+
+def _walk(planning, paths, now, positions=None):
+    # lateness, flying time and fullness as the walk flew the planning, with the
+    # first leg of a plane leaving from its position
+    order = _leg_order(planning)
+    if order is None:
+        return None
+    departures = {}
+    lateness = flying = fullness = 0
+    for plane, i in order:
+        leg = plane.legs[i]
+        departure = now
+        if i > 0:
+            previous = plane.legs[i - 1]
+            empty = paths.get_travel_time(
+                previous.cargo_edges[-1].destination, leg.cargo_edges[0].origin
+            )
+            departure = departures[id(previous)] + previous.get_duration() + empty
+            flying += empty
+        elif positions is not None and plane.id in positions:
+            airport, available = positions[plane.id]
+            empty = paths.get_travel_time(airport, leg.cargo_edges[0].origin)
+            departure = max(now, available) + empty
+            flying += empty
+        for ce in leg.cargo_edges:
+            departure = max(departure, ce.ep)
+            found = planning.find(ce.cargo_id, ce.sequence - 1)
+            if found is not None:
+                arrival = departures[id(found[1])] + found[1].get_duration()
+                departure = max(departure, arrival + PROCESSING_TIME)
+        departures[id(leg)] = departure
+        flying += leg.get_duration()
+        lateness += sum(max(0, departure - ce.lp) for ce in leg.cargo_edges)
+        fullness -= len(leg.cargo_edges) ** 2
+    return lateness, flying, fullness
+
+
+def _planning(seed):
+    # legs on random edges in a random order, and cargo that hops from leg to a later
+    # one, on the same plane or on another one
+    rng = random.Random(seed)
+    cargo_edges = CargoEdges()
+    planes = {}
+    legs = []
+    for p in range(4):
+        plane = Plane(f"a_{p}", 0, 0, 0, rng.randint(2, 6))
+        for _ in range(rng.randint(1, 4)):
+            legs.append((len(legs), rng.sample(range(N_AIRPORTS), 2), []))
+            plane.legs.append(legs[-1])
+        planes[plane.id] = plane
+    rng.shuffle(legs)
+    for cargo_id in range(10):
+        i = rng.randrange(len(legs))
+        _, (orig, dest), ces = legs[i]
+        for sequence in range(rng.randint(1, 3)):
+            ep = rng.randint(0, 200)
+            ces.append(
+                cargo_edges.create(
+                    cargo_id,
+                    orig,
+                    dest,
+                    10 + 7 * abs(orig - dest),
+                    sequence,
+                    ep,
+                    ep + rng.randint(0, 100),
+                    rng.randint(1, 3),
+                    1,
+                )
+            )
+            following = [j for j in range(i + 1, len(legs)) if legs[j][1][0] == dest]
+            if len(following) == 0:
+                break
+            i = rng.choice(following)
+            _, (orig, dest), ces = legs[i]
+    order = {leg[0]: i for i, leg in enumerate(legs)}
+    for plane in planes.values():
+        plane.legs = [
+            Leg.construct(ces)
+            for _, _, ces in sorted(plane.legs, key=lambda leg: order[leg[0]])
+            if len(ces) > 0
+        ]
+    return Planning(cargo_edges, planes)
+
+
+@pytest.mark.parametrize("rounds", [1, evaluation.ROUNDS])
+@pytest.mark.parametrize("seed", range(30))
+def test_same_costs_as_the_walk(monkeypatch, seed, rounds):
+    # after one round the departures are mostly left to the topological pass
+    monkeypatch.setattr(evaluation, "ROUNDS", rounds)
+    paths = _paths()
+    planning = _planning(seed)
+    positions = {"a_0": (3, 40), "a_2": (1, 0)}
+    for now, positions in ((0, None), (50, positions)):
+        estimate = PlanEvaluator(paths, PROCESSING_TIME).evaluate(
+            planning, now, positions=positions
+        )
+        expected = _walk(planning, paths, now, positions)
+        assert (
+            estimate.lateness,
+            estimate.flying_time,
+            estimate.fullness,
+        ) == expected
+        assert estimate.overloaded == sum(
+            sum(ce.weight for ce in leg.cargo_edges) > plane.max_weight
+            for plane in planning.planes.values()
+            for leg in plane.legs
+        )
+
+
+def _chain(legs_of_planes, weights=(1, 1)):
+    # cargo 0 flies 0 -> 1 -> 2, the legs are given per plane as (cargo_id, sequence)
+    cargo_edges = CargoEdges()
+    ces = {
+        (0, 0): cargo_edges.create(0, 0, 1, 24, 0, 0, 100, weights[0], 1),
+        (0, 1): cargo_edges.create(0, 1, 2, 24, 1, 0, 100, weights[1], 1),
+    }
+    planes = {}
+    for p, legs in enumerate(legs_of_planes):
+        plane = Plane(f"a_{p}", 0, 0, 0, 2)
+        plane.legs = [Leg.construct([ces[key] for key in leg]) for leg in legs]
+        planes[plane.id] = plane
+    return Planning(cargo_edges, planes)
+
+
+def test_legs_waiting_on_each_other_in_a_circle():
+    # a_0 flies the second cargo edge of the cargo before the first one
+    planning = _chain([[[(0, 1)], [(0, 0)]]])
+    assert _walk(planning, _paths(), 0) is None
+    assert PlanEvaluator(_paths(), PROCESSING_TIME).evaluate(planning, 0) is None
+
+
+def test_overloaded_leg_does_not_deliver():
+    planning = _chain([[[(0, 0)]], [[(0, 1)]]], weights=(1, 3))
+    estimate = PlanEvaluator(_paths(), PROCESSING_TIME).evaluate(planning, 0)
+    assert estimate.overloaded == 1
+    assert (estimate.delivered, estimate.undelivered) == (0, 1)
+    assert (
+        estimate.lateness,
+        estimate.flying_time,
+        estimate.fullness,
+    ) == _walk(planning, _paths(), 0)
+
+
+def test_first_leg_waits_for_the_flight_from_where_the_plane_is():
+    planning = _chain([[[(0, 0)], [(0, 1)]]])
+    evaluator = PlanEvaluator(_paths(), PROCESSING_TIME)
+    at_origin = evaluator.evaluate(planning, 0)
+    positioned = evaluator.evaluate(planning, 0, positions={"a_0": (2, 90)})
+    # the plane is at airport 2 at 90 and takes 24 from there to airport 0, the
+    # cargo is on board the second leg after 24 more and the processing time
+    assert positioned.flying_time == at_origin.flying_time + 24
+    assert positioned.flight_cost == at_origin.flight_cost + 24
+    assert at_origin.lateness == 0
+    assert positioned.lateness == (114 - 100) + (114 + 24 + PROCESSING_TIME - 100)
+    assert positioned.missed == 1
@@ -0,0 +1,175 @@
+import random
+
+import networkx as nx
+import pytest
+
+from solution.common import (
+    TW_OVERLAP_MARGIN,
+    CargoEdges,
+    Leg,
+    PathCache,
+    Plane,
+    PlaneTypeMap,
+)
+from solution.fleet import CandidateIndex, FleetScorer, LegIndex
+
+N_AIRPORTS = 8
+
+
+def _graph(rng, plane_type):
+    graph = nx.DiGraph()
+    graph.add_nodes_from(range(N_AIRPORTS))
+    for orig in range(N_AIRPORTS):
+        for dest in range(N_AIRPORTS):
+            if orig != dest and rng.random() < 0.4:
+                time = rng.randint(10, 60)
+                graph.add_edge(orig, dest, time=time, cost=time, type=plane_type)
+    return graph
+
+
+def _fleet(seed):
+    rng = random.Random(seed)
+    route_map = {plane_type: _graph(rng, plane_type) for plane_type in (0, 1)}
+    graph = nx.MultiDiGraph()
+    for plane_type, routes in route_map.items():
+        graph.add_nodes_from(routes)
+        graph.add_edges_from(routes.edges(data=True))
+    paths = PathCache(graph)
+    cargo_edges = CargoEdges()
+
+    def cargo_edge(cargo_id, sequence=0):
+        orig, dest = rng.sample(range(N_AIRPORTS), 2)
+        ep = rng.randint(0, 300)
+        return cargo_edges.create(
+            cargo_id,
+            orig,
+            dest,
+            rng.randint(10, 60),
+            sequence,
+            ep,
+            ep + rng.randint(0, 200),
+            rng.randint(1, 5),
+            rng.randint(1, 3),
+        )
+
+    planes = {}
+    for i in range(12):
+        location = rng.randrange(N_AIRPORTS)
+        plane = Plane(f"a_{i}", location, location, rng.randint(0, 1), 10)
+        for sequence in range(rng.randint(0, 3)):
+            plane.legs.append(Leg.construct([cargo_edge(100 + i, sequence)]))
+        plane.sync_last_leg()
+        planes[plane.id] = plane
+    queries = [cargo_edge(cargo_id) for cargo_id in range(30)]
+    # some queries for cargo that a plane carries
+    queries += [cargo_edge(100 + rng.randrange(12), 9) for _ in range(10)]
+    return planes, paths, PlaneTypeMap(route_map), queries
+
+
+def _linear(planes, ce, paths):
+    ordinal = {plane_id: i for i, plane_id in enumerate(planes)}
+    return sorted(
+        (plane for plane in planes.values() if plane.flies(ce)),
+        key=lambda plane: (plane.matches(ce, paths), ordinal[plane.id]),
+    )
+
+
+def _move_last_legs(planes, rng):
+    # as propagate does after a cargo edge was planned
+    for plane in planes.values():
+        if plane.has_legs() and rng.random() < 0.5:
+            plane.legs[-1].ep += rng.randint(1, 100)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_candidates_in_the_order_of_plane_matches(seed):
+    planes, paths, plane_type_map, queries = _fleet(seed)
+    index = CandidateIndex(planes, paths)
+    for ce in queries:
+        assert [plane.id for plane in index.candidates(ce)] == [
+            plane.id for plane in _linear(planes, ce, paths)
+        ]
+
+    _move_last_legs(planes, random.Random(seed))
+    for plane in planes.values():
+        index.update(plane)
+    for ce in queries:
+        assert [plane.id for plane in index.candidates(ce)] == [
+            plane.id for plane in _linear(planes, ce, paths)
+        ]
+
+
+@pytest.mark.parametrize("index_type", [CandidateIndex, FleetScorer])
+@pytest.mark.parametrize("seed", range(5))
+def test_servicing_as_plane_can_service(index_type, seed):
+    planes, paths, plane_type_map, queries = _fleet(seed)
+    index = index_type(planes, paths)
+    _move_last_legs(planes, random.Random(seed))
+    for plane in planes.values():
+        index.update(plane)
+    for ce in queries:
+        expected = [
+            plane.id
+            for plane in _linear(planes, ce, paths)
+            if plane.can_service(ce, paths, plane_type_map)
+        ]
+        found = index.servicing(ce, plane_type_map, len(planes))
+        assert [plane.id for plane in found] == expected
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_joinable_legs_after_windows_narrowed(seed):
+    planes, paths, plane_type_map, queries = _fleet(seed)
+    legs = LegIndex(planes)
+    rng = random.Random(seed)
+    for plane in planes.values():
+        for leg in plane.legs:
+            leg.ep += rng.randint(0, 50)
+            leg.lp -= rng.randint(0, 50)
+    for ce in queries:
+        expected = [
+            (plane.id, id(leg))
+            for plane in planes.values()
+            for leg in plane.legs[1:]
+            if (leg.cargo_edges[0].origin, leg.cargo_edges[0].destination)
+            == (ce.origin, ce.destination)
+            and leg.ep <= ce.lp - TW_OVERLAP_MARGIN
+            and ce.ep <= leg.lp - TW_OVERLAP_MARGIN
+        ]
+        found = [(plane.id, id(leg)) for plane, leg in legs.joinable(ce)]
+        assert sorted(found) == sorted(expected)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_scores_as_plane_matches(seed):
+    planes, paths, plane_type_map, queries = _fleet(seed)
+    scorer = FleetScorer(planes, paths)
+    _move_last_legs(planes, random.Random(seed))
+    for plane in planes.values():
+        scorer.update(plane)
+    keys, feasible = scorer.score(queries, plane_type_map)
+    for row, ce in enumerate(queries):
+        for column, plane in enumerate(planes.values()):
+            assert tuple(keys[row, column]) == plane.matches(ce, paths)
+            assert feasible[row, column] == plane.can_service(ce, paths, plane_type_map)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_updated_leg_index_as_a_new_one(seed):
+    planes, paths, plane_type_map, queries = _fleet(seed)
+    legs = LegIndex(planes)
+    rng = random.Random(seed)
+    for ce in queries:
+        plane = rng.choice(list(planes.values()))
+        if plane.has_legs() and rng.random() < 0.3:
+            plane.legs[-1].add(ce)
+        elif len(plane.legs) > 1 and rng.random() < 0.2:
+            plane.legs.pop()
+        else:
+            plane.legs.append(Leg.construct([ce]))
+        legs.update(plane)
+    fresh = LegIndex(planes)
+    for ce in queries:
+        assert [(plane.id, id(leg)) for plane, leg in legs.joinable(ce)] == [
+            (plane.id, id(leg)) for plane, leg in fresh.joinable(ce)
+        ]
@@ -0,0 +1,61 @@
+import csv
+
+from solution.instrument import Instrumentation, write_rows
+
+
+class _Cache:
+    hits = 0
+    misses = 0
+
+
+def test_records_nothing_unless_enabled():
+    instrumentation = Instrumentation()
+    instrumentation.start_episode()
+    instrumentation.start_step()
+    with instrumentation.span("plan_ms"):
+        instrumentation.count("moves")
+    instrumentation.end_step()
+    assert instrumentation.episodes == []
+
+
+def test_steps_with_spans_counts_and_cache_lookups():
+    instrumentation = Instrumentation()
+    instrumentation.enable()
+    cache = _Cache()
+    for episode in range(2):
+        instrumentation.start_episode()
+        instrumentation.watch("paths", cache)
+        for step in range(3):
+            instrumentation.start_step()
+            with instrumentation.span("plan_ms"):
+                cache.hits += step
+                cache.misses += 1
+            instrumentation.count("moves", step)
+            instrumentation.count("moves")
+            instrumentation.end_step()
+
+    rows = instrumentation.rows()
+    assert [(row["episode"], row["step"]) for row in rows] == [
+        (episode, step) for episode in range(2) for step in range(3)
+    ]
+    assert [row["moves"] for row in rows[:3]] == [1, 2, 3]
+    assert [(row["paths_hits"], row["paths_misses"]) for row in rows[:3]] == [
+        (0, 1),
+        (1, 1),
+        (2, 1),
+    ]
+    assert all(row["step_ms"] >= row["plan_ms"] >= 0 for row in rows)
+
+    summary = instrumentation.summary()
+    assert [row["steps"] for row in summary] == [3, 3]
+    assert summary[0]["max_ms"] == max(row["step_ms"] for row in rows[:3])
+
+
+def test_writes_all_columns_with_missing_values_as_zero(tmp_path):
+    path = tmp_path / "timings.csv"
+    write_rows(str(path), [{"step": 0, "plan_ms": 1.5}, {"step": 1, "moves": 2}])
+    with open(path) as file:
+        assert list(csv.DictReader(file)) == [
+            {"step": "0", "plan_ms": "1.5", "moves": "0"},
+            {"step": "1", "plan_ms": "0", "moves": "2"},
+        ]
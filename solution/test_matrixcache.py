@@ -0,0 +1,73 @@
+import networkx as nx
+import numpy as np
+
+from solution.common import PathCache, PlaneTypeMap
+from solution.matrixcache import MatrixCache, fingerprint
+
+
+def _graph():
+    graph = nx.MultiDiGraph()
+    for orig, dest, time in [(0, 1, 10), (0, 2, 10), (2, 1, 10), (1, 0, 30)]:
+        graph.add_edge(orig, dest, time=time, cost=time)
+    return graph
+
+
+def test_stores_and_loads_arrays_read_only(tmp_path):
+    cache = MatrixCache(str(tmp_path))
+    arrays = {"a": np.arange(6).reshape(2, 3), "b": np.ones(4, dtype=bool)}
+    assert cache.load("key") is None
+
+    cache.store("key", arrays)
+    loaded = cache.load("key")
+    assert set(loaded) == {"a", "b"}
+    assert np.array_equal(loaded["a"], arrays["a"])
+    assert not loaded["a"].flags.writeable
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_evicts_the_least_recently_used_entries(tmp_path):
+    cache = MatrixCache(str(tmp_path), max_bytes=2500)
+    for key in ("first", "second", "third"):
+        cache.store(key, {"a": np.zeros(100)})
+    assert cache.load("first") is None
+    assert cache.load("third") is not None
+
+
+def test_fingerprint_follows_the_edge_weights():
+    graph = _graph()
+    key = fingerprint("paths", {0: graph})
+    assert fingerprint("paths", {0: _graph()}) == key
+    graph.add_edge(1, 2, time=5, cost=5)
+    assert fingerprint("paths", {0: graph}) != key
+
+
+def test_path_cache_uses_the_loaded_matrices_until_a_route_goes_down(tmp_path):
+    cache = MatrixCache(str(tmp_path))
+    computed = PathCache(_graph(), cache=cache)
+    paths = PathCache(_graph(), cache=cache)
+    assert cache.hits == 1
+    assert isinstance(paths._cost, np.memmap)
+    assert paths.get_path(0, 1) == computed.get_path(0, 1) == [0, 1]
+
+    paths.set_unavailable_routes({(0, 1)})
+    assert paths.get_path(0, 1) == [0, 2, 1]
+    assert not isinstance(paths._cost, np.memmap)
+    assert PathCache(_graph(), cache=cache).get_path(0, 1) == [0, 1]
+
+    paths.set_unavailable_routes(set())
+    assert paths.get_path(0, 1) == [0, 1]
+    assert isinstance(paths._cost, np.memmap)
+
+
+def test_plane_type_map_restores_the_reachability(tmp_path):
+    cache = MatrixCache(str(tmp_path))
+    route_map = {0: nx.DiGraph([(0, 1), (1, 2)]), 1: nx.DiGraph([(2, 0)])}
+    computed = PlaneTypeMap(route_map, cache=cache)
+    loaded = PlaneTypeMap(route_map, cache=cache)
+    assert cache.hits == 1
+    for plane_type in route_map:
+        for orig in range(3):
+            for dest in range(3):
+                assert loaded.reachable(plane_type, orig, dest) == computed.reachable(
+                    plane_type, orig, dest
+                )
@@ -0,0 +1,54 @@
+from collections import namedtuple
+
+import networkx as nx
+
+from solution.observation import StepView, ViewCache
+
+Cargo = namedtuple("Cargo", "id location")
+
+
+def _obs():
+    fast = nx.DiGraph()
+    fast.add_edge(0, 1, route_available=False)
+    fast.add_edge(1, 2, mal=3)
+    fast.add_edge(2, 0)
+    slow = nx.DiGraph()
+    slow.add_edge(0, 1)
+    slow.add_edge(1, 2, route_available=False)
+    global_state = {
+        "route_map": {0: fast, 1: slow},
+        "event_new_cargo": [],
+        "active_cargo": [Cargo(7, 1), Cargo(3, 1), Cargo(5, 0)],
+    }
+    agents = [(1, [3, 7, 9]), (1, [7]), (0, [])]
+    return {
+        f"a_{i}": {
+            "globalstate": global_state,
+            "current_airport": airport,
+            "cargo_at_current_airport": cargo_ids,
+        }
+        for i, (airport, cargo_ids) in enumerate(agents)
+    }
+
+
+def test_routes_down_in_every_route_map():
+    view = StepView(_obs())
+    assert view.unavailable_routes_by_type == {0: {(0, 1), (1, 2)}, 1: {(1, 2)}}
+    assert view.unavailable_routes == {(1, 2)}
+
+
+def test_active_cargo_at_the_airports_in_the_order_of_the_observation():
+    view = StepView(_obs())
+    assert [cargo.id for cargo in view.cargo_by_airport[1]] == [7, 3]
+    assert view.cargo_by_airport[0] == []
+    assert [cargo.id for cargo in view.cargo_info({5, 3, 9})] == [3, 5]
+
+
+def test_view_is_built_once_per_global_state():
+    obs = _obs()
+    views = ViewCache()
+    view = views.get(obs)
+    assert views.get(obs) is view
+    assert views.get(obs, refresh=True) is not view
+    assert ViewCache().get(obs) is not views.get(obs)
+    assert views.get(_obs()) is not views.get(obs)
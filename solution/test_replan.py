@@ -0,0 +1,64 @@
+import networkx as nx
+import pytest
+
+pytest.importorskip("airlift")
+
+from solution.common import CargoEdges, Leg, PathCache, Plane, PlaneTypeMap, Planning
+from solution.replan import BackgroundReplanner
+from solution.search import LocalSearch
+from solution.strategic import Model
+from solution.windows import TimeWindows
+
+PROCESSING_TIME = 5
+
+
+def _model():
+    # a plane that carries three cargo from airport 0 to airport 1
+    routes = nx.DiGraph()
+    routes.add_edge(0, 1, time=10, cost=10)
+    routes.add_edge(1, 0, time=10, cost=10)
+    graph = nx.MultiDiGraph()
+    graph.add_edges_from(routes.edges(data=True))
+    model = Model()
+    model.processing_time = PROCESSING_TIME
+    model.paths = PathCache(graph)
+    model.plane_type_map = PlaneTypeMap({0: routes})
+    model.cargo_edges = CargoEdges()
+    ces = [
+        model.cargo_edges.create(cargo_id, 0, 1, 10 + PROCESSING_TIME, 0, 0, 100, 1, 1)
+        for cargo_id in range(3)
+    ]
+    plane = Plane("a_0", 0, 1, 0, 10, legs=[Leg.construct(ces)])
+    model.planning = Planning(model.cargo_edges, {plane.id: plane})
+    model.windows = TimeWindows(model.planning, PROCESSING_TIME)
+    model.search = LocalSearch(model.paths, model.plane_type_map)
+    return model
+
+
+def test_fork_plans_on_its_own_copies():
+    model = _model()
+    forked = model.fork()
+    forked.planning.remove_cargo_edge(forked.cargo_edges.get(0, 0))
+    forked.paths.set_unavailable_routes({(0, 1)})
+    assert model.planning.is_assigned(0, 0)
+    assert len(model.planning.planes["a_0"].legs[0].cargo_edges) == 3
+    assert model.paths.unavailable_routes == set()
+    assert model.paths.get_path(0, 1) == [0, 1]
+
+
+def test_replanned_model_drops_what_was_executed_or_missed_meanwhile():
+    model = _model()
+    replanner = BackgroundReplanner(model)
+    try:
+        replanner._assigned = model.planning.assigned_rows()
+        replanner._cargo_ids = model.cargo_edges.cargo_ids()
+        forked = model.fork()
+        # cargo 0 was delivered and cargo 1 missed while the worker was busy
+        model.planning.remove_cargo_edge(model.cargo_edges.get(0, 0))
+        model.planning.cancel_cargo({1})
+
+        replanner._reconcile(forked)
+        assert forked.planning.assigned() == {(2, 0)}
+        assert forked.cargo_edges.cargo_ids() == {0, 2}
+    finally:
+        replanner.close()
@@ -0,0 +1,38 @@
+import networkx as nx
+
+from solution.routing import NextHopTable
+
+
+def _graph(edges):
+    graph = nx.DiGraph()
+    for orig, dest, cost in edges:
+        graph.add_edge(orig, dest, cost=cost, time=cost)
+    return graph
+
+
+def test_first_hops_in_the_order_of_the_path_costs():
+    table = NextHopTable(_graph([(0, 1, 10), (1, 3, 10), (0, 2, 10), (2, 3, 30)]))
+    assert table.next_hops(0, 3) == [1, 2]
+    assert table.next_hop(0, 3, [2]) == 2
+    assert table.next_hop(0, 3, []) is None
+    assert (table.hits, table.misses) == (1, 1)
+
+
+def test_no_first_hop_whose_path_comes_back_through_the_origin():
+    # from 2 the cheapest path to 3 is back over 0 and the route 0 -> 1 that is down
+    table = NextHopTable(
+        _graph([(0, 1, 10), (1, 3, 10), (0, 2, 10), (2, 0, 1), (2, 4, 50), (4, 3, 50)])
+    )
+    assert table.next_hops(0, 3) == [1, 2]
+    assert table.next_hops(2, 3) == [0, 4]
+
+    # without the way around over 4 a plane at 0 can only reach 3 over 1
+    table = NextHopTable(_graph([(0, 1, 10), (1, 3, 10), (0, 2, 10), (2, 0, 1)]))
+    assert table.next_hops(0, 3) == [1]
+    assert table.next_hop(0, 3, [2]) is None
+
+
+def test_no_first_hops_for_unknown_airports_or_the_origin():
+    table = NextHopTable(_graph([(0, 1, 10), (1, 0, 10)]))
+    assert table.next_hops(0, 0) == []
+    assert table.next_hops(0, 5) == []
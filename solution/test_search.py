@@ -0,0 +1,79 @@
+import pytest
+
+from solution.common import CargoEdges, Leg, Plane, Planning
+from solution.search import LocalSearch
+from solution.test_evaluation import PROCESSING_TIME, _paths, _planning
+from solution.windows import TimeWindows
+
+
+def _planned(planning):
+    return sorted(
+        (ce.cargo_id, ce.sequence)
+        for plane in planning.planes.values()
+        for leg in plane.legs
+        for ce in leg.cargo_edges
+    )
+
+
+@pytest.mark.parametrize("seed", range(30))
+def test_cost_never_gets_worse(seed):
+    planning = _planning(seed)
+    windows = TimeWindows(planning, PROCESSING_TIME)
+    search = LocalSearch(_paths(), None)
+    planned = _planned(planning)
+    first_legs = {plane.id: plane.legs[:1] for plane in planning.planes.values()}
+    cost = search._evaluate(planning, windows, 0)
+
+    applied = search.run(planning, windows, 1.0, 0)
+
+    after = search._evaluate(planning, windows, 0)
+    if cost is None:
+        assert applied == 0
+    else:
+        assert after is not None and after <= cost
+        assert (after < cost) == (applied > 0)
+    assert _planned(planning) == planned
+    for plane in planning.planes.values():
+        assert plane.legs[:1] == first_legs[plane.id]
+
+
+def _two_planes():
+    # both planes fly their cargo 0 -> 1 and then another cargo 1 -> 2, the second
+    # legs can be merged
+    cargo_edges = CargoEdges()
+    planes = {}
+    for p in range(2):
+        first = cargo_edges.create(2 * p, 0, 1, 24, 0, 0, 1000, 1, 1)
+        second = cargo_edges.create(2 * p + 1, 1, 2, 24, 0, 0, 1000, 1, 1)
+        plane = Plane(f"a_{p}", 0, 0, 0, 2)
+        plane.legs = [Leg.construct([first]), Leg.construct([second])]
+        planes[plane.id] = plane
+    return Planning(cargo_edges, planes)
+
+
+def test_relocates_cargo_to_a_leg_on_the_same_edge():
+    planning = _two_planes()
+    windows = TimeWindows(planning, PROCESSING_TIME)
+
+    assert LocalSearch(_paths(), None).run(planning, windows, 1.0, 0) == 1
+    assert [len(plane.legs) for plane in planning.planes.values()] in ([2, 1], [1, 2])
+
+
+def test_moves_made_late_by_the_windows_are_undone(monkeypatch):
+    planning = _two_planes()
+    windows = TimeWindows(planning, PROCESSING_TIME)
+    propagate = TimeWindows.propagate
+
+    def late(self, changed, changes=None):
+        # the leg that took the cargo has to leave right away
+        infeasible = propagate(self, changed, changes)
+        for ce in changed.cargo_edges:
+            changes.append((ce, "lp", ce.lp))
+            ce.lp = 0
+        return infeasible
+
+    monkeypatch.setattr(TimeWindows, "propagate", late)
+    assert LocalSearch(_paths(), None).run(planning, windows, 1.0, 0) == 0
+    for plane in planning.planes.values():
+        assert [len(leg.cargo_edges) for leg in plane.legs] == [1, 1]
+        assert all(ce.lp == 1000 for leg in plane.legs for ce in leg.cargo_edges)
@@ -0,0 +1,151 @@
+from collections import namedtuple
+
+import networkx as nx
+import pytest
+
+pytest.importorskip("airlift")
+
+from solution.common import CargoEdges, Leg, PathCache, Plane, PlaneTypeMap, Planning
+from solution.strategic import Model
+from solution.windows import TimeWindows
+
+PROCESSING_TIME = 5
+
+Cargo = namedtuple(
+    "Cargo",
+    "id location destination weight earliest_pickup_time soft_deadline hard_deadline",
+)
+ScenarioInfo = namedtuple("ScenarioInfo", "processing_time")
+
+
+def _model(edges, ep=0):
+    # a plane at airport 0 with a leg 0 -> 1 for a cargo that goes on to airport 3
+    routes = nx.DiGraph()
+    for orig, dest, time in edges:
+        routes.add_edge(orig, dest, time=time, cost=time)
+    graph = nx.MultiDiGraph()
+    graph.add_edges_from(routes.edges(data=True))
+    model = Model()
+    model.processing_time = PROCESSING_TIME
+    model.paths = PathCache(graph)
+    model.plane_type_map = PlaneTypeMap({0: routes})
+    model.cargo_edges = CargoEdges()
+    first = model.cargo_edges.create(0, 0, 1, 10 + PROCESSING_TIME, 0, ep, 100, 1, 1)
+    model.cargo_edges.create(0, 1, 3, 10 + PROCESSING_TIME, 1, 20, 120, 1, 1)
+    plane = Plane("a_0", 0, 1, 0, 10, legs=[Leg.construct([first])])
+    model.planning = Planning(model.cargo_edges, {plane.id: plane})
+    model.windows = TimeWindows(model.planning, PROCESSING_TIME)
+    model.paths.set_unavailable_routes({(0, 1)})
+    return model, plane, routes
+
+
+def test_detour_keeps_the_latest_pickup_of_the_next_cargo_edge():
+    model, plane, routes = _model([(0, 1, 10), (0, 2, 10), (2, 1, 10), (1, 3, 10)])
+    assert model._detour(plane, plane.legs[0], routes, 0, 0)
+
+    hops = [model.cargo_edges.get(0, sequence) for sequence in range(3)]
+    assert [(ce.origin, ce.destination) for ce in hops] == [(0, 2), (2, 1), (1, 3)]
+    assert [(ce.ep, ce.lp) for ce in hops] == [(0, 80), (20, 100), (40, 120)]
+    assert [leg.cargo_edges for leg in plane.legs] == [hops[:1], hops[1:2]]
+
+
+def test_no_detour_that_can_not_make_the_next_cargo_edge():
+    model, plane, routes = _model(
+        [(0, 1, 10), (0, 2, 10), (2, 1, 10), (1, 3, 10)], ep=90
+    )
+    assert not model._detour(plane, plane.legs[0], routes, 0, 0)
+    assert model.cargo_edges.get(0, 1).origin == 1
+    assert len(plane.legs) == 1
+
+
+def test_no_detour_over_the_route_that_is_down():
+    model, plane, routes = _model([(0, 1, 10), (1, 3, 10)])
+    assert not model._detour(plane, plane.legs[0], routes, 0, 0)
+
+
+def _line(n_airports, down=()):
+    # airports 0 - 1 - ... in a line, with routes both ways
+    routes = nx.DiGraph()
+    for orig in range(n_airports - 1):
+        for edge in ((orig, orig + 1), (orig + 1, orig)):
+            routes.add_edge(
+                *edge, time=10, cost=10, route_available=edge not in down, mal=0
+            )
+    return routes
+
+
+def _obs(routes, airports, active_cargo, new_cargo=()):
+    # a plane of type 0 at each of the airports
+    global_state = {
+        "route_map": {0: routes},
+        "active_cargo": list(active_cargo) + list(new_cargo),
+        "event_new_cargo": list(new_cargo),
+        "scenario_info": [ScenarioInfo(PROCESSING_TIME)],
+    }
+    return {
+        f"a_{i}": {
+            "globalstate": global_state,
+            "plane_type": 0,
+            "current_airport": airport,
+            "cargo_at_current_airport": [],
+            "max_weight": 10,
+        }
+        for i, airport in enumerate(airports)
+    }
+
+
+def _cargo(cargo_id, location, destination, start=0):
+    return Cargo(cargo_id, location, destination, 1, start, start + 500, start + 1000)
+
+
+def test_new_cargo_cut_off_by_a_route_that_is_down_is_planned_on_the_full_map():
+    cargo = [_cargo(0, 1, 2)]
+    model = Model()
+    model.create_planning(_obs(_line(3), [0], cargo))
+
+    # the only route out of airport 0, where the plane and the new cargo are, is down
+    new_cargo = [_cargo(1, 0, 2, start=50)]
+    obs = _obs(_line(3, down={(0, 1)}), [0], cargo, new_cargo)
+    model.update_planning(obs, now=50)
+    assert model.paths.unavailable_routes == {(0, 1)}
+    assert [(ce.origin, ce.destination) for ce in model.cargo_edges.chain(1)] == [
+        (0, 1),
+        (1, 2),
+    ]
+    assert all(
+        model.planning.is_assigned(ce.cargo_id, ce.sequence)
+        for ce in model.cargo_edges.chain(1)
+    )
+
+
+def test_new_cargo_is_inserted_into_the_planning():
+    cargo = [_cargo(0, 0, 1), _cargo(1, 2, 3)]
+    model = Model()
+    planning = model.create_planning(_obs(_line(4), [0, 2], cargo))
+    legs = {plane.id: list(plane.legs) for plane in planning.planes.values()}
+
+    new_cargo = [_cargo(2, 1, 3, start=50)]
+    assert model.update_planning(_obs(_line(4), [0, 2], cargo, new_cargo)) is planning
+    for plane in planning.planes.values():
+        assert plane.legs[: len(legs[plane.id])] == legs[plane.id]
+    assert all(
+        planning.is_assigned(ce.cargo_id, ce.sequence)
+        for ce in model.cargo_edges.cargo_edges
+    )
+
+
+def test_cargo_edges_that_can_not_be_inserted_stay_unplanned():
+    cargo = [_cargo(0, 0, 1)]
+    model = Model()
+    planning = model.create_planning(_obs(_line(3), [0], cargo))
+
+    # due before the only plane can get there
+    late = _cargo(1, 1, 2, start=50)._replace(soft_deadline=55)
+    obs = _obs(_line(3), [0], cargo, [late])
+    assert model.update_planning(obs) is planning
+    assert planning.is_assigned(0, 1)
+    assert not any(
+        planning.is_assigned(1, ce.sequence) for ce in model.cargo_edges.chain(1)
+    )
+
+    assert model.update_planning(obs, full_rebuild=True) is not planning
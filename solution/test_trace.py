@@ -0,0 +1,65 @@
+from solution.trace import INFO, WARNING, Trace
+
+
+def _messages(trace):
+    return [message % args for _, _, message, args in trace._buffer]
+
+
+def test_keeps_the_latest_records():
+    trace = Trace(capacity=3)
+    trace.configure(echo_level=100)
+    for i in range(5):
+        trace.info("record %s", i)
+    assert _messages(trace) == ["record 2", "record 3", "record 4"]
+
+    trace.configure(capacity=2)
+    assert _messages(trace) == ["record 3", "record 4"]
+
+
+def test_drops_records_below_the_level():
+    trace = Trace()
+    trace.configure(level=WARNING, echo_level=100)
+    trace.info("dropped")
+    trace.warning("kept")
+    assert _messages(trace) == ["kept"]
+
+
+def test_echoes_from_the_echo_level(capsys):
+    trace = Trace()
+    trace.configure(level=INFO, echo_level=WARNING)
+    trace.time = 7
+    trace.info("quiet")
+    trace.warning("loud %s", 1)
+    assert capsys.readouterr().out == "[7] WARNING: loud 1\n"
+
+
+def test_mutable_arguments_show_their_state_when_logged():
+    trace = Trace()
+    trace.configure(echo_level=100)
+    cargo_ids = {1}
+    trace.info("carrying %s, %r", cargo_ids, [cargo_ids])
+    cargo_ids.add(2)
+    assert _messages(trace) == ["carrying {1}, [{1}]"]
+
+
+def test_immutable_arguments_are_kept_as_they_are():
+    trace = Trace()
+    trace.configure(echo_level=100)
+    cargo_ids = (1, 2)
+    trace.info("loading %s on %s", cargo_ids, "a_0")
+    _, _, _, args = trace._buffer[-1]
+    assert args[0] is cargo_ids
+    assert _messages(trace) == ["loading (1, 2) on a_0"]
+
+
+def test_writes_records_to_a_file(tmp_path):
+    trace = Trace()
+    trace.configure(echo_level=100)
+    path = tmp_path / "trace.tsv"
+    trace.open(str(path))
+    legs = [1]
+    trace.time = 3
+    trace.info("legs %s", legs)
+    legs.append(2)
+    trace.close()
+    assert path.read_text() == f"3\t{INFO}\tlegs [1]\n"
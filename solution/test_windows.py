@@ -0,0 +1,102 @@
+from solution.common import CargoEdges, Leg, Plane, Planning
+from solution.windows import TimeWindows
+
+PROCESSING_TIME = 10
+
+
+def _chain(cargo_edges, cargo_id, windows, duration=20):
+    # cargo edges 0 -> 1 -> 2 ... of one cargo with the given (ep, lp) windows
+    return [
+        cargo_edges.create(cargo_id, i, i + 1, duration, i, ep, lp, 1, 1)
+        for i, (ep, lp) in enumerate(windows)
+    ]
+
+
+def _planning(cargo_edges, *legs):
+    planes = {
+        f"a_{i}": Plane(
+            f"a_{i}", 0, 0, 0, 10, legs=[Leg.construct(ces) for ces in plan]
+        )
+        for i, plan in enumerate(legs)
+    }
+    return Planning(cargo_edges, planes)
+
+
+def test_pushes_windows_along_the_cargo():
+    cargo_edges = CargoEdges()
+    first, second, third = _chain(cargo_edges, 0, [(0, 100), (0, 200), (0, 300)])
+    windows = TimeWindows(_planning(cargo_edges), PROCESSING_TIME)
+
+    first.ep = 50
+    assert windows.propagate(first) == []
+    assert (second.ep, third.ep) == (80, 110)
+
+    third.lp = 150
+    assert windows.propagate(third) == []
+    assert (first.lp, second.lp) == (90, 120)
+
+
+def test_stops_where_windows_do_not_change():
+    cargo_edges = CargoEdges()
+    first, second, third = _chain(cargo_edges, 0, [(0, 100), (200, 300), (250, 400)])
+    other = _chain(cargo_edges, 1, [(0, 100)])[0]
+    windows = TimeWindows(_planning(cargo_edges), PROCESSING_TIME)
+
+    first.ep = 50
+    changes = []
+    assert windows.propagate(first, changes) == []
+    assert changes == []
+    assert (second.ep, third.ep, other.ep) == (200, 250, 0)
+
+
+def test_reports_and_undoes_infeasible_windows():
+    cargo_edges = CargoEdges()
+    first, second = _chain(cargo_edges, 0, [(0, 100), (0, 60)])
+    windows = TimeWindows(_planning(cargo_edges), PROCESSING_TIME)
+
+    first.ep = 40
+    changes = []
+    assert windows.propagate(first, changes) == [second]
+    assert second.ep == 70
+
+    windows.undo(changes)
+    assert second.ep == 0
+
+
+def test_cargo_edges_of_a_leg_depart_together():
+    cargo_edges = CargoEdges()
+    a_first, a_second = _chain(cargo_edges, 0, [(0, 100), (0, 200)])
+    b_first, b_second = _chain(cargo_edges, 1, [(0, 100), (0, 200)])
+    planning = _planning(cargo_edges, [[a_first], [a_second, b_second]])
+    windows = TimeWindows(planning, PROCESSING_TIME)
+
+    a_first.ep = 40
+    planning.find(0, 0)[1].ep = 40
+    assert windows.propagate(a_first) == []
+    # the leg waits for cargo 0, so cargo 1 departs as late
+    assert windows.ep(b_second) == 70
+    assert b_first.ep == 0
+
+
+def test_legs_waiting_on_each_other_are_infeasible():
+    cargo_edges = CargoEdges()
+    a_first, a_second = _chain(cargo_edges, 0, [(0, 1000), (0, 1000)])
+    b_first, b_second = _chain(cargo_edges, 1, [(0, 1000), (0, 1000)])
+    # each leg carries the second cargo edge of the cargo the other leg flies first
+    planning = _planning(cargo_edges, [[a_first, b_second]], [[b_first, a_second]])
+    windows = TimeWindows(planning, PROCESSING_TIME)
+
+    infeasible = {ce.row for ce in windows.propagate(a_first)}
+    assert infeasible >= {a_first.row, b_second.row}
+
+
+def test_relax_reports_only_its_own_changes():
+    cargo_edges = CargoEdges()
+    first, second = _chain(cargo_edges, 0, [(0, 30), (50, 60)])
+    windows = TimeWindows(_planning(cargo_edges), PROCESSING_TIME)
+
+    # the last change in the shared list is an earlier one of the same cargo edge
+    changes = [(second, "ep", 40)]
+    assert not windows._relax_ep(second, changes)
+    assert not windows._relax_lp(first, [(first, "lp", 200)])
+    assert len(changes) == 1
@@ -0,0 +1,139 @@
+from __future__ import annotations
+
+import atexit
+import sys
+import threading
+from collections import deque
+from numbers import Number
+from queue import SimpleQueue
+from typing import Deque, Optional, TextIO, Tuple
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+
+LEVEL_NAMES = {DEBUG: "DEBUG", INFO: "INFO", WARNING: "WARNING", ERROR: "ERROR"}
+
+# (step, level, message, arguments), the message is only formatted when it is read
+Record = Tuple[int, int, str, tuple]
+
+# arguments of these types are kept as they are, others are formatted when logged
+IMMUTABLE = (Number, str, bytes, type(None), range)
+
+
+class Trace:
+    # recent decisions of the solution in a ring buffer, printed from echo_level on
+    # and optionally written to a file by a background thread
+    def __init__(self, capacity: int = 1000) -> None:
+        # records below this level are dropped right away
+        self.level = INFO
+        self.echo_level = WARNING
+        # step of the episode, set by the solution
+        self.time = 0
+        self._buffer: Deque[Record] = deque(maxlen=capacity)
+        self._queue: Optional[SimpleQueue] = None
+        self._writer: Optional[threading.Thread] = None
+        atexit.register(self.close)
+
+    def configure(
+        self,
+        level: Optional[int] = None,
+        echo_level: Optional[int] = None,
+        capacity: Optional[int] = None,
+    ) -> None:
+        if level is not None:
+            self.level = level
+        if echo_level is not None:
+            self.echo_level = echo_level
+        if capacity is not None:
+            self._buffer = deque(self._buffer, maxlen=capacity)
+
+    def log(self, level: int, message: str, *args) -> None:
+        # message uses % formatting with args, like the logging module
+        if level < self.level:
+            return
+        record = (self.time, level, message, tuple(_snapshot(arg) for arg in args))
+        self._buffer.append(record)
+        if self._queue is not None:
+            self._queue.put(record)
+        if level >= self.echo_level:
+            print(format_record(record))
+
+    def debug(self, message: str, *args) -> None:
+        self.log(DEBUG, message, *args)
+
+    def info(self, message: str, *args) -> None:
+        self.log(INFO, message, *args)
+
+    def warning(self, message: str, *args) -> None:
+        self.log(WARNING, message, *args)
+
+    def error(self, message: str, *args) -> None:
+        self.log(ERROR, message, *args)
+
+    def dump(self, file: Optional[TextIO] = None) -> None:
+        file = file or sys.stdout
+        for record in self._buffer:
+            print(format_record(record), file=file)
+
+    def clear(self) -> None:
+        self._buffer.clear()
+
+    def open(self, path: str) -> None:
+        # write all records from now on to path, one tab separated line each
+        self.close()
+        self._queue = SimpleQueue()
+        self._writer = threading.Thread(
+            target=_write_records, args=(self._queue, path), daemon=True
+        )
+        self._writer.start()
+
+    def close(self) -> None:
+        if self._queue is not None:
+            self._queue.put(None)
+            self._writer.join()
+            self._queue = None
+            self._writer = None
+
+
+class _Formatted:
+    # an argument formatted when it was logged, the objects it shows may change or
+    # be used by the solution thread while the record is written, %r shows it as %s
+    __slots__ = ("_text",)
+
+    def __init__(self, arg) -> None:
+        self._text = str(arg)
+
+    def __str__(self) -> str:
+        return self._text
+
+    __repr__ = __str__
+
+
+def _snapshot(arg):
+    if isinstance(arg, IMMUTABLE):
+        return arg
+    if isinstance(arg, (tuple, frozenset)) and all(
+        isinstance(item, IMMUTABLE) for item in arg
+    ):
+        return arg
+    return _Formatted(arg)
+
+
+def format_record(record: Record) -> str:
+    time, level, message, args = record
+    return f"[{time}] {LEVEL_NAMES[level]}: {message % args if args else message}"
+
+
+def _write_records(queue: SimpleQueue, path: str) -> None:
+    with open(path, "w") as file:
+        while True:
+            record = queue.get()
+            if record is None:
+                break
+            time, level, message, args = record
+            file.write(f"{time}\t{level}\t{message % args if args else message}\n")
+
+
+trace = Trace()
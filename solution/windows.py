@@ -0,0 +1,159 @@
+from __future__ import annotations
+
+from collections import deque
+from typing import Dict, Hashable, List, Optional, Tuple, Union
+
+from solution.common import CargoEdge, Leg, Planning
+
+# a leg for planned cargo edges (they depart together), the cargo edge itself otherwise
+Unit = Union[Leg, CargoEdge]
+# a leg or cargo edge, "ep" or "lp" and the value before propagate changed it
+Change = Tuple[Unit, str, int]
+
+
+class TimeWindows:
+    # simple temporal network over the cargo edges of a planning: a cargo edge departs
+    # at least its duration plus the processing time after the previous cargo edge of
+    # the same cargo, and the cargo edges of a leg depart together
+    def __init__(self, planning: Planning, processing_time: int) -> None:
+        self.planning = planning
+        self.processing_time = processing_time
+
+    def ep(self, ce: CargoEdge) -> int:
+        return self._unit(ce).ep
+
+    def lp(self, ce: CargoEdge) -> int:
+        return self._unit(ce).lp
+
+    def slack(self, ce: CargoEdge) -> int:
+        unit = self._unit(ce)
+        return unit.lp - unit.ep
+
+    def propagate(
+        self, changed: Unit, changes: Optional[List[Change]] = None
+    ) -> List[CargoEdge]:
+        # push a changed window of a cargo edge or leg to the cargo edges before and
+        # after it, as far as windows change, returns the touched cargo edges that ended
+        # up infeasible, the old windows are appended to changes to undo them
+        start = self._unit(changed) if isinstance(changed, CargoEdge) else changed
+        if changes is None:
+            changes = []
+        first = len(changes)
+        infeasible: Dict[Hashable, Unit] = {}
+        for neighbours, relax in (
+            (self._successors, self._relax_ep),
+            (self._predecessors, self._relax_lp),
+        ):
+            # how often each reached unit was taken from the queue, without cycles a
+            # unit is taken at most once per edge of the longest path to it
+            taken: Dict[Hashable, int] = {}
+            queue = deque([start])
+            queued = {_key(start)}
+            while len(queue) > 0:
+                unit = queue.popleft()
+                key = _key(unit)
+                queued.discard(key)
+                taken[key] = taken.get(key, 0) + 1
+                if taken[key] > len(taken):
+                    # the window keeps changing along a cycle of cargo edges
+                    infeasible[key] = unit
+                    continue
+                for neighbour in neighbours(unit):
+                    key = _key(neighbour)
+                    if key in infeasible or not relax(neighbour, changes):
+                        continue
+                    if key not in queued:
+                        queue.append(neighbour)
+                        queued.add(key)
+        touched = {_key(start): start}
+        touched.update((_key(unit), unit) for unit, _, _ in changes[first:])
+        for key, unit in touched.items():
+            if unit.ep > unit.lp:
+                infeasible[key] = unit
+        members = {}
+        for unit in infeasible.values():
+            for ce in self._members(
+                self._unit(unit) if isinstance(unit, CargoEdge) else unit
+            ):
+                members[ce.row] = ce
+        return list(members.values())
+
+    @staticmethod
+    def undo(changes: List[Change]) -> None:
+        # restore the windows that propagate changed
+        for obj, name, value in reversed(changes):
+            setattr(obj, name, value)
+
+    def _relax_ep(self, unit: Unit, changes: List[Change]) -> bool:
+        # returns whether the window of the unit changed
+        before = len(changes)
+        for ce in self._members(unit):
+            pred = self._predecessor(ce)
+            if pred is not None:
+                _set(
+                    ce, "ep", max(ce.ep, self._unit(pred).ep + self._gap(pred)), changes
+                )
+        if isinstance(unit, Leg):
+            return _set(
+                unit, "ep", max(unit.ep, max(ce.ep for ce in unit.cargo_edges)), changes
+            )
+        return len(changes) > before
+
+    def _relax_lp(self, unit: Unit, changes: List[Change]) -> bool:
+        before = len(changes)
+        for ce in self._members(unit):
+            succ = self._successor(ce)
+            if succ is not None:
+                _set(ce, "lp", min(ce.lp, self._unit(succ).lp - self._gap(ce)), changes)
+        if isinstance(unit, Leg):
+            return _set(
+                unit, "lp", min(unit.lp, min(ce.lp for ce in unit.cargo_edges)), changes
+            )
+        return len(changes) > before
+
+    def _successors(self, unit: Unit) -> List[Unit]:
+        units = []
+        for ce in self._members(unit):
+            succ = self._successor(ce)
+            if succ is not None:
+                units.append(self._unit(succ))
+        return units
+
+    def _predecessors(self, unit: Unit) -> List[Unit]:
+        units = []
+        for ce in self._members(unit):
+            pred = self._predecessor(ce)
+            if pred is not None:
+                units.append(self._unit(pred))
+        return units
+
+    def _unit(self, ce: CargoEdge) -> Unit:
+        found = self.planning.find(ce.cargo_id, ce.sequence)
+        return found[1] if found is not None else ce
+
+    @staticmethod
+    def _members(unit: Unit) -> List[CargoEdge]:
+        return unit.cargo_edges if isinstance(unit, Leg) else [unit]
+
+    def _gap(self, ce: CargoEdge) -> int:
+        return ce.duration + self.processing_time
+
+    def _successor(self, ce: CargoEdge) -> Optional[CargoEdge]:
+        return self.planning.cargo_edges.get(ce.cargo_id, ce.sequence + 1)
+
+    def _predecessor(self, ce: CargoEdge) -> Optional[CargoEdge]:
+        return self.planning.cargo_edges.get(ce.cargo_id, ce.sequence - 1)
+
+
+def _set(unit: Unit, name: str, value: int, changes: List[Change]) -> bool:
+    old = getattr(unit, name)
+    if value == old:
+        return False
+    changes.append((unit, name, old))
+    setattr(unit, name, value)
+    return True
+
+
+def _key(unit: Unit) -> Hashable:
+    # cargo edges are views, the row identifies them
+    return ("row", unit.row) if isinstance(unit, CargoEdge) else id(unit)